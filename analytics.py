@@ -0,0 +1,253 @@
+"""Per-level difficulty analytics over game_progress, computed with NumPy.
+
+For every (data_structure, level_id) the level_stats table holds:
+
+  * players (rows in game_progress), completions and completion_rate
+  * attempts: mean, p50/p90/p99 and counts in ATTEMPT_BUCKETS
+  * best_moves of completed rows: p50/p90, and moves_at_limit, the share
+    of completions that needed the level's whole maxMoves (a high share
+    means maxMoves is tight, a p90 far below it that it is loose)
+  * best_time of completed rows, in seconds: p50/p90/p99
+  * drop_off: the share of players who reached this level but not the
+    next one, i.e. the funnel across level ids
+
+GET /api/levels/<ds>/stats serves it from that table. It is rebuilt at most
+once per LEVEL_STATS_INTERVAL seconds (default 300; 0 turns it off) by a
+background thread in whichever worker first claims it, or on demand with
+`python analytics.py`.
+
+A rebuild reads each shard in rowid ranges of ANALYTICS_CHUNK_SIZE rows,
+inside one read transaction. SQLite packs each row into a single integer
+and returns a range as one group_concat string, which NumPy parses into an
+array, unpacks column by column and adds into per-level histograms with
+bincount. So memory is one chunk plus the histograms (a few MiB) however
+large the table, and Python never touches a row. Percentiles come from the
+histograms, so they are exact up to MAX_ATTEMPTS, MAX_MOVES and MAX_TIME;
+larger values count as that maximum.
+"""
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from database import PeriodicClaim
+from level_catalog import catalog
+from shards import router
+
+ANALYTICS_CHUNK_SIZE = int(os.environ.get('ANALYTICS_CHUNK_SIZE', 200000))
+LEVEL_STATS_INTERVAL = float(os.environ.get('LEVEL_STATS_INTERVAL', 300))
+
+# Histogram widths: one bin per value, the last also holds everything above
+MAX_ATTEMPTS = 1024
+MAX_MOVES = 1024
+MAX_TIME = 4096
+
+# (first attempts count, label); bucket '1' also holds rows with 0 attempts
+ATTEMPT_BUCKETS = ((0, '1'), (2, '2'), (3, '3'), (4, '4-5'), (6, '6-10'), (11, '11-20'), (21, '21+'))
+
+COLUMNS = ('data_structure', 'level_id', 'players', 'completions', 'completion_rate',
+           'attempts_mean', 'attempts_p50', 'attempts_p90', 'attempts_p99', 'attempt_buckets',
+           'moves_p50', 'moves_p90', 'moves_at_limit', 'time_p50', 'time_p90', 'time_p99', 'drop_off')
+
+log = logging.getLogger('analytics')
+
+
+def _clamp(column, size):
+    return f'MIN(MAX({column}, 0), {size - 1})'
+
+
+def _percentiles(hist, qs):
+    # Nearest-rank percentiles per row of a (groups, values) histogram;
+    # -1 where a row is empty
+    counts = hist.sum(axis=1)
+    cumulative = hist.cumsum(axis=1)
+    result = []
+    for q in qs:
+        target = np.maximum(np.ceil(counts * q), 1)
+        result.append(np.where(counts > 0, (cumulative < target[:, None]).sum(axis=1), -1))
+    return result
+
+
+class Histograms:
+    def __init__(self, groups):
+        self.groups = groups
+        self.completions = np.zeros(groups, dtype=np.int64)
+        self.attempts = np.zeros((groups, MAX_ATTEMPTS), dtype=np.int64)
+        self.moves = np.zeros((groups, MAX_MOVES), dtype=np.int64)
+        self.time = np.zeros((groups, MAX_TIME), dtype=np.int64)
+
+    def add(self, packed):
+        # packed: int64 array of rows as packed by LevelStats.query
+        packed, time_taken = np.divmod(packed, MAX_TIME)
+        packed, moves = np.divmod(packed, MAX_MOVES)
+        packed, attempts = np.divmod(packed, MAX_ATTEMPTS)
+        group, completed = np.divmod(packed, 2)
+        completed = completed.astype(bool)
+        self.completions += np.bincount(group[completed], minlength=self.groups)
+        self.attempts += self._count(group, attempts, MAX_ATTEMPTS)
+        # Times and move counts of 0 were not recorded
+        recorded = completed & (moves > 0)
+        self.moves += self._count(group[recorded], moves[recorded], MAX_MOVES)
+        recorded = completed & (time_taken > 0)
+        self.time += self._count(group[recorded], time_taken[recorded], MAX_TIME)
+
+    def _count(self, group, values, width):
+        return np.bincount(group * width + values, minlength=self.groups * width).reshape(self.groups, width)
+
+
+class LevelStats:
+    def __init__(self, router=router, catalog=catalog, chunk_size=ANALYTICS_CHUNK_SIZE,
+                 interval=LEVEL_STATS_INTERVAL):
+        self.router = router
+        self.catalog = catalog
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.data_structures = catalog.data_structures
+        # Group of (ds, level_id) = ds index * span + level_id
+        self.span = 1 + max(level['id'] for levels in catalog.levels.values() for level in levels)
+        self.periodic = PeriodicClaim('level_stats_refresh', 'level-stats')
+
+        ds_code = ' '.join(f"WHEN '{ds}' THEN {n}" for n, ds in enumerate(self.data_structures))
+        packed = f'(CASE data_structure {ds_code} END * {self.span} + level_id) * 2 + (completed != 0)'
+        for column, size in (('attempts', MAX_ATTEMPTS), ('best_moves', MAX_MOVES), ('best_time', MAX_TIME)):
+            packed = f'({packed}) * {size} + {_clamp(column, size)}'
+        # Rows of data structures or levels not in the catalog pack to NULL,
+        # which group_concat skips. Nothing validates the stored values, so
+        # they are clamped, and a fractional time is truncated by the CAST.
+        self.query = f'''
+            SELECT group_concat(CASE WHEN level_id BETWEEN 0 AND {self.span - 1} THEN CAST({packed} AS INTEGER) END)
+            FROM game_progress WHERE id > ? AND id <= ?
+        '''
+
+    # Rebuilding
+
+    def compute(self):
+        # Histograms over every shard, then one row per catalog level
+        hist = Histograms(len(self.data_structures) * self.span)
+        for shard in self.router.shards:
+            self._scan(shard.pool, hist)
+        return self._rows(hist)
+
+    def _scan(self, pool, hist):
+        with pool.connection() as conn:
+            # One snapshot for all the chunks
+            conn.execute('BEGIN')
+            try:
+                low, high = conn.execute('SELECT MIN(id), MAX(id) FROM game_progress').fetchone()
+                if low is None:
+                    return
+                for start in range(low - 1, high, self.chunk_size):
+                    text = conn.execute(self.query, (start, start + self.chunk_size)).fetchone()[0]
+                    if text:
+                        hist.add(np.fromstring(text, dtype=np.int64, sep=','))
+            finally:
+                conn.execute('COMMIT')
+
+    def _rows(self, hist):
+        players = hist.attempts.sum(axis=1)
+        attempts_total = hist.attempts @ np.arange(MAX_ATTEMPTS)
+        attempts_p50, attempts_p90, attempts_p99 = _percentiles(hist.attempts, (0.5, 0.9, 0.99))
+        buckets = np.add.reduceat(hist.attempts, [start for start, _ in ATTEMPT_BUCKETS], axis=1)
+        moves_p50, moves_p90 = _percentiles(hist.moves, (0.5, 0.9))
+        time_p50, time_p90, time_p99 = _percentiles(hist.time, (0.5, 0.9, 0.99))
+        moves_cumulative = hist.moves.cumsum(axis=1)
+        moves_recorded = hist.moves.sum(axis=1)
+
+        def value(array, group):
+            return None if array[group] < 0 else int(array[group])
+
+        rows = []
+        for n, ds in enumerate(self.data_structures):
+            levels = sorted(self.catalog.levels[ds], key=lambda level: level['id'])
+            for index, level in enumerate(levels):
+                group = n * self.span + level['id']
+                count = int(players[group])
+                completions = int(hist.completions[group])
+                drop_off = None
+                if index + 1 < len(levels) and count:
+                    reached_next = int(players[n * self.span + levels[index + 1]['id']])
+                    drop_off = max(0.0, 1 - reached_next / count)
+                moves_at_limit = None
+                max_moves = level.get('maxMoves')
+                if max_moves and moves_recorded[group]:
+                    # Completions in fewer than max_moves moves
+                    below = int(moves_cumulative[group, min(max_moves, MAX_MOVES) - 1])
+                    moves_at_limit = 1 - below / int(moves_recorded[group])
+                rows.append((
+                    ds, level['id'], count, completions, completions / count if count else None,
+                    int(attempts_total[group]) / count if count else None,
+                    value(attempts_p50, group), value(attempts_p90, group), value(attempts_p99, group),
+                    json.dumps({label: int(c) for (_, label), c in zip(ATTEMPT_BUCKETS, buckets[group])},
+                               separators=(',', ':')),
+                    value(moves_p50, group), value(moves_p90, group), moves_at_limit,
+                    value(time_p50, group), value(time_p90, group), value(time_p99, group),
+                    drop_off,
+                ))
+        return rows
+
+    def refresh(self):
+        started = time.perf_counter()
+        rows = self.compute()
+        with self.router.directory.transaction() as conn:
+            conn.execute('DELETE FROM level_stats')
+            conn.executemany(
+                f'INSERT INTO level_stats ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})', rows)
+        return time.perf_counter() - started
+
+    # Periodic refresh
+
+    def refresh_if_due(self):
+        # Called on requests; starts a background refresh in this worker if
+        # LEVEL_STATS_INTERVAL has passed since any worker last claimed one
+        return self.periodic.start_if_due(self.router.directory, self.interval, self._background_refresh)
+
+    def _background_refresh(self):
+        try:
+            log.info('level_stats refreshed in %.1f s', self.refresh())
+        except Exception:
+            log.exception('level_stats refresh failed')
+
+    # Reading
+
+    def load(self, conn, data_structure):
+        # (levels in id order, time of the refresh) from level_stats
+        cursor = conn.execute(
+            f'SELECT {", ".join(COLUMNS)}, refreshed_at FROM level_stats WHERE data_structure = ? ORDER BY level_id',
+            (data_structure,))
+        levels, refreshed_at = [], None
+        for row in cursor:
+            catalog_level = self.catalog.level(data_structure, row['level_id']) or {}
+            refreshed_at = row['refreshed_at']
+            levels.append({
+                'level_id': row['level_id'],
+                'name': catalog_level.get('name'),
+                'max_moves': catalog_level.get('maxMoves'),
+                'players': row['players'],
+                'completions': row['completions'],
+                'completion_rate': row['completion_rate'],
+                'attempts': {
+                    'mean': row['attempts_mean'],
+                    'p50': row['attempts_p50'],
+                    'p90': row['attempts_p90'],
+                    'p99': row['attempts_p99'],
+                    'distribution': json.loads(row['attempt_buckets']),
+                },
+                'moves': {'p50': row['moves_p50'], 'p90': row['moves_p90'], 'at_limit': row['moves_at_limit']},
+                'time': {'p50': row['time_p50'], 'p90': row['time_p90'], 'p99': row['time_p99']},
+                'drop_off': row['drop_off'],
+            })
+        return levels, refreshed_at
+
+
+level_stats = LevelStats()
+
+
+def main():
+    import app  # noqa: F401  creates the schema
+    print(f'level_stats refreshed in {level_stats.refresh():.1f} s')
+
+
+if __name__ == '__main__':
+    main()
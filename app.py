@@ -1,30 +1,63 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import sqlite3
-import hashlib
+import hmac
+import json
 import uuid
+from contextlib import ExitStack
+from functools import wraps
 from datetime import datetime
 import os
 
+import history
+import metrics
+from analytics import level_stats
+from migrations import migrate
+from passwords import UNKNOWN_USER_HASH, PasswordQueueFull, hasher
+from progress import MAX_BATCH_SIZE, parse_verified, record_attempt, record_attempts, score_deltas
+from replay import InvalidReplay
+from response_cache import response_cache
+from leaderboard import DATA_STRUCTURES, GLOBAL, LEADERBOARD_SIZE, merge_top
+from leaderboard import SCHEMA as LEADERBOARD_SCHEMA
+from rank_index import neighbours_across, percentile_across, rank_across
+from level_catalog import catalog
+from export import EXPORTS, ndjson, parse_since
+from generator import DIFFICULTIES, MAX_SAMPLE, generated_pool
+from sessions import sessions
+from shards import router
+from solver import Unsolvable, next_move
+from write_behind import normalize as normalize_buffered, progress_buffer
+
+# Exports and metrics answer only requests that send this key as a
+# Bearer token; with no key set they are disabled
+OPERATOR_KEY = os.environ.get('OPERATOR_KEY', '')
+
 app = Flask(__name__)
 CORS(app)
+if metrics.METRICS_ENABLED:
+    metrics.init_app(app)
 
 
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('game_database.db')
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    with router.directory.transaction() as conn:
+        _create_schema(conn.cursor())
+    for shard in router.shards:
+        if shard.pool is not router.directory:
+            with shard.pool.transaction() as conn:
+                _create_schema(conn.cursor(), users=False)
+
+def _create_schema(cursor, users=True):
+    # Users table; shard files read it from the attached directory database
+    if users:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     
     # Game progress table
     cursor.execute('''
@@ -59,17 +92,50 @@ def init_db():
         )
     ''')
     
-    conn.commit()
-    conn.close()
+    # Shared version counter for the in-memory leaderboards
+    for statement in LEADERBOARD_SCHEMA:
+        cursor.execute(statement)
+    
+    # Indexes and later schema changes
+    migrate(cursor)
 
 # Utility functions
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+def require_session(view):
+    # Runs view with g.session set from the Bearer token, or answers 401
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return _unauthorized('Missing session token')
+        if sessions.refresh_due():
+            with router.directory.connection() as conn:
+                sessions.refresh(conn)
+        session = sessions.validate(token.strip())
+        if session is None:
+            return _unauthorized('Invalid or expired session token')
+        g.session = session
+        return view(*args, **kwargs)
+    return wrapper
+
+def require_operator(view):
+    # Runs view only for requests carrying OPERATOR_KEY, or answers 401/403
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not OPERATOR_KEY:
+            return jsonify({'error': 'Operator endpoints are disabled'}), 403
+        scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(key.strip().encode(), OPERATOR_KEY.encode()):
+            return _unauthorized('Invalid operator key')
+        return view(*args, **kwargs)
+    return wrapper
 
-def get_db_connection():
-    conn = sqlite3.connect('game_database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+def _unauthorized(message):
+    response = jsonify({'error': message})
+    response.headers['WWW-Authenticate'] = 'Bearer'
+    return response, 401
+
+def _hashing_busy(e):
+    return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
 
 # User authentication routes
 @app.route('/api/register', methods=['POST'])
@@ -89,34 +155,45 @@ def register():
         if len(password) < 6:
             return jsonify({'error': 'Password must be at least 6 characters'}), 400
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if user already exists
-        cursor.execute('SELECT id FROM users WHERE username = ? OR email = ?', (username, email))
-        existing_user = cursor.fetchone()
-        
-        if existing_user:
-            conn.close()
-            return jsonify({'error': 'Username or email already exists'}), 409
-        
-        # Create new user
-        password_hash = hash_password(password)
-        cursor.execute(
-            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
-            (username, email, password_hash)
-        )
-        
-        user_id = cursor.lastrowid
+        password_hash = hasher.hash(password)
         
-        # Initialize user stats
-        cursor.execute(
-            'INSERT INTO user_stats (user_id) VALUES (?)',
-            (user_id,)
-        )
-        
-        conn.commit()
-        conn.close()
+        with router.directory.transaction() as conn:
+            cursor = conn.cursor()
+            
+            # Check if user already exists
+            cursor.execute('SELECT id FROM users WHERE username = ? OR email = ?', (username, email))
+            existing_user = cursor.fetchone()
+            
+            if existing_user:
+                return jsonify({'error': 'Username or email already exists'}), 409
+            
+            # Create new user
+            cursor.execute(
+                'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                (username, email, password_hash)
+            )
+            
+            user_id = cursor.lastrowid
+            
+            if not router.sharded:
+                # Single file: stats go in the same transaction
+                ranking_changes = _init_user_stats(router.shards[0], cursor, user_id)
+        
+        shard = router.for_user(user_id)
+        if router.sharded:
+            # Two files, two commits: undo the user if the stats row fails
+            try:
+                with shard.pool.transaction() as conn:
+                    ranking_changes = _init_user_stats(shard, conn.cursor(), user_id)
+            except Exception:
+                with router.directory.transaction() as conn:
+                    conn.execute('DELETE FROM users WHERE id = ?', (user_id,))
+                raise
+        
+        shard.leaderboard.apply(ranking_changes)
+        shard.rank_index.apply(ranking_changes[0], [(None, 0)])
+        
+        token, session = sessions.issue(user_id, username, email)
         
         return jsonify({
             'message': 'User registered successfully',
@@ -124,13 +201,24 @@ def register():
                 'id': user_id,
                 'username': username,
                 'email': email
-            }
+            },
+            'token': token,
+            'expires_at': session.expires
         }), 201
         
+    except PasswordQueueFull as e:
+        return _hashing_busy(e)
     except Exception as e:
         print(f"Registration error: {str(e)}")
         return jsonify({'error': 'Registration failed. Please try again.'}), 500
 
+def _init_user_stats(shard, cursor, user_id):
+    cursor.execute(
+        'INSERT INTO user_stats (user_id) VALUES (?)',
+        (user_id,)
+    )
+    return shard.leaderboard.collect(cursor, [(user_id, None)])
+
 @app.route('/api/login', methods=['POST'])
 def login():
     try:
@@ -141,370 +229,488 @@ def login():
         if not username or not password:
             return jsonify({'error': 'Missing username or password'}), 400
         
-        password_hash = hash_password(password)
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'SELECT id, username, email FROM users WHERE username = ? AND password_hash = ?',
-            (username, password_hash)
-        )
-        
-        user = cursor.fetchone()
-        conn.close()
-        
-        if user:
+        with router.directory.connection() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(
+                'SELECT id, username, email, password_hash FROM users WHERE username = ?',
+                (username,)
+            )
+            
+            user = cursor.fetchone()
+        
+        # Unknown usernames cost a hash too, so timing does not reveal them
+        valid, new_hash = hasher.verify(password, user['password_hash'] if user else UNKNOWN_USER_HASH)
+        
+        if user and valid:
+            if new_hash:
+                # Legacy SHA-256 or outdated scrypt cost; skipped if the
+                # password changed meanwhile
+                with router.directory.transaction() as conn:
+                    conn.execute(
+                        'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                        (new_hash, user['id'], user['password_hash'])
+                    )
+            
+            token, session = sessions.issue(user['id'], user['username'], user['email'])
             return jsonify({
                 'message': 'Login successful',
                 'user': {
                     'id': user['id'],
                     'username': user['username'],
                     'email': user['email']
-                }
+                },
+                'token': token,
+                'expires_at': session.expires
             }), 200
         else:
             return jsonify({'error': 'Invalid username or password'}), 401
             
+    except PasswordQueueFull as e:
+        return _hashing_busy(e)
     except Exception as e:
         print(f"Login error: {str(e)}")
         return jsonify({'error': 'Login failed. Please try again.'}), 500
 
-# Game progress routes
-@app.route('/api/progress/<int:user_id>', methods=['GET'])
-def get_progress(user_id):
+@app.route('/api/logout', methods=['POST'])
+@require_session
+def logout():
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with router.directory.transaction() as conn:
+            sessions.revoke(conn, g.session)
         
-        # Get user stats
-        cursor.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
-        stats = cursor.fetchone()
+        return jsonify({'message': 'Logged out'}), 200
         
-        # Get detailed progress for each data structure
-        cursor.execute('''
-            SELECT data_structure, 
-                   COUNT(*) as total_levels,
-                   SUM(CASE WHEN completed THEN 1 ELSE 0 END) as completed_levels,
-                   SUM(best_score) as total_ds_score
-            FROM game_progress 
-            WHERE user_id = ?
-            GROUP BY data_structure
-        ''', (user_id,))
-        
-        ds_progress = cursor.fetchall()
-        
-        # Get all level progress
-        cursor.execute('SELECT * FROM game_progress WHERE user_id = ?', (user_id,))
-        all_progress = cursor.fetchall()
-        
-        conn.close()
-        
-        result = {
-            'stats': dict(stats) if stats else {
-                'total_score': 0,
-                'total_time': 0,
-                'levels_completed': 0,
-                'total_attempts': 0
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/session', methods=['GET'])
+@require_session
+def get_session():
+    try:
+        session = g.session
+        if session.username is None:
+            # Issued by another worker: fetch the metadata once and keep it
+            with router.directory.connection() as conn:
+                user = conn.execute('SELECT username, email FROM users WHERE id = ?',
+                                    (session.user_id,)).fetchone()
+            if not user:
+                return jsonify({'error': 'User not found'}), 404
+            session.username, session.email = user['username'], user['email']
+        
+        return jsonify({
+            'user': {
+                'id': session.user_id,
+                'username': session.username,
+                'email': session.email
             },
-            'data_structure_progress': [dict(row) for row in ds_progress],
-            'all_progress': [dict(row) for row in all_progress]
-        }
+            'expires_at': session.expires
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _other_user(user_id):
+    # True when a URL or attempt names someone other than the session's user
+    return user_id is not None and str(user_id) != str(g.session.user_id)
+
+def _claim(items):
+    # Records attempts for the session's user; False if one names another user
+    attempts = [item for item in items if isinstance(item, dict)]
+    if any(_other_user(item.get('user_id')) for item in attempts):
+        return False
+    for item in attempts:
+        item['user_id'] = g.session.user_id
+    return True
+
+# Game progress routes
+@app.route('/api/progress', methods=['GET'])
+@app.route('/api/progress/<int:user_id>', methods=['GET'])
+@require_session
+def get_progress(user_id=None):
+    try:
+        if _other_user(user_id):
+            return jsonify({'error': 'Progress of other users is not accessible'}), 403
+        user_id = g.session.user_id
+        
+        def fill():
+            with router.for_user(user_id).pool.connection() as conn:
+                result = progress_buffer.read_progress(conn.cursor(), user_id)
+            return app.json.response(result).get_data()
         
-        return jsonify(result), 200
+        body = response_cache.get(('progress', user_id), {f'progress:{user_id}'}, fill)
+        return Response(body, 200, mimetype='application/json')
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/progress', methods=['POST'])
+@require_session
 def update_progress():
     try:
         data = request.get_json()
-        user_id = data.get('user_id')
-        data_structure = data.get('data_structure')
-        level_id = data.get('level_id')
-        completed = data.get('completed', False)
-        score = data.get('score', 0)
-        time_taken = data.get('time_taken', 0)
-        moves = data.get('moves', 0)
-        
-        if not all([user_id, data_structure, level_id]):
-            return jsonify({'error': 'Missing required fields'}), 400
+        if not _claim([data]):
+            return jsonify({'error': 'user_id does not match the session'}), 403
+        
+        attempt = parse_verified([data])[0]
+        if isinstance(attempt, InvalidReplay):
+            return jsonify({'error': str(attempt)}), 422
+        if isinstance(attempt, ValueError):
+            return jsonify({'error': str(attempt)}), 400
+        
+        response = {
+            'message': 'Progress updated successfully',
+            'completed': bool(attempt[3]),
+            'score': attempt[4],
+            'moves': attempt[6]
+        }
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        if progress_buffer.enabled:
+            # Acknowledged once buffered; the group commit follows shortly
+            try:
+                attempt = normalize_buffered(attempt)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            progress_buffer.add([attempt])
+            # Buffered attempts show in progress reads before the flush
+            response_cache.invalidate(f'progress:{attempt[0]}')
+            history.compactor.compact_if_due()
+            return jsonify(dict(response, message='Progress accepted')), 202
+        
+        shard = router.for_user(attempt[0])
+        with shard.pool.transaction() as conn:
+            cursor = conn.cursor()
+            record_attempt(cursor, attempt)
+            history.record(cursor, [attempt])
+            ranking_changes = shard.leaderboard.collect(cursor, [attempt[:2]])
+            score_moves = shard.rank_index.collect(cursor, score_deltas([attempt]))
+        
+        shard.leaderboard.apply(ranking_changes)
+        shard.rank_index.apply(ranking_changes[0], score_moves)
+        response_cache.invalidate(f'progress:{attempt[0]}', 'leaderboard')
+        history.compactor.compact_if_due()
+        
+        return jsonify(response), 200
         
-        # Check if progress record exists
-        cursor.execute('''
-            SELECT * FROM game_progress 
-            WHERE user_id = ? AND data_structure = ? AND level_id = ?
-        ''', (user_id, data_structure, level_id))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/progress/batch', methods=['POST'])
+@require_session
+def update_progress_batch():
+    try:
+        data = request.get_json()
+        items = data.get('attempts') if isinstance(data, dict) else data
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Expected a non-empty list of attempts'}), 400
+        
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} attempts per batch'}), 413
+        
+        if not _claim(items):
+            return jsonify({'error': 'user_id does not match the session'}), 403
+        
+        results = []
+        attempts = []
+        for index, attempt in enumerate(parse_verified(items)):
+            if progress_buffer.enabled and not isinstance(attempt, ValueError):
+                try:
+                    attempt = normalize_buffered(attempt)
+                except ValueError as e:
+                    attempt = e
+            if isinstance(attempt, ValueError):
+                results.append({'index': index, 'status': 'error', 'error': str(attempt)})
+            else:
+                attempts.append(attempt)
+                results.append({'index': index, 'status': 'ok'})
+        
+        if attempts and progress_buffer.enabled:
+            progress_buffer.add(attempts)
+        elif attempts:
+            # One transaction per shard touched
+            for shard, shard_attempts in router.group(attempts).items():
+                with shard.pool.transaction() as conn:
+                    cursor = conn.cursor()
+                    record_attempts(cursor, shard_attempts)
+                    history.record(cursor, shard_attempts)
+                    ranking_changes = shard.leaderboard.collect(cursor, [a[:2] for a in shard_attempts])
+                    score_moves = shard.rank_index.collect(cursor, score_deltas(shard_attempts))
+                
+                shard.leaderboard.apply(ranking_changes)
+                shard.rank_index.apply(ranking_changes[0], score_moves)
+                response_cache.invalidate('leaderboard')
+        if attempts:
+            response_cache.invalidate(f'progress:{g.session.user_id}')
+            history.compactor.compact_if_due()
         
-        existing = cursor.fetchone()
+        return jsonify({
+            'applied': len(attempts),
+            'failed': len(items) - len(attempts),
+            'results': results
+        }), 202 if attempts and progress_buffer.enabled else 200
         
-        if existing:
-            # Update existing record
-            new_best_score = max(existing['best_score'], score)
-            new_best_time = min(existing['best_time'], time_taken) if time_taken > 0 else existing['best_time']
-            new_best_moves = min(existing['best_moves'], moves) if moves > 0 else existing['best_moves']
-            
-            cursor.execute('''
-                UPDATE game_progress 
-                SET completed = ?,
-                    best_score = ?,
-                    best_time = ?,
-                    best_moves = ?,
-                    attempts = attempts + 1,
-                    last_played = CURRENT_TIMESTAMP
-                WHERE user_id = ? AND data_structure = ? AND level_id = ?
-            ''', (completed, new_best_score, new_best_time, new_best_moves, 
-                  user_id, data_structure, level_id))
-        else:
-            # Create new record
-            cursor.execute('''
-                INSERT INTO game_progress 
-                (user_id, data_structure, level_id, completed, best_score, best_time, best_moves, attempts)
-                VALUES (?, ?, ?, ?, ?, ?, ?, 1)
-            ''', (user_id, data_structure, level_id, completed, score, time_taken, moves))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _leaderboard_response(board, window=None):
+    limit = request.args.get('limit', 10, type=int)
+    limit = max(1, min(limit, LEADERBOARD_SIZE))
+    current = history.period(window) if window else None
+    
+    def fill():
+        # Scatter to every shard, then merge their top lists
+        boards = []
+        for shard in router.shards:
+            with shard.pool.connection() as conn:
+                if window:
+                    # Today's or this week's rollup rows only
+                    boards.append(history.top_keyed(conn, window, current, limit))
+                else:
+                    boards.append(shard.leaderboard.top_keyed(conn, board, limit))
+        return app.json.response(merge_top(boards, limit)).get_data()
+    
+    body = response_cache.get(('leaderboard', board, window, current, limit), {'leaderboard'}, fill)
+    return Response(body, 200, mimetype='application/json')
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
+    try:
+        window = request.args.get('window')
+        if window is not None and window not in history.WINDOWS:
+            return jsonify({'error': f'window must be one of {", ".join(history.WINDOWS)}'}), 400
         
-        # Update user stats
-        if completed:
-            cursor.execute('''
-                UPDATE user_stats 
-                SET total_score = total_score + ?,
-                    total_time = total_time + ?,
-                    levels_completed = levels_completed + 1,
-                    total_attempts = total_attempts + 1,
-                    last_updated = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (score, time_taken, user_id))
-        else:
-            cursor.execute('''
-                UPDATE user_stats 
-                SET total_attempts = total_attempts + 1,
-                    last_updated = CURRENT_TIMESTAMP
-                WHERE user_id = ?
-            ''', (user_id,))
+        return _leaderboard_response(GLOBAL, window)
         
-        conn.commit()
-        conn.close()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/leaderboard/<data_structure>', methods=['GET'])
+def get_ds_leaderboard(data_structure):
+    try:
+        if data_structure not in DATA_STRUCTURES:
+            return jsonify({'error': 'Unknown data structure'}), 404
         
-        return jsonify({'message': 'Progress updated successfully'}), 200
+        return _leaderboard_response(data_structure)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/leaderboard', methods=['GET'])
-def get_leaderboard():
+@app.route('/api/rank', methods=['GET'])
+@app.route('/api/rank/<int:user_id>', methods=['GET'])
+@require_session
+def get_rank(user_id=None):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        if _other_user(user_id):
+            return jsonify({'error': 'Rank of other users is not accessible'}), 403
+        user_id = g.session.user_id
+        
+        around = request.args.get('around', 5, type=int)
+        around = max(0, min(around, 50))
+        
+        with ExitStack() as stack:
+            cursors = {}
+            for shard in router.shards:
+                conn = stack.enter_context(shard.pool.connection())
+                shard.rank_index.refresh(conn)
+                cursors[shard] = conn.cursor()
+            cursor = cursors[router.for_user(user_id)]
+            
+            cursor.execute('''
+                SELECT u.username, us.total_score
+                FROM user_stats us
+                JOIN users u ON u.id = us.user_id
+                WHERE us.user_id = ?
+            ''', (user_id,))
+            user = cursor.fetchone()
+            
+            if not user:
+                return jsonify({'error': 'User not found'}), 404
+            
+            above, below = neighbours_across(cursors.values(), user_id, user['total_score'], around)
         
-        cursor.execute('''
-            SELECT u.username, us.total_score, us.levels_completed, us.total_time
-            FROM users u
-            JOIN user_stats us ON u.id = us.user_id
-            ORDER BY us.total_score DESC
-            LIMIT 10
-        ''')
+        indexes = [shard.rank_index for shard in router.shards]
+        
+        def player(row):
+            return {
+                'username': row['username'],
+                'total_score': row['total_score'],
+                'rank': rank_across(indexes, row['total_score'])
+            }
         
-        leaderboard = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        return jsonify({
+            'user_id': user_id,
+            'username': user['username'],
+            'total_score': user['total_score'],
+            'rank': rank_across(indexes, user['total_score']),
+            'total_players': sum(index.total for index in indexes),
+            'percentile': percentile_across(indexes, user['total_score']),
+            'above': [player(row) for row in reversed(above)],
+            'below': [player(row) for row in below]
+        }), 200
         
-        return jsonify(leaderboard), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export/<any(progress, stats):table>', methods=['GET'])
+@require_operator
+def export_rows(table):
+    try:
+        export = EXPORTS[table]
+        try:
+            after = export.parse_after(request.args.get('after'))
+            since = parse_since(request.args.get('since'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        
+        # Streamed: rows are read and encoded as the client consumes them
+        compress = request.accept_encodings['gzip'] > 0
+        rows = export.rows([shard.pool for shard in router.shards], after, since, limit)
+        headers = {'Vary': 'Accept-Encoding'}
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+        return Response(ndjson(export.columns, rows, compress), mimetype='application/x-ndjson',
+                        headers=headers)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _encoded_response(encoded, cache_control='no-cache'):
+    # no-cache still lets clients keep the body; they revalidate with
+    # If-None-Match and get an empty 304 while the catalog is unchanged.
+    headers = {'ETag': f'"{encoded.etag}"', 'Cache-Control': cache_control}
+    if request.if_none_match.contains(encoded.etag):
+        return Response(status=304, headers=headers)
+    return Response(encoded.body, status=200, mimetype='application/json', headers=headers)
+
 @app.route('/api/levels/<data_structure>', methods=['GET'])
 def get_levels(data_structure):
     try:
-        # Return the level definitions from the frontend
-        levels = {
-            'stack': [
-                {'id': 1, 'name': 'Basic Push', 'difficulty': 'Easy'},
-                {'id': 2, 'name': 'Simple Pop', 'difficulty': 'Easy'},
-                {'id': 3, 'name': 'Push Multiple', 'difficulty': 'Easy'},
-                {'id': 4, 'name': 'Pop to Empty', 'difficulty': 'Easy'},
-                {'id': 5, 'name': 'Push and Pop', 'difficulty': 'Easy'},
-                {'id': 6, 'name': 'Single Element', 'difficulty': 'Easy'},
-                {'id': 7, 'name': 'Clear Stack', 'difficulty': 'Easy'},
-                {'id': 8, 'name': 'Build Stack', 'difficulty': 'Easy'},
-                {'id': 9, 'name': 'Remove Top', 'difficulty': 'Easy'},
-                {'id': 10, 'name': 'Add One', 'difficulty': 'Easy'},
-                {'id': 11, 'name': 'Reverse Two', 'difficulty': 'Medium'},
-                {'id': 12, 'name': 'Stack Swap', 'difficulty': 'Medium'},
-                {'id': 13, 'name': 'Insert Middle', 'difficulty': 'Medium'},
-                {'id': 14, 'name': 'Duplicate Top', 'difficulty': 'Medium'},
-                {'id': 15, 'name': 'Move Bottom', 'difficulty': 'Medium'},
-                {'id': 16, 'name': 'Stack Rotation', 'difficulty': 'Medium'},
-                {'id': 17, 'name': 'Replace Top', 'difficulty': 'Medium'},
-                {'id': 18, 'name': 'Sort Two', 'difficulty': 'Medium'},
-                {'id': 19, 'name': 'Triple Reverse', 'difficulty': 'Medium'},
-                {'id': 20, 'name': 'Insert Between', 'difficulty': 'Medium'},
-                {'id': 21, 'name': 'Perfect Shuffle', 'difficulty': 'Hard'},
-                {'id': 22, 'name': 'Stack Tower', 'difficulty': 'Hard'},
-                {'id': 23, 'name': 'Complex Reverse', 'difficulty': 'Hard'},
-                {'id': 24, 'name': 'Palindrome', 'difficulty': 'Hard'},
-                {'id': 25, 'name': 'Stack Permutation', 'difficulty': 'Hard'},
-                {'id': 26, 'name': 'Mirror Image', 'difficulty': 'Hard'},
-                {'id': 27, 'name': 'Stack Merge', 'difficulty': 'Hard'},
-                {'id': 28, 'name': 'Fibonacci Stack', 'difficulty': 'Hard'},
-                {'id': 29, 'name': 'Tower of Hanoi', 'difficulty': 'Hard'},
-                {'id': 30, 'name': 'Master Stack', 'difficulty': 'Hard'}
-            ],
-            'queue': [
-                {'id': 1, 'name': 'Basic Enqueue', 'difficulty': 'Easy'},
-                {'id': 2, 'name': 'Simple Dequeue', 'difficulty': 'Easy'},
-                {'id': 3, 'name': 'Queue Build', 'difficulty': 'Easy'},
-                {'id': 4, 'name': 'Empty Queue', 'difficulty': 'Easy'},
-                {'id': 5, 'name': 'Queue Replace', 'difficulty': 'Easy'},
-                {'id': 6, 'name': 'Single Item', 'difficulty': 'Easy'},
-                {'id': 7, 'name': 'Clear Queue', 'difficulty': 'Easy'},
-                {'id': 8, 'name': 'Build Three', 'difficulty': 'Easy'},
-                {'id': 9, 'name': 'Remove Front', 'difficulty': 'Easy'},
-                {'id': 10, 'name': 'Add Back', 'difficulty': 'Easy'},
-                {'id': 11, 'name': 'Queue Rotation', 'difficulty': 'Medium'},
-                {'id': 12, 'name': 'Move Front', 'difficulty': 'Medium'},
-                {'id': 13, 'name': 'Insert Middle', 'difficulty': 'Medium'},
-                {'id': 14, 'name': 'Queue Duplicate', 'difficulty': 'Medium'},
-                {'id': 15, 'name': 'Rearrange Queue', 'difficulty': 'Medium'},
-                {'id': 16, 'name': 'Queue Circle', 'difficulty': 'Medium'},
-                {'id': 17, 'name': 'Replace Front', 'difficulty': 'Medium'},
-                {'id': 18, 'name': 'Queue Sort', 'difficulty': 'Medium'},
-                {'id': 19, 'name': 'Triple Rotate', 'difficulty': 'Medium'},
-                {'id': 20, 'name': 'Queue Insert', 'difficulty': 'Medium'},
-                {'id': 21, 'name': 'Queue Reversal', 'difficulty': 'Hard'},
-                {'id': 22, 'name': 'Queue Tower', 'difficulty': 'Hard'},
-                {'id': 23, 'name': 'Complex Queue', 'difficulty': 'Hard'},
-                {'id': 24, 'name': 'Queue Palindrome', 'difficulty': 'Hard'},
-                {'id': 25, 'name': 'Queue Shuffle', 'difficulty': 'Hard'},
-                {'id': 26, 'name': 'Queue Mirror', 'difficulty': 'Hard'},
-                {'id': 27, 'name': 'Queue Merge', 'difficulty': 'Hard'},
-                {'id': 28, 'name': 'Queue Pattern', 'difficulty': 'Hard'},
-                {'id': 29, 'name': 'Queue Permutation', 'difficulty': 'Hard'},
-                {'id': 30, 'name': 'Master Queue', 'difficulty': 'Hard'}
-            ],
-            'linkedlist': [
-                {'id': 1, 'name': 'Basic Insert', 'difficulty': 'Easy'},
-                {'id': 2, 'name': 'Simple Delete', 'difficulty': 'Easy'},
-                {'id': 3, 'name': 'Build List', 'difficulty': 'Easy'},
-                {'id': 4, 'name': 'Empty List', 'difficulty': 'Easy'},
-                {'id': 5, 'name': 'Replace Element', 'difficulty': 'Easy'},
-                {'id': 6, 'name': 'Single Node', 'difficulty': 'Easy'},
-                {'id': 7, 'name': 'Clear List', 'difficulty': 'Easy'},
-                {'id': 8, 'name': 'Build Three', 'difficulty': 'Easy'},
-                {'id': 9, 'name': 'Remove Last', 'difficulty': 'Easy'},
-                {'id': 10, 'name': 'Add End', 'difficulty': 'Easy'},
-                {'id': 11, 'name': 'Insert Middle', 'difficulty': 'Medium'},
-                {'id': 12, 'name': 'Delete Middle', 'difficulty': 'Medium'},
-                {'id': 13, 'name': 'List Swap', 'difficulty': 'Medium'},
-                {'id': 14, 'name': 'Insert Start', 'difficulty': 'Medium'},
-                {'id': 15, 'name': 'Delete Start', 'difficulty': 'Medium'},
-                {'id': 16, 'name': 'List Reverse', 'difficulty': 'Medium'},
-                {'id': 17, 'name': 'Insert Position', 'difficulty': 'Medium'},
-                {'id': 18, 'name': 'Delete Position', 'difficulty': 'Medium'},
-                {'id': 19, 'name': 'List Rotation', 'difficulty': 'Medium'},
-                {'id': 20, 'name': 'Complex Insert', 'difficulty': 'Medium'},
-                {'id': 21, 'name': 'List Permutation', 'difficulty': 'Hard'},
-                {'id': 22, 'name': 'List Tower', 'difficulty': 'Hard'},
-                {'id': 23, 'name': 'Complex List', 'difficulty': 'Hard'},
-                {'id': 24, 'name': 'List Palindrome', 'difficulty': 'Hard'},
-                {'id': 25, 'name': 'List Shuffle', 'difficulty': 'Hard'},
-                {'id': 26, 'name': 'List Mirror', 'difficulty': 'Hard'},
-                {'id': 27, 'name': 'List Merge', 'difficulty': 'Hard'},
-                {'id': 28, 'name': 'List Pattern', 'difficulty': 'Hard'},
-                {'id': 29, 'name': 'List Sort', 'difficulty': 'Hard'},
-                {'id': 30, 'name': 'Master List', 'difficulty': 'Hard'}
-            ],
-            'tree': [
-                {'id': 1, 'name': 'Basic Insert', 'difficulty': 'Easy'},
-                {'id': 2, 'name': 'Simple Search', 'difficulty': 'Easy'},
-                {'id': 3, 'name': 'Build BST', 'difficulty': 'Easy'},
-                {'id': 4, 'name': 'Find Element', 'difficulty': 'Easy'},
-                {'id': 5, 'name': 'Insert Left', 'difficulty': 'Easy'},
-                {'id': 6, 'name': 'Insert Right', 'difficulty': 'Easy'},
-                {'id': 7, 'name': 'Single Node', 'difficulty': 'Easy'},
-                {'id': 8, 'name': 'Build Three', 'difficulty': 'Easy'},
-                {'id': 9, 'name': 'Search Found', 'difficulty': 'Easy'},
-                {'id': 10, 'name': 'Insert Multiple', 'difficulty': 'Easy'},
-                {'id': 11, 'name': 'Balanced Tree', 'difficulty': 'Medium'},
-                {'id': 12, 'name': 'Search Multiple', 'difficulty': 'Medium'},
-                {'id': 13, 'name': 'Insert Complex', 'difficulty': 'Medium'},
-                {'id': 14, 'name': 'Tree Traversal', 'difficulty': 'Medium'},
-                {'id': 15, 'name': 'Build Complete', 'difficulty': 'Medium'},
-                {'id': 16, 'name': 'Search Path', 'difficulty': 'Medium'},
-                {'id': 17, 'name': 'Insert Deep', 'difficulty': 'Medium'},
-                {'id': 18, 'name': 'Tree Height', 'difficulty': 'Medium'},
-                {'id': 19, 'name': 'Search All', 'difficulty': 'Medium'},
-                {'id': 20, 'name': 'Insert Skewed', 'difficulty': 'Medium'},
-                {'id': 21, 'name': 'Complex BST', 'difficulty': 'Hard'},
-                {'id': 22, 'name': 'Tree Search', 'difficulty': 'Hard'},
-                {'id': 23, 'name': 'Perfect Tree', 'difficulty': 'Hard'},
-                {'id': 24, 'name': 'Tree Patterns', 'difficulty': 'Hard'},
-                {'id': 25, 'name': 'Search Challenge', 'difficulty': 'Hard'},
-                {'id': 26, 'name': 'Tree Mirror', 'difficulty': 'Hard'},
-                {'id': 27, 'name': 'Deep Search', 'difficulty': 'Hard'},
-                {'id': 28, 'name': 'Fibonacci Tree', 'difficulty': 'Hard'},
-                {'id': 29, 'name': 'Tree Balance', 'difficulty': 'Hard'},
-                {'id': 30, 'name': 'Master Tree', 'difficulty': 'Hard'}
-            ],
-            'graph': [
-                {'id': 1, 'name': 'Basic Vertex', 'difficulty': 'Easy'},
-                {'id': 2, 'name': 'Simple Remove', 'difficulty': 'Easy'},
-                {'id': 3, 'name': 'Build Graph', 'difficulty': 'Easy'},
-                {'id': 4, 'name': 'Empty Graph', 'difficulty': 'Easy'},
-                {'id': 5, 'name': 'Replace Vertex', 'difficulty': 'Easy'},
-                {'id': 6, 'name': 'Single Node', 'difficulty': 'Easy'},
-                {'id': 7, 'name': 'Clear Graph', 'difficulty': 'Easy'},
-                {'id': 8, 'name': 'Build Three', 'difficulty': 'Easy'},
-                {'id': 9, 'name': 'Remove One', 'difficulty': 'Easy'},
-                {'id': 10, 'name': 'Add Vertex', 'difficulty': 'Easy'},
-                {'id': 11, 'name': 'Graph Build', 'difficulty': 'Medium'},
-                {'id': 12, 'name': 'Graph Remove', 'difficulty': 'Medium'},
-                {'id': 13, 'name': 'Graph Swap', 'difficulty': 'Medium'},
-                {'id': 14, 'name': 'Graph Replace', 'difficulty': 'Medium'},
-                {'id': 15, 'name': 'Graph Expand', 'difficulty': 'Medium'},
-                {'id': 16, 'name': 'Graph Contract', 'difficulty': 'Medium'},
-                {'id': 17, 'name': 'Graph Mix', 'difficulty': 'Medium'},
-                {'id': 18, 'name': 'Graph Transform', 'difficulty': 'Medium'},
-                {'id': 19, 'name': 'Graph Cycle', 'difficulty': 'Medium'},
-                {'id': 20, 'name': 'Graph Path', 'difficulty': 'Medium'},
-                {'id': 21, 'name': 'Complex Graph', 'difficulty': 'Hard'},
-                {'id': 22, 'name': 'Graph Tower', 'difficulty': 'Hard'},
-                {'id': 23, 'name': 'Graph Network', 'difficulty': 'Hard'},
-                {'id': 24, 'name': 'Graph Complete', 'difficulty': 'Hard'},
-                {'id': 25, 'name': 'Graph Sparse', 'difficulty': 'Hard'},
-                {'id': 26, 'name': 'Graph Dense', 'difficulty': 'Hard'},
-                {'id': 27, 'name': 'Graph Merge', 'difficulty': 'Hard'},
-                {'id': 28, 'name': 'Graph Pattern', 'difficulty': 'Hard'},
-                {'id': 29, 'name': 'Graph Web', 'difficulty': 'Hard'},
-                {'id': 30, 'name': 'Master Graph', 'difficulty': 'Hard'}
-            ]
-        }
+        return _encoded_response(catalog.summary(data_structure))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/levels/<data_structure>/stats', methods=['GET'])
+def get_level_stats(data_structure):
+    try:
+        if data_structure not in catalog.levels:
+            return jsonify({'error': 'Unknown data structure'}), 404
+        
+        level_stats.refresh_if_due()
+        with router.directory.connection() as conn:
+            levels, refreshed_at = level_stats.load(conn, data_structure)
+        
+        return jsonify({
+            'data_structure': data_structure,
+            'refreshed_at': refreshed_at,
+            'levels': levels
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/levels/<data_structure>/generated', methods=['GET'])
+def get_generated_levels(data_structure):
+    try:
+        if data_structure not in catalog.levels:
+            return jsonify({'error': 'Unknown data structure'}), 404
+        
+        difficulty = request.args.get('difficulty')
+        if difficulty is not None:
+            difficulty = difficulty.capitalize()
+            if difficulty not in DIFFICULTIES:
+                return jsonify({'error': f'difficulty must be one of {", ".join(DIFFICULTIES)}'}), 400
+        
+        count = request.args.get('count', 1, type=int)
+        if not 1 <= count <= MAX_SAMPLE:
+            return jsonify({'error': f'count must be between 1 and {MAX_SAMPLE}'}), 400
+        
+        # Random picks from the pool built by generator.py
+        response = jsonify(generated_pool.sample(data_structure, difficulty, count))
+        response.headers['Cache-Control'] = 'no-store'
+        return response, 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/levels/catalog', methods=['GET'])
+def get_level_catalog():
+    try:
+        response = _encoded_response(catalog.full)
+        response.headers['X-Catalog-Version'] = catalog.version
+        response.headers['Link'] = f'</api/levels/catalog/{catalog.version}>; rel="canonical"'
+        return response
         
-        return jsonify(levels.get(data_structure, [])), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/levels/catalog/<version>', methods=['GET'])
+def get_versioned_level_catalog(version):
+    try:
+        if version != catalog.version:
+            return jsonify({'error': 'Unknown catalog version', 'current_version': catalog.version}), 404
+        
+        return _encoded_response(catalog.full, 'public, max-age=31536000, immutable')
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/hint/<data_structure>/<int:level_id>', methods=['GET'])
+def get_hint(data_structure, level_id):
+    try:
+        level = catalog.level(data_structure, level_id) or generated_pool.level(data_structure, level_id)
+        if not level:
+            return jsonify({'error': 'Unknown level'}), 404
+        
+        # Current structure as a JSON list, e.g. ?state=["A","B"];
+        # defaults to the level's initial state
+        state = request.args.get('state')
+        if state is not None:
+            try:
+                state = json.loads(state)
+            except ValueError:
+                state = None
+            if not isinstance(state, list):
+                return jsonify({'error': 'state must be a JSON list'}), 400
+        
+        try:
+            move, remaining = next_move(data_structure, level_id, level, state)
+        except Unsolvable:
+            return jsonify({'error': 'No solution from this state'}), 422
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({'move': move, 'moves_remaining': remaining}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Prometheus metrics endpoint
+@app.route('/api/metrics', methods=['GET'])
+@require_operator
+def get_metrics():
+    try:
+        return Response(metrics.exposition(), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()}), 200
 
-if __name__ == '__main__':
-    # Initialize database if it doesn't exist
-    if not os.path.exists('game_database.db'):
-        init_db()
-        print("Database initialized successfully!")
-        if __name__ == '__main__':
-    # Initialize database if it doesn't exist
-    if not os.path.exists('game_database.db'):
-        init_db()
-        print("Database initialized successfully!")
+# Create the schema on import so gunicorn workers, which never run
+# __main__, also get it. Every statement is CREATE ... IF NOT EXISTS.
+init_db()
+if progress_buffer.enabled:
+    progress_buffer.recover()
+router.load()
 
+if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
-    
-    
@@ -0,0 +1,216 @@
+"""Async serving mode: the same Flask app behind gunicorn's asyncio worker.
+
+    gunicorn -k asgi --workers 4 --worker-connections 10000 --keep-alive 75 asgi:app
+
+Sockets, keep-alive and slow clients are handled on one event loop per
+worker, so an idle connection costs a socket and a few objects instead of a
+thread. Each request runs the unchanged Flask app (same routes, payloads and
+status codes) on a pool of ASYNC_THREADS threads, which is where all the
+SQLite work happens. At most ASYNC_MAX_QUEUED more requests wait for a
+thread; past that the worker answers 503 with Retry-After at once instead of
+queueing without bound.
+
+Response bodies up to ASYNC_BUFFER_BYTES are collected on the thread and
+written by the loop in one piece. Larger ones (the NDJSON exports) are
+streamed: the thread waits for each chunk to be sent, so a slow reader holds
+back the producer instead of filling memory.
+"""
+import asyncio
+import io
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from app import app as flask_app
+
+ASYNC_THREADS = int(os.environ.get('ASYNC_THREADS', 8))
+ASYNC_MAX_QUEUED = int(os.environ.get('ASYNC_MAX_QUEUED', 256))
+ASYNC_MAX_BODY = int(os.environ.get('ASYNC_MAX_BODY', 16 * 2 ** 20))
+ASYNC_BUFFER_BYTES = int(os.environ.get('ASYNC_BUFFER_BYTES', 64 * 2 ** 10))
+STREAM_POLL_SECONDS = 0.5
+
+queue_wait = metrics.registry.histogram(
+    'async_queue_wait_seconds', 'Time async-mode requests waited for a thread.')
+rejected = metrics.registry.counter(
+    'async_requests_rejected_total', 'Async-mode requests refused with 503 because the queue was full.')
+
+
+def _error(status, message, headers=()):
+    # Same shape as jsonify() in app.py
+    body = (json.dumps({'error': message}, separators=(',', ':')) + '\n').encode()
+    return status, [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                    *headers], [body]
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        # The whole body is buffered, so a chunked request reads like any other
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    if body:
+        environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+class AsyncBridge:
+    # ASGI callable running a WSGI app on a bounded thread pool
+    def __init__(self, wsgi_app, threads=ASYNC_THREADS, max_queued=ASYNC_MAX_QUEUED,
+                 max_body=ASYNC_MAX_BODY, buffer_bytes=ASYNC_BUFFER_BYTES):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.max_queued = max_queued
+        self.max_body = max_body
+        self.buffer_bytes = buffer_bytes
+        self._executor = None
+        # Requests running or waiting for a thread; only touched on the loop
+        self._admitted = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        if self._admitted >= self.threads + self.max_queued:
+            with metrics.registry.lock:
+                rejected.inc(())
+            return await self._send(send, *_error(503, 'Server busy, retry shortly', [(b'retry-after', b'1')]))
+        self._admitted += 1
+        try:
+            await self._handle(scope, receive, send)
+        finally:
+            self._admitted -= 1
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='async-request')
+
+    async def _handle(self, scope, receive, send):
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            size += len(chunks[-1])
+            if size > self.max_body:
+                return await self._send(send, *_error(413, 'Request body too large'))
+            if not message.get('more_body'):
+                break
+
+        self._start()
+        loop = asyncio.get_running_loop()
+        stop = threading.Event()
+        watcher = loop.create_task(self._watch(receive, stop))
+        try:
+            response = await loop.run_in_executor(
+                self._executor, self._run, _environ(scope, b''.join(chunks)), time.perf_counter(), stop, loop, send)
+            if response is not None:
+                await self._send(send, *response)
+        finally:
+            # Done, or cancelled: a streaming thread stops at its next chunk
+            stop.set()
+            watcher.cancel()
+
+    @staticmethod
+    async def _watch(receive, stop):
+        # After the body, receive() only returns once the client is gone
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        stop.set()
+
+    def _run(self, environ, admitted_at, stop, loop, send):
+        # On a pool thread. Returns (status, headers, body chunks), or None
+        # once a large body has been streamed from here.
+        with metrics.registry.lock:
+            queue_wait.observe((), time.perf_counter() - admitted_at)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            chunks, size = [], 0
+            body = iter(result)
+            for chunk in body:
+                if chunk:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                if size > self.buffer_bytes:
+                    break
+            else:
+                return started['status'], started['headers'], chunks
+
+            def call(message):
+                # Blocks while the client is slow to read; False once it is gone,
+                # since a send waiting on a dead socket may never finish
+                future = asyncio.run_coroutine_threadsafe(send(message), loop)
+                while not stop.is_set():
+                    try:
+                        future.result(timeout=STREAM_POLL_SECONDS)
+                        return True
+                    except TimeoutError:
+                        pass
+                future.cancel()
+                return False
+
+            if not call({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']}):
+                return None
+            for chunk in itertools.chain([b''.join(chunks)], body):
+                if chunk and not call({'type': 'http.response.body', 'body': chunk, 'more_body': True}):
+                    return None
+            call({'type': 'http.response.body', 'body': b''})
+            return None
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    @staticmethod
+    async def _send(send, status, headers, chunks):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+
+
+app = AsyncBridge(flask_app)
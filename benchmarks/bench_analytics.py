@@ -0,0 +1,87 @@
+"""Level difficulty analytics: rebuild time and memory on a seeded database.
+
+    python benchmarks/seed.py --db /tmp/big.db --users 1000000 --progress 10000000
+    python benchmarks/bench_analytics.py --db /tmp/big.db
+
+Times LevelStats.compute() (packed group_concat chunks into NumPy
+histograms) at each --chunk-sizes, with its peak traced allocation, against
+two ways of doing without it:
+
+    sql GROUP BY   players, completions and mean attempts per level in one
+                   aggregate query (no percentiles or distributions)
+    row fetch      the same columns fetched row by row with fetchmany and
+                   turned into NumPy arrays per chunk, the usual way to
+                   load a table into NumPy
+
+The database is migrated to the latest schema first.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', required=True, help='database filled by benchmarks/seed.py')
+    parser.add_argument('--chunk-sizes', default='50000,200000,1000000')
+    parser.add_argument('--skip-row-fetch', action='store_true', help='leave out the slowest baseline')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_PATH'] = args.db
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import numpy as np
+    import app  # noqa: F401  (migrates the schema)
+    from analytics import LevelStats
+    from shards import router
+
+    with router.directory.connection() as conn:
+        rows = conn.execute('SELECT COUNT(*) FROM game_progress').fetchone()[0]
+        # Warm the page cache, so every run below reads from memory
+        conn.execute('SELECT SUM(attempts) FROM game_progress').fetchone()
+    print(f'{rows} progress rows\n')
+    print(f'{"method":<30} {"seconds":>8} {"rows/s":>12} {"peak MiB":>9}')
+
+    def report(name, func):
+        tracemalloc.start()
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{name:<30} {elapsed:>8.2f} {rows / elapsed:>12,.0f} {peak / 2 ** 20:>9.1f}')
+
+    for chunk_size in (int(size) for size in args.chunk_sizes.split(',')):
+        report(f'numpy, chunks of {chunk_size}', LevelStats(chunk_size=chunk_size).compute)
+
+    def group_by():
+        with router.directory.connection() as conn:
+            conn.execute('''
+                SELECT data_structure, level_id, COUNT(*), SUM(completed), AVG(attempts)
+                FROM game_progress GROUP BY data_structure, level_id
+            ''').fetchall()
+
+    report('sql GROUP BY', group_by)
+
+    def row_fetch():
+        with router.directory.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute('SELECT level_id, completed, attempts, best_moves, best_time FROM game_progress')
+            while True:
+                chunk = cursor.fetchmany(200000)
+                if not chunk:
+                    break
+                np.array(chunk, dtype=np.int64)
+
+    if not args.skip_row_fetch:
+        report('row fetch, chunks of 200000', row_fetch)
+
+    started = time.perf_counter()
+    LevelStats().refresh()
+    print(f'\nrefresh() including the level_stats write: {time.perf_counter() - started:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
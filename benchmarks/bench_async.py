@@ -0,0 +1,275 @@
+"""Thousands of concurrent keep-alive clients against each serving mode.
+
+    python benchmarks/bench_async.py --clients 5000 --seconds 30
+    python benchmarks/bench_async.py --modes gthread,asgi --clients 1000 --think 2
+
+Starts gunicorn on a throwaway database once per mode, with the same
+--workers, --keep-alive and --worker-connections:
+
+    sync     gunicorn --workers W app:app
+    gthread  gunicorn -k gthread --workers W --threads T app:app
+    asgi     gunicorn -k asgi --workers W asgi:app     (asgi.py)
+
+--clients asyncio clients then ramp up over --ramp seconds. Each one holds a
+keep-alive connection, waits a random think time (mean --think seconds)
+and sends one request: mostly leaderboard, rank and progress reads, with
+--write-ratio progress writes. So at any moment nearly every connection is
+idle, which is what a classroom of open browser tabs looks like. A client
+reconnects only when the server closes the connection (the sync worker
+does after every response) or a request fails. --slow-ratio of the
+clients are on a bad network: they send half of every request, stall for
+--slow-delay seconds and then send the rest. They are not measured, only
+the others are.
+
+Reported per mode, over the --seconds after the ramp: requests/s, p50/p99,
+failures (timeouts, resets, 5xx), new connections made, connections open
+at the end of the ramp, and the server's RSS and thread count summed over
+the gunicorn process tree. Client and server share the machine, so keep
+the client's CPU in mind when reading the numbers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import OPERATIONS, ROOT, HttpClient, free_port, register_population, summarize  # noqa: E402
+
+MODES = {
+    'sync': lambda args: ['--workers', str(args.workers), 'app:app'],
+    'gthread': lambda args: ['-k', 'gthread', '--workers', str(args.workers),
+                             '--threads', str(args.worker_threads), 'app:app'],
+    'asgi': lambda args: ['-k', 'asgi', '--workers', str(args.workers), 'asgi:app'],
+}
+
+READS = {'leaderboard': 4, 'rank': 2, 'progress_get': 3}
+
+
+def start_server(mode, args, db_dir):
+    port = free_port()
+    env = dict(os.environ, DATABASE_PATH=os.path.join(db_dir, 'bench.db'))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning',
+         '--keep-alive', str(args.keep_alive), '--worker-connections', str(args.worker_connections),
+         '--backlog', '2048', '--timeout', '60', *MODES[mode](args)],
+        cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn ({mode}) exited during startup')
+        status, _ = HttpClient(port).request('GET', '/api/health')
+        if status == 200:
+            return port, server
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f'gunicorn ({mode}) did not become healthy within 30 s')
+
+
+def process_tree(pid):
+    pids = [pid]
+    for current in pids:
+        for task in os.listdir(f'/proc/{current}/task'):
+            with open(f'/proc/{current}/task/{task}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+    return pids
+
+
+def server_resources(pid):
+    # (RSS in MiB, threads) summed over gunicorn's master and workers
+    rss = threads = 0
+    for current in process_tree(pid):
+        with open(f'/proc/{current}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss += int(line.split()[1])
+                elif line.startswith('Threads:'):
+                    threads += int(line.split()[1])
+    return rss / 1024, threads
+
+
+async def read_response(reader):
+    # (status, keep_alive) for one HTTP/1.1 response, body discarded
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection') != 'close'
+
+
+class Client:
+    def __init__(self, index, port, pop, args):
+        self.index = index
+        self.port = port
+        self.pop = pop
+        self.args = args
+        self.rng = Random(args.seed * 100000 + index)
+        self.slow = self.rng.random() < args.slow_ratio
+        self.reads = [OPERATIONS[name] for name in READS]
+        self.weights = list(READS.values())
+        self.signups = 0
+        self.connection = None
+        self.connects = 0
+        self.samples = []
+        self.statuses = {}
+
+    def _request(self):
+        rng = self.rng
+        if rng.random() < self.args.write_ratio:
+            operation = OPERATIONS['progress_post']
+        else:
+            operation = rng.choices(self.reads, self.weights)[0]
+        _, method, path, body, headers = operation(self, rng)
+        payload = json.dumps(body).encode() if body is not None else b''
+        headers = ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+        return (f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n{headers}'
+                f'Content-Length: {len(payload)}\r\n\r\n').encode() + payload
+
+    def close(self):
+        if self.connection:
+            self.connection[1].close()
+            self.connection = None
+
+    async def run(self, ramp_until, measure_from, deadline):
+        await asyncio.sleep(self.index * (ramp_until - time.monotonic()) / self.args.clients)
+        first = True
+        while True:
+            if not first:
+                # Idle on the open connection, as a browser tab between actions
+                think = self.rng.expovariate(1 / self.args.think)
+                await asyncio.sleep(max(0, min(think, deadline - time.monotonic())))
+            first = False
+            if time.monotonic() >= deadline:
+                return self.close()
+            if self.connection is None:
+                try:
+                    self.connection = await asyncio.wait_for(
+                        asyncio.open_connection('127.0.0.1', self.port), self.args.timeout)
+                    self.connects += 1
+                except (OSError, asyncio.TimeoutError):
+                    self._record(0, 0, measure_from)
+                    continue
+            reader, writer = self.connection
+            start = time.perf_counter()
+            try:
+                request = self._request()
+                if self.slow:
+                    # Half the request, then a stall: a phone on a bad network
+                    writer.write(request[:len(request) // 2])
+                    await asyncio.sleep(self.args.slow_delay)
+                    request = request[len(request) // 2:]
+                writer.write(request)
+                status, keep_alive = await asyncio.wait_for(read_response(reader), self.args.timeout)
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                status, keep_alive = 0, False
+            self._record(status, time.perf_counter() - start, measure_from)
+            if not keep_alive:
+                self.close()
+
+    def _record(self, status, elapsed, measure_from):
+        # Slow clients only create the load; they are not measured
+        if self.slow or time.monotonic() < measure_from:
+            return
+        if status:
+            self.samples.append(elapsed)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+async def drive(port, pop, args, server):
+    loop_started = time.monotonic()
+    ramp_until = loop_started + args.ramp
+    measure_from = ramp_until + min(args.think, 5)
+    deadline = measure_from + args.seconds
+    clients = [Client(n, port, pop, args) for n in range(args.clients)]
+    tasks = [asyncio.create_task(client.run(ramp_until, measure_from, deadline)) for client in clients]
+
+    await asyncio.sleep(measure_from - time.monotonic())
+    open_connections = sum(client.connection is not None for client in clients)
+    rss, threads = server_resources(server.pid)
+    await asyncio.gather(*tasks)
+    connects = sum(client.connects for client in clients)
+    return clients, open_connections, connects, rss, threads
+
+
+def run_mode(mode, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        port, server = start_server(mode, args, tmp)
+        try:
+            pop = register_population(HttpClient(port), args.users, 0, Random(args.seed))
+            idle_rss, idle_threads = server_resources(server.pid)
+            clients, open_connections, connects, rss, threads = asyncio.run(drive(port, pop, args, server))
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+    samples = [value for client in clients for value in client.samples]
+    statuses = {}
+    for client in clients:
+        for status, count in client.statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return dict(
+        summarize(samples, statuses, args.seconds), mode=mode, clients=args.clients,
+        open_connections=open_connections, connects=connects,
+        idle_rss_mib=round(idle_rss, 1), rss_mib=round(rss, 1), idle_threads=idle_threads, threads=threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--modes', default='sync,gthread,asgi', help=f'comma-separated, from {", ".join(MODES)}')
+    parser.add_argument('--clients', type=int, default=5000, help='concurrent client connections')
+    parser.add_argument('--ramp', type=float, default=10, help='seconds to open all connections')
+    parser.add_argument('--seconds', type=float, default=30, help='measured seconds after the ramp')
+    parser.add_argument('--think', type=float, default=10, help='mean idle seconds between requests')
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--slow-ratio', type=float, default=0.01,
+                        help='share of clients that stall --slow-delay seconds halfway through each request')
+    parser.add_argument('--slow-delay', type=float, default=5)
+    parser.add_argument('--timeout', type=float, default=30, help='per-request timeout in seconds')
+    parser.add_argument('--users', type=int, default=200, help='students registered before the run')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--worker-threads', type=int, default=4, help='threads per gthread worker')
+    parser.add_argument('--worker-connections', type=int, default=10000)
+    parser.add_argument('--keep-alive', type=int, default=75, help='gunicorn --keep-alive seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print one JSON object per mode instead')
+    args = parser.parse_args()
+
+    # Every client needs a socket, and so does the server end of it
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if hard < args.clients * 2 + 100:
+        parser.error(f'open file limit {hard} is too low for {args.clients} clients; raise ulimit -n')
+
+    if not args.json:
+        print(f'{"mode":<8} {"req/s":>7} {"p50 ms":>8} {"p99 ms":>9} {"failed":>7} {"connects":>9} '
+              f'{"open":>6} {"RSS MiB":>14} {"threads":>10}')
+    for mode in args.modes.split(','):
+        r = run_mode(mode, args)
+        if args.json:
+            print(json.dumps(r))
+            continue
+        print(f'{mode:<8} {r["throughput_rps"]:>7.0f} {r["p50_ms"]:>8.1f} {r["p99_ms"]:>9.1f} {r["errors"]:>7} '
+              f'{r["connects"]:>9} {r["open_connections"]:>6} '
+              f'{r["idle_rss_mib"]:>6.0f} -> {r["rss_mib"]:<4.0f} {r["idle_threads"]:>4} -> {r["threads"]:<4}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Requests/sec through the Flask app: pooled WAL connections vs. the old
+connect-per-request, rollback-journal setup.
+
+    python benchmarks/bench_connection_pool.py --threads 8 --seconds 5
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'import.db'))
+
+import app as api  # noqa: E402
+from database import ConnectionPool  # noqa: E402
+from loadtest import playable_levels, solution_log  # noqa: E402
+from shards import ShardRouter  # noqa: E402
+
+
+class LegacyConnections:
+    # What every route did before: open, use, close, default journal mode.
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def connection(self):
+        conn = self._connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        conn = self._connect()
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def close_all(self):
+        pass
+
+
+def run(connections, users, threads, seconds, write_ratio):
+    api.router = ShardRouter(connections, [connections])
+    api.init_db()
+    client = api.app.test_client()
+    tokens = []
+    for i in range(users):
+        response = client.post('/api/register', json={
+            'username': f'user{i}', 'email': f'user{i}@example.com', 'password': 'password'})
+        tokens.append(response.get_json()['token'])
+
+    counts = [0] * threads
+    errors = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    levels = playable_levels()
+
+    def worker(n):
+        rng = random.Random(n)
+        local = api.app.test_client()
+        while time.perf_counter() < deadline:
+            if rng.random() < write_ratio:
+                data_structure, level_id = rng.choice(levels)
+                response = local.post('/api/progress', headers={
+                    'Authorization': f'Bearer {rng.choice(tokens)}',
+                }, json={
+                    'data_structure': data_structure,
+                    'level_id': level_id,
+                    'time_taken': rng.randint(1, 120),
+                    'operation_log': solution_log(data_structure, level_id),
+                })
+            else:
+                response = local.get('/api/leaderboard')
+            counts[n] += 1
+            if response.status_code != 200:
+                errors[n] += 1
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    connections.close_all()
+    return sum(counts) / elapsed, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    modes = [
+        ('connect-per-request', LegacyConnections(os.path.join(workdir, 'legacy.db'))),
+        ('pooled WAL', ConnectionPool(os.path.join(workdir, 'pooled.db'))),
+    ]
+    results = {}
+    for name, connections in modes:
+        rps, errors = run(connections, args.users, args.threads, args.seconds, args.write_ratio)
+        results[name] = rps
+        print(f'{name:>20}: {rps:8.0f} req/s  ({errors} errors)')
+    before, after = results['connect-per-request'], results['pooled WAL']
+    print(f'{"speedup":>20}: {after / before:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Generated puzzles: pool build time per process count, and pool sampling vs. searching per request.
+
+    python benchmarks/bench_generator.py --per-difficulty 200 --processes 1,2,4
+
+"on demand" is what a request would cost without the pool: generate
+candidates for the data structure and solve each one until one has the
+asked difficulty. "pool" is generated_pool.sample() on the pool built by
+generator.py.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import generator  # noqa: E402
+from solver import Unsolvable, solve  # noqa: E402
+
+
+def on_demand(data_structure, difficulty, rng):
+    while True:
+        initial, target, operations = generator.GENERATORS[data_structure](rng)
+        try:
+            optimal = len(solve(data_structure, {'initial': initial, 'target': target, 'operations': operations}))
+        except Unsolvable:
+            continue
+        if generator.grade(optimal) == difficulty:
+            return initial, target, operations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--per-difficulty', type=int, default=200)
+    parser.add_argument('--processes', default=f'1,{os.cpu_count() or 1}')
+    parser.add_argument('--requests', type=int, default=500, help='sampled requests per data structure')
+    args = parser.parse_args()
+
+    print(f'{os.cpu_count()} CPUs')
+    for processes in sorted({int(n) for n in args.processes.split(',')}):
+        started = time.perf_counter()
+        levels = generator.build(args.per_difficulty, processes)
+        elapsed = time.perf_counter() - started
+        print(f'build, {processes} process(es): {elapsed:6.2f} s  ({sum(map(len, levels.values()))} levels)')
+
+    pool = generator.generated_pool
+    rng = random.Random(1)
+    print(f'\n{"data structure":<15} {"on demand (Hard)":>18} {"pool (Hard)":>12}')
+    for ds in generator.GENERATORS:
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            on_demand(ds, 'Hard', rng)
+        demand = (time.perf_counter() - started) / args.requests
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            pool.sample(ds, 'Hard')
+        sampled = (time.perf_counter() - started) / args.requests
+        print(f'{ds:<15} {demand * 1e3:>15.2f} ms {sampled * 1e6:>9.2f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Attempt journal: write overhead, windowed leaderboard reads, and compaction.
+
+    python benchmarks/bench_history.py --users 20000 --attempts 2000000
+
+Fills a throwaway database with --attempts journaled attempts by --users
+players, spread evenly over the last --days days, through history.record()
+in batches of 1000, as a write-behind flush would. Then reports:
+
+    writes      attempts/s recording progress alone (record_attempts) and
+                with the journal and rollups (plus history.record)
+    reads       top 10 of this week from rollup_week, against the same
+                answer computed by rescanning the week's journal rows
+    compaction  time to fold everything past ATTEMPTS_RETENTION_DAYS into
+                attempt_weeks, and the database size before and after
+                (after VACUUM)
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--attempts', type=int, default=2000000)
+    parser.add_argument('--days', type=int, default=60, help='days the attempts are spread over')
+    parser.add_argument('--write-sample', type=int, default=100000, help='attempts timed for the write cost')
+    parser.add_argument('--reads', type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ['DATABASE_PATH'] = os.path.join(tmp, 'history.db')
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import app  # noqa: F401  (creates the schema)
+    import history
+    from progress import record_attempts
+    from shards import router
+
+    rng = random.Random(1)
+    levels = [(ds, level_id) for ds in ('stack', 'queue', 'linkedlist', 'tree', 'graph') for level_id in range(1, 9)]
+    with router.directory.transaction() as conn:
+        conn.executemany('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                         [(f'u{n}', f'u{n}@example.com', '-') for n in range(args.users)])
+        conn.executemany('INSERT INTO user_stats (user_id) VALUES (?)', [(n + 1,) for n in range(args.users)])
+
+    def attempt():
+        ds, level_id = rng.choice(levels)
+        completed = rng.random() < 0.6
+        return (rng.randint(1, args.users), ds, level_id, completed, rng.randint(50, 200) if completed else 0,
+                rng.randint(5, 120), rng.randint(1, 15))
+
+    today = history.today()
+    print(f'{args.users} users, {args.attempts} attempts over {args.days} days\n')
+
+    # Writes
+    sample = [attempt() for _ in range(args.write_sample)]
+    for name, journal in (('record_attempts', False), ('+ history.record', True)):
+        started = time.perf_counter()
+        for start in range(0, len(sample), 1000):
+            with router.directory.transaction() as conn:
+                cursor = conn.cursor()
+                record_attempts(cursor, sample[start:start + 1000])
+                if journal:
+                    history.record(cursor, sample[start:start + 1000], today)
+        elapsed = time.perf_counter() - started
+        print(f'writes: {name:<20} {len(sample) / elapsed:>10,.0f} attempts/s')
+
+    # The rest of the journal, oldest day first
+    per_day = (args.attempts - len(sample)) // args.days
+    started = time.perf_counter()
+    for day in range(today - args.days + 1, today + 1):
+        for start in range(0, per_day, 1000):
+            with router.directory.transaction() as conn:
+                history.record(conn.cursor(), [attempt() for _ in range(min(1000, per_day - start))], day)
+    print(f'filled in {time.perf_counter() - started:.1f} s\n')
+
+    week = history.week_of(today)
+    rescan = '''
+        SELECT a.user_id, u.username,
+               SUM(CASE WHEN a.completed THEN a.score ELSE 0 END) AS total_score
+        FROM attempts a JOIN users u ON u.id = a.user_id
+        WHERE a.day BETWEEN ? AND ?
+        GROUP BY a.user_id ORDER BY total_score DESC, a.user_id LIMIT 10
+    '''
+    with router.directory.connection() as conn:
+        rolled = [entry['username'] for _, entry in history.top_keyed(conn, 'week', week, 10)]
+        scanned = [row['username'] for row in conn.execute(rescan, (week * 7 - 3, week * 7 + 3))]
+        if rolled != scanned:
+            raise SystemExit(f'rollup and rescan disagree: {rolled} != {scanned}')
+        for name, func in (
+            ('rollup_week', lambda: history.top_keyed(conn, 'week', week, 10)),
+            ('journal rescan', lambda: conn.execute(rescan, (week * 7 - 3, week * 7 + 3)).fetchall()),
+        ):
+            started = time.perf_counter()
+            for _ in range(args.reads):
+                func()
+            print(f'reads: {name:<21} {(time.perf_counter() - started) / args.reads * 1e3:>9.2f} ms')
+
+    def size():
+        return sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)) / 2 ** 20
+
+    with router.directory.connection() as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    before = size()
+    started = time.perf_counter()
+    folded = history.compactor.compact()
+    elapsed = time.perf_counter() - started
+    with router.directory.connection() as conn:
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    print(f'\ncompaction: folded {folded} attempts in {elapsed:.1f} s; '
+          f'database {before:.0f} MiB -> {size():.0f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Login throughput, and latency of other endpoints during a login storm.
+
+    python benchmarks/bench_logins.py --seconds 20
+    python benchmarks/bench_logins.py --configs inline,pool --login-clients 32
+
+Starts gunicorn (gthread) on a throwaway database once per config:
+
+    inline    PASSWORD_HASH_PROCESSES=0: scrypt on the request threads
+    pool      the defaults: niced hashing processes, bounded queue
+    unniced   the pool with PASSWORD_HASH_NICE=0
+
+Each run registers --users students, then measures two phases of --seconds
+each. In the quiet phase --readers threads request the leaderboard, their
+progress and their rank, with --think seconds between requests. In the
+storm phase the readers keep going while --login-clients threads log in
+back to back with correct passwords. Reported: reader p50/p99 in both
+phases, successful logins/s and their p99, and how many logins got 503.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_async import start_server  # noqa: E402
+from loadtest import OPERATIONS, HttpClient, password_for, register_population, summarize, username_for  # noqa: E402
+
+CONFIGS = {
+    'inline': {'PASSWORD_HASH_PROCESSES': '0'},
+    'pool': {},
+    'unniced': {'PASSWORD_HASH_NICE': '0'},
+}
+
+READS = ['leaderboard', 'progress_get', 'rank']
+
+
+class Loop(threading.Thread):
+    def __init__(self, port, pop, seed, stop, think=0):
+        super().__init__(daemon=True)
+        self.client = HttpClient(port)
+        self.pop = pop
+        self.rng = Random(seed)
+        self.stop = stop
+        self.think = think
+        self.samples = []
+        self.statuses = {}
+
+    def run(self):
+        while not self.stop.is_set():
+            method, path, body, headers = self.request()
+            start = time.perf_counter()
+            status, _ = self.client.request(method, path, body, headers)
+            elapsed = time.perf_counter() - start
+            if status and status < 500:
+                self.samples.append(elapsed)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if self.think:
+                time.sleep(self.rng.expovariate(1 / self.think))
+
+
+class Reader(Loop):
+    def request(self):
+        _, method, path, body, headers = OPERATIONS[self.rng.choice(READS)](self, self.rng)
+        return method, path, body, headers
+
+
+class LoginClient(Loop):
+    def request(self):
+        n, _ = self.rng.choice(self.pop.user_ids)
+        return 'POST', '/api/login', {'username': username_for(n), 'password': password_for(n)}, None
+
+
+def phase(threads, seconds):
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    threads[0].stop.set()
+    for thread in threads:
+        thread.join()
+
+
+def merged(threads, seconds):
+    samples = [value for thread in threads for value in thread.samples]
+    statuses = {}
+    for thread in threads:
+        for status, count in thread.statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return summarize(samples, statuses, seconds)
+
+
+def run_config(name, args):
+    saved = dict(os.environ)
+    os.environ.update(CONFIGS[name])
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            port, server = start_server('gthread', args, tmp)
+            try:
+                pop = register_population(HttpClient(port), args.users, 0, Random(args.seed))
+                quiet_stop = threading.Event()
+                quiet = [Reader(port, pop, args.seed * 1000 + n, quiet_stop, args.think) for n in range(args.readers)]
+                phase(quiet, args.seconds)
+
+                storm_stop = threading.Event()
+                readers = [Reader(port, pop, args.seed * 2000 + n, storm_stop, args.think)
+                           for n in range(args.readers)]
+                logins = [LoginClient(port, pop, args.seed * 3000 + n, storm_stop)
+                          for n in range(args.login_clients)]
+                phase(readers + logins, args.seconds)
+            finally:
+                server.terminate()
+                server.wait(timeout=60)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+    login = merged(logins, args.seconds)
+    return {
+        'config': name,
+        'quiet': merged(quiet, args.seconds),
+        'storm': merged(readers, args.seconds),
+        'login': login,
+        'login_rejected': login['statuses'].get('503', 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--configs', default='inline,pool', help=f'comma-separated, from {", ".join(CONFIGS)}')
+    parser.add_argument('--seconds', type=float, default=20, help='length of each phase')
+    parser.add_argument('--users', type=int, default=50, help='students registered before the run')
+    parser.add_argument('--readers', type=int, default=4, help='threads reading other endpoints')
+    parser.add_argument('--think', type=float, default=0.02, help='mean seconds between a reader\'s requests')
+    parser.add_argument('--login-clients', type=int, default=16, help='threads logging in back to back')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--worker-threads', type=int, default=16, help='threads per gthread worker')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print one JSON object per config instead')
+    args = parser.parse_args()
+    # start_server() also sets these
+    args.keep_alive, args.worker_connections = 75, 1000
+
+    if not args.json:
+        print(f'{"config":<8} {"quiet p50/p99 ms":>18} {"storm p50/p99 ms":>18} {"logins/s":>9} '
+              f'{"login p99 ms":>13} {"503s":>6}')
+    for name in args.configs.split(','):
+        r = run_config(name, args)
+        if args.json:
+            print(json.dumps(r))
+            continue
+        quiet, storm, login = r['quiet'], r['storm'], r['login']
+        print(f'{name:<8} {quiet["p50_ms"]:>8.1f} / {quiet["p99_ms"]:<7.1f} {storm["p50_ms"]:>8.1f} / '
+              f'{storm["p99_ms"]:<7.1f} {login["throughput_rps"]:>9.1f} {login["p99_ms"]:>13.1f} '
+              f'{r["login_rejected"]:>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Instrumentation overhead: timed vs. plain cursors, hooked vs. bare routes.
+
+    python benchmarks/bench_metrics.py --iterations 50000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask, jsonify  # noqa: E402
+
+import metrics  # noqa: E402
+
+
+def per_call(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def statement_cost(factory, iterations):
+    conn = sqlite3.connect(':memory:', isolation_level=None, factory=factory)
+    conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, score INTEGER)')
+    conn.executemany('INSERT INTO t VALUES (?, ?)', [(i, i * 7) for i in range(1000)])
+    cursor = conn.cursor()
+
+    def query():
+        cursor.execute('SELECT score FROM t WHERE id = ?', (42,))
+        cursor.fetchone()
+
+    return per_call(query, iterations)
+
+
+def request_cost(instrumented, iterations):
+    app = Flask(__name__)
+    if instrumented:
+        metrics.init_app(app)
+
+    @app.route('/ping/<int:n>')
+    def ping(n):
+        return jsonify({'n': n})
+
+    client = app.test_client()
+    return per_call(lambda: client.get('/ping/1'), iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=50000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    plain = statement_cost(sqlite3.Connection, n)
+    timed = statement_cost(metrics.TimedConnection, n)
+    print(f'SELECT + fetchone: plain {plain:6.2f} us  timed {timed:6.2f} us  (+{timed - plain:.2f} us)')
+
+    n = max(1, n // 10)
+    bare = request_cost(False, n)
+    hooked = request_cost(True, n)
+    print(f'test-client GET:   bare {bare:7.1f} us  hooked {hooked:7.1f} us  (+{hooked - bare:.1f} us)')
+
+    start = time.perf_counter()
+    text = metrics.exposition()
+    print(f'exposition: {len(text.splitlines())} lines in {(time.perf_counter() - start) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Query latency and plans before/after the index migrations, on a seeded database.
+
+    python benchmarks/seed.py --db /tmp/big.db --users 1000000 --progress 10000000
+    python benchmarks/bench_queries.py --db /tmp/big.db --plans
+
+"Before" is the original schema: no secondary indexes, and get_progress as
+three queries including a GROUP BY. "After" is the schema from migrations.py
+and the two-query read_progress(). The database is left migrated.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from random import Random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import migrations  # noqa: E402
+from database import PRAGMAS  # noqa: E402
+from leaderboard import _DS_QUERY, _GLOBAL_QUERY  # noqa: E402
+from progress import read_progress  # noqa: E402
+from rank_index import neighbours  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+GLOBAL_TOP = _GLOBAL_QUERY + ' ORDER BY us.total_score DESC, us.user_id LIMIT 100'
+DS_TOP = _DS_QUERY + ' GROUP BY gp.user_id ORDER BY total_score DESC, gp.user_id LIMIT 100'
+DS_ROW = _DS_QUERY + ' AND gp.user_id = ? GROUP BY gp.user_id'
+SCORE_HISTOGRAM = 'SELECT total_score, COUNT(*) FROM user_stats GROUP BY total_score'
+
+
+def old_get_progress(cursor, user_id):
+    # get_progress() as it was: stats, a GROUP BY, then every row
+    cursor.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
+    cursor.fetchone()
+    cursor.execute('''
+        SELECT data_structure,
+               COUNT(*) as total_levels,
+               SUM(CASE WHEN completed THEN 1 ELSE 0 END) as completed_levels,
+               SUM(best_score) as total_ds_score
+        FROM game_progress
+        WHERE user_id = ?
+        GROUP BY data_structure
+    ''', (user_id,))
+    cursor.fetchall()
+    cursor.execute('SELECT * FROM game_progress WHERE user_id = ?', (user_id,))
+    cursor.fetchall()
+
+
+def user_score(cursor, user_id):
+    cursor.execute('SELECT total_score FROM user_stats WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+# name -> (function(cursor, user_id, phase), [(sql, params(user_id)) to explain])
+QUERIES = {
+    'get_progress': (
+        lambda c, u, phase: old_get_progress(c, u) if phase == 'before' else read_progress(c, u),
+        [('SELECT * FROM game_progress WHERE user_id = ? ORDER BY data_structure, level_id', lambda u: (u,))],
+    ),
+    'leaderboard top 100': (
+        lambda c, u, phase: c.execute(GLOBAL_TOP).fetchall(),
+        [(GLOBAL_TOP, lambda u: ())],
+    ),
+    'leaderboard/<ds> rebuild': (
+        lambda c, u, phase: c.execute(DS_TOP, ('stack',)).fetchall(),
+        [(DS_TOP, lambda u: ('stack',))],
+    ),
+    'leaderboard/<ds> user row': (
+        lambda c, u, phase: c.execute(DS_ROW, ('stack', u)).fetchall(),
+        [(DS_ROW, lambda u: ('stack', u))],
+    ),
+    'rank neighbours': (
+        lambda c, u, phase: neighbours(c, u, user_score(c, u), 5),
+        [],
+    ),
+    'rank index load': (
+        lambda c, u, phase: c.execute(SCORE_HISTOGRAM).fetchall(),
+        [(SCORE_HISTOGRAM, lambda u: ())],
+    ),
+}
+
+
+def connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def measure(conn, phase, user_ids, samples, budget, rng):
+    cursor = conn.cursor()
+    results = {}
+    for name, (func, explain) in QUERIES.items():
+        func(cursor, rng.choice(user_ids), phase)  # warm the page cache
+        timings = []
+        deadline = time.perf_counter() + budget
+        while len(timings) < samples and (not timings or time.perf_counter() < deadline):
+            user_id = rng.choice(user_ids)
+            start = time.perf_counter()
+            func(cursor, user_id, phase)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        plans = []
+        for sql, params in explain:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params(user_ids[0]))
+            plans.append([row[-1] for row in cursor.fetchall()])
+        results[name] = {
+            'samples': len(timings),
+            'p50_ms': round(timings[len(timings) // 2] * 1000, 3),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000, 3),
+            'plans': plans,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', required=True, help='database filled by benchmarks/seed.py')
+    parser.add_argument('--samples', type=int, default=300, help='max runs per query')
+    parser.add_argument('--budget', type=float, default=5, help='max seconds per query')
+    parser.add_argument('--plans', action='store_true', help='print EXPLAIN QUERY PLAN output')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/queries-<time>.json)')
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    cursor = conn.cursor()
+    user_ids = [row[0] for row in cursor.execute('SELECT user_id FROM user_stats')]
+    progress_rows = cursor.execute('SELECT COUNT(*) FROM game_progress').fetchone()[0]
+    print(f'{len(user_ids)} users, {progress_rows} progress rows')
+
+    # Back to the original schema: no secondary indexes at all
+    started = time.perf_counter()
+    cursor.execute('BEGIN IMMEDIATE')
+    for index in migrations.index_names():
+        cursor.execute(f'DROP INDEX IF EXISTS {index}')
+    cursor.execute('PRAGMA user_version = 0')
+    cursor.execute('COMMIT')
+    cursor.execute('PRAGMA analysis_limit = 1000')
+    cursor.execute('ANALYZE')
+    print(f'dropped indexes in {time.perf_counter() - started:.1f} s')
+    before = measure(conn, 'before', user_ids, args.samples, args.budget, Random(1))
+
+    started = time.perf_counter()
+    cursor.execute('BEGIN IMMEDIATE')
+    migrations.migrate(cursor)
+    cursor.execute('COMMIT')
+    migrated_in = time.perf_counter() - started
+    cursor.execute('ANALYZE')
+    print(f'migrated to version {migrations.LATEST} in {migrated_in:.1f} s')
+    after = measure(conn, 'after', user_ids, args.samples, args.budget, Random(1))
+
+    print(f'\n{"query":<28} {"before p50":>11} {"p95":>10} {"after p50":>11} {"p95":>10} {"speedup":>8}')
+    for name in QUERIES:
+        b, a = before[name], after[name]
+        speedup = b['p50_ms'] / a['p50_ms'] if a['p50_ms'] else float('inf')
+        print(f'{name:<28} {b["p50_ms"]:>9.3f}ms {b["p95_ms"]:>8.3f}ms '
+              f'{a["p50_ms"]:>9.3f}ms {a["p95_ms"]:>8.3f}ms {speedup:>7.1f}x')
+        if args.plans:
+            for phase, result in (('before', b), ('after', a)):
+                for plan in result['plans']:
+                    print(f'    {phase:<6} ' + ' | '.join(plan))
+
+    output = args.output or os.path.join(RESULTS_DIR, f'queries-{datetime.now().strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'users': len(user_ids),
+            'progress_rows': progress_rows,
+            'sqlite': sqlite3.sqlite_version,
+            'migration_seconds': round(migrated_in, 2),
+            'before': before,
+            'after': after,
+        }, f, indent=2)
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
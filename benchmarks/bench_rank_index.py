@@ -0,0 +1,83 @@
+"""Rank lookups: Fenwick-tree rank index vs. SQL COUNT(*) on user_stats.
+
+Seeds a synthetic user_stats table, then times the same random rank
+queries both ways.
+
+    python benchmarks/bench_rank_index.py --users 2000000 --lookups 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(), 'rank.db')
+
+import app as api  # noqa: E402,F401  (creates the schema)
+from database import pool  # noqa: E402
+from rank_index import RankIndex  # noqa: E402
+
+
+def seed(users, rng):
+    # Long-tailed scores, roughly what accumulated totals look like.
+    with pool.transaction() as conn:
+        conn.executemany(
+            'INSERT INTO users (id, username, email, password_hash) VALUES (?, ?, ?, ?)',
+            ((i, f'user{i}', f'user{i}@example.com', '') for i in range(1, users + 1)))
+        conn.executemany(
+            'INSERT INTO user_stats (user_id, total_score) VALUES (?, ?)',
+            ((i, int(rng.expovariate(1 / 1500))) for i in range(1, users + 1)))
+
+
+def timed(func, scores):
+    start = time.perf_counter()
+    results = [func(score) for score in scores]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    start = time.perf_counter()
+    seed(args.users, rng)
+    print(f'seeded {args.users} users in {time.perf_counter() - start:.1f}s')
+
+    index = RankIndex()
+    with pool.connection() as conn:
+        start = time.perf_counter()
+        index.load(conn)
+        print(f'index build: {(time.perf_counter() - start) * 1000:.0f} ms')
+
+        scores = [row[0] for row in conn.execute(
+            'SELECT total_score FROM user_stats ORDER BY random() LIMIT ?', (args.lookups,))]
+
+        def sql_rank(score):
+            return 1 + conn.execute(
+                'SELECT COUNT(*) FROM user_stats WHERE total_score > ?', (score,)).fetchone()[0]
+
+        def sql_rank_unindexed(score):
+            return 1 + conn.execute(
+                'SELECT COUNT(*) FROM user_stats NOT INDEXED WHERE total_score > ?',
+                (score,)).fetchone()[0]
+
+        fenwick, fenwick_time = timed(index.rank, scores)
+        indexed, indexed_time = timed(sql_rank, scores)
+        scanned, scanned_time = timed(sql_rank_unindexed, scores[:max(1, len(scores) // 10)])
+
+    assert fenwick == indexed and fenwick[:len(scanned)] == scanned
+    for name, elapsed, count in (
+        ('rank index', fenwick_time, len(scores)),
+        ('COUNT(*) using score index', indexed_time, len(scores)),
+        ('COUNT(*) table scan', scanned_time, len(scanned)),
+    ):
+        print(f'{name:>28}: {elapsed / count * 1e6:10.1f} us/lookup')
+
+
+if __name__ == '__main__':
+    main()
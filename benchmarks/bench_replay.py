@@ -0,0 +1,72 @@
+"""Operation-log replay throughput, one verify() per log vs. verify_many().
+
+    python benchmarks/bench_replay.py --logs 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import replay  # noqa: E402
+import solver  # noqa: E402
+from level_catalog import catalog  # noqa: E402
+
+
+def solution_log(data_structure, level):
+    moves = solver.solve(data_structure, level)
+    return [[m['operation'], m.get('value'), m.get('position')] for m in moves]
+
+
+def noisy_log(log, level, rng):
+    # A losing log: the solution cut short, with a few random allowed ops.
+    ops = sorted(level['operations'])
+    values = level['target'] + level['initial'] or ['A']
+    noisy = log[:rng.randint(0, len(log) - 1)]
+    for _ in range(rng.randint(0, 3)):
+        noisy.append([rng.choice(ops), rng.choice(values), rng.randint(0, 4)])
+    return noisy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--logs', type=int, default=20000, help='submissions to verify')
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    solutions = []
+    for ds in catalog.data_structures:
+        for level in catalog.levels[ds]:
+            try:
+                solutions.append((ds, level, solution_log(ds, level)))
+            except solver.Unsolvable:
+                pass
+
+    submissions = []
+    for _ in range(args.logs):
+        ds, level, log = rng.choice(solutions)
+        if rng.random() < 0.3:
+            log = noisy_log(log, level, rng)
+        submissions.append((ds, level['id'], log, rng.randint(5, 60), rng.randint(0, 2)))
+
+    wins = sum(r.won for r in replay.verify_many(submissions))
+    print(f'{len(submissions)} logs from {len(solutions)} solvable levels, {wins} wins')
+
+    start = time.perf_counter()
+    for submission in submissions:
+        replay.verify(*submission)
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    replay.verify_many(submissions)
+    batched = time.perf_counter() - start
+
+    for label, seconds in (('verify() per log', single), ('verify_many()', batched)):
+        print(f'{label:>17}: {len(submissions) / seconds:10.0f} replays/s  '
+              f'{seconds / len(submissions) * 1e6:6.1f} us/replay')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Thundering herd on the leaderboard and progress reads, with and without the response cache.
+
+    python benchmarks/bench_response_cache.py --clients 64 --rounds 50
+    python benchmarks/bench_response_cache.py --configs off,cache --writers 2
+
+Starts gunicorn (gthread) on a throwaway database once per config:
+
+    off     RESPONSE_CACHE_TTL=0: every read runs its queries
+    cache   the defaults (1 s TTL, single-flight fills)
+
+Each run registers --users students and posts a few attempts for each, so
+the leaderboard has something to rank. Then --clients threads, all
+released at once by a barrier, each send one read per round. Every round
+picks one board (global or a data structure's) and most clients request
+it, the way a class refreshes the leaderboard together when a round
+ends; --progress-ratio of them read their own progress instead. --writers
+threads post progress every --write-interval seconds meanwhile, so
+entries keep being invalidated. Reported per config: reads/s, p50/p99 of
+the reads, SQL statements run per read (from /api/metrics, all workers)
+and the cache's hit, miss and coalesced counts.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_async import start_server  # noqa: E402
+from loadtest import OPERATIONS, HttpClient, register_population, summarize  # noqa: E402
+from leaderboard import DATA_STRUCTURES  # noqa: E402
+
+OPERATOR_KEY = 'bench-operator-key'
+
+CONFIGS = {
+    'off': {'RESPONSE_CACHE_TTL': '0'},
+    'cache': {},
+}
+
+
+def metric_totals(port):
+    # {(name, result label or None): value} for the counters read below,
+    # summed over the other labels
+    conn = HttpClient(port).conn
+    conn.request('GET', '/api/metrics', headers={'Authorization': f'Bearer {OPERATOR_KEY}'})
+    text = conn.getresponse().read().decode()
+    totals = {}
+    for line in text.splitlines():
+        match = re.match(r'(sqlite_statement_duration_seconds_count|response_cache_requests_total)\b.* (\S+)$', line)
+        if match:
+            result = re.search(r'result="(\w+)"', line)
+            key = (match.group(1), result and result.group(1))
+            totals[key] = totals.get(key, 0) + float(match.group(2))
+    return totals
+
+
+def flush_workers(port):
+    # Snapshots are written by requests at most about once a second, so
+    # wait, then send a few requests on fresh connections to reach each worker
+    time.sleep(1.5)
+    for _ in range(20):
+        HttpClient(port).request('GET', '/api/health')
+
+
+def statements(totals):
+    return totals.get(('sqlite_statement_duration_seconds_count', None), 0)
+
+
+class Herd(threading.Thread):
+    def __init__(self, port, pop, n, barrier, boards, progress_ratio):
+        super().__init__(daemon=True)
+        self.client = HttpClient(port)
+        self.pop = pop
+        self.rng = Random(n)
+        self.barrier = barrier
+        self.boards = boards
+        self.progress_ratio = progress_ratio
+        self.samples = []
+        self.statuses = {}
+
+    def run(self):
+        for path in self.boards:
+            if self.rng.random() < self.progress_ratio:
+                _, method, path, body, headers = OPERATIONS['progress_get'](self, self.rng)
+            else:
+                method, body, headers = 'GET', None, None
+            self.barrier.wait()
+            start = time.perf_counter()
+            status, _ = self.client.request(method, path, body, headers)
+            elapsed = time.perf_counter() - start
+            if status and status < 500:
+                self.samples.append(elapsed)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+class Writer(threading.Thread):
+    def __init__(self, port, pop, n, stop, interval=0):
+        super().__init__(daemon=True)
+        self.client = HttpClient(port)
+        self.pop = pop
+        self.rng = Random(-n)
+        self.stop = stop
+        self.interval = interval
+        self.writes = 0
+
+    def run(self):
+        while not self.stop.is_set():
+            self.write()
+            self.stop.wait(self.interval)
+
+    def write(self):
+        _, method, path, body, headers = OPERATIONS['progress_post'](self, self.rng)
+        self.client.request(method, path, body, headers)
+        self.writes += 1
+
+
+def run_config(name, args):
+    saved = dict(os.environ)
+    os.environ.update(CONFIGS[name])
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ['METRICS_DIR'] = os.path.join(tmp, 'metrics')
+            os.environ['OPERATOR_KEY'] = OPERATOR_KEY
+            port, server = start_server('gthread', args, tmp)
+            try:
+                pop = register_population(HttpClient(port), args.users, 0, Random(args.seed))
+                flush_workers(port)
+                registered = metric_totals(port)
+                seeder = Writer(port, pop, 0, None)
+                for _ in range(args.users * 3):
+                    seeder.write()
+                flush_workers(port)
+                before = metric_totals(port)
+                # The writers' statements land in the same counter; take
+                # them out at what the seeding writes cost on average
+                per_write = (statements(before) - statements(registered)) / seeder.writes
+
+                rng = Random(args.seed)
+                boards = [f'/api/leaderboard/{rng.choice(DATA_STRUCTURES)}' if rng.random() < 0.5
+                          else '/api/leaderboard?limit=10' for _ in range(args.rounds)]
+                stop = threading.Event()
+                writers = [Writer(port, pop, n + 1, stop, args.write_interval) for n in range(args.writers)]
+                barrier = threading.Barrier(args.clients)
+                herd = [Herd(port, pop, args.seed * 1000 + n, barrier, boards, args.progress_ratio)
+                        for n in range(args.clients)]
+                for thread in writers:
+                    thread.start()
+                started = time.perf_counter()
+                for thread in herd:
+                    thread.start()
+                for thread in herd:
+                    thread.join()
+                elapsed = time.perf_counter() - started
+                stop.set()
+                for thread in writers:
+                    thread.join()
+
+                flush_workers(port)
+                after = metric_totals(port)
+            finally:
+                server.terminate()
+                server.wait(timeout=60)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+    samples = [value for thread in herd for value in thread.samples]
+    statuses = {}
+    for thread in herd:
+        for status, count in thread.statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    delta = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+    reads = args.clients * args.rounds
+    writes = sum(thread.writes for thread in writers)
+    return {
+        'config': name,
+        'reads': summarize(samples, statuses, elapsed),
+        'writes': writes,
+        'sql_statements': max(0, round(statements(delta) - writes * per_write)),
+        'hits': int(delta.get(('response_cache_requests_total', 'hit'), 0)),
+        'misses': int(delta.get(('response_cache_requests_total', 'miss'), 0)),
+        'coalesced': int(delta.get(('response_cache_requests_total', 'coalesced'), 0)),
+        'total_reads': reads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--configs', default='off,cache', help=f'comma-separated, from {", ".join(CONFIGS)}')
+    parser.add_argument('--clients', type=int, default=64, help='threads released together each round')
+    parser.add_argument('--rounds', type=int, default=50, help='reads per client')
+    parser.add_argument('--progress-ratio', type=float, default=0.2, help='share of reads that are own progress')
+    parser.add_argument('--writers', type=int, default=1, help='threads posting progress meanwhile')
+    parser.add_argument('--write-interval', type=float, default=0.05, help='seconds between a writer\'s posts')
+    parser.add_argument('--users', type=int, default=50, help='students registered before the run')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--worker-threads', type=int, default=32, help='threads per gthread worker')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print one JSON object per config instead')
+    args = parser.parse_args()
+    # start_server() also sets these
+    args.keep_alive, args.worker_connections = 75, 1000
+
+    if not args.json:
+        print(f'{"config":<7} {"reads/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"5xx":>5} {"writes":>7} '
+              f'{"SQL/read":>9} {"hit":>6} {"miss":>6} {"coalesced":>9}')
+    for name in args.configs.split(','):
+        r = run_config(name, args)
+        if args.json:
+            print(json.dumps(r))
+            continue
+        reads = r['reads']
+        print(f'{name:<7} {reads["throughput_rps"]:>8.1f} {reads["p50_ms"]:>8.1f} {reads["p99_ms"]:>8.1f} '
+              f'{reads["errors"]:>5} {r["writes"]:>7} {r["sql_statements"] / r["total_reads"]:>9.2f} '
+              f'{r["hits"]:>6} {r["misses"]:>6} {r["coalesced"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
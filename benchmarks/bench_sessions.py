@@ -0,0 +1,84 @@
+"""Session token cost: validation paths, @require_session, and the users lookup it replaces.
+
+    python benchmarks/bench_sessions.py --iterations 200000
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(), 'bench.db'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask import Flask, jsonify  # noqa: E402
+
+import app as api  # noqa: E402
+from bench_metrics import per_call  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    store = SessionStore(secret=b'x' * 32)
+    token, _ = store.issue(42, 'student', 'student@example.com')
+    # cache_size=0 forgets every token at once, so each check is a miss
+    cold = SessionStore(secret=b'x' * 32, cache_size=0)
+    forged = token[:-4] + 'AAAA'
+
+    print(f'issue:                  {per_call(lambda: store.issue(42), n):6.2f} us')
+    print(f'validate, cached:       {per_call(lambda: store.validate(token), n):6.2f} us')
+    print(f'validate, not cached:   {per_call(lambda: cold.validate(token), n):6.2f} us  (HMAC-SHA256)')
+    print(f'validate, forged:       {per_call(lambda: cold.validate(forged), n):6.2f} us')
+
+    # The whole decorator inside a request context, against the bare view
+    flask_app = Flask(__name__)
+    header, _ = api.sessions.issue(1)
+
+    def view():
+        return 'ok'
+
+    protected = api.require_session(view)
+    with flask_app.test_request_context(headers={'Authorization': f'Bearer {header}'}):
+        bare = per_call(view, n)
+        wrapped = per_call(protected, n)
+    print(f'@require_session:       {wrapped - bare:6.2f} us  (bare view {bare:.2f} us)')
+
+    # What a per-request check against users would cost instead
+    client = api.app.test_client()
+    user_id = client.post('/api/register', json={
+        'username': 'student', 'email': 'student@example.com', 'password': 'password'}).get_json()['user']['id']
+    with api.router.directory.connection() as conn:
+        cursor = conn.cursor()
+
+        def lookup():
+            cursor.execute('SELECT id, username, email FROM users WHERE id = ?', (user_id,))
+            cursor.fetchone()
+
+        print(f'users lookup (pooled):  {per_call(lookup, n):6.2f} us')
+
+    ping = Flask(__name__)
+
+    @ping.route('/open')
+    def open_route():
+        return jsonify({'ok': True})
+
+    @ping.route('/private')
+    @api.require_session
+    def private_route():
+        return jsonify({'user_id': api.g.session.user_id})
+
+    ping_client = ping.test_client()
+    n = max(1, n // 20)
+    headers = {'Authorization': f'Bearer {header}'}
+    open_cost = per_call(lambda: ping_client.get('/open', headers=headers), n)
+    private_cost = per_call(lambda: ping_client.get('/private', headers=headers), n)
+    print(f'test-client GET:        open {open_cost:7.1f} us  authenticated {private_cost:7.1f} us  '
+          f'(+{private_cost - open_cost:.1f} us)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Sustained POST /api/progress writes/sec as shards are added.
+
+    python benchmarks/bench_shards.py --processes 8 --seconds 10
+    python benchmarks/bench_shards.py --target gunicorn --workers 8 --synchronous NORMAL
+
+Each SHARD_COUNT runs in a fresh process on its own database. With
+--target client, --processes forked writers post through the Flask test
+client, so only the app and SQLite are measured; --target gunicorn adds
+HTTP. The default SQLITE_SYNCHRONOUS=FULL fsyncs every commit, so the write
+lock is held across an fsync, which is where a single file hurts most.
+After the run the stored total_attempts must equal the acknowledged writes.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_write_behind import drive  # noqa: E402
+from loadtest import InProcessClient, solution_log, start_gunicorn  # noqa: E402
+
+
+def register(client, users):
+    # user_id -> session token
+    tokens = {}
+    for n in range(users):
+        status, body = client.request('POST', '/api/register', {
+            'username': f'student{n}', 'email': f'student{n}@example.com', 'password': 'password'})
+        tokens[body['user']['id']] = body['token']
+    return tokens
+
+
+def writer(flask_app, tokens, index, deadline, results):
+    rng = Random(index)
+    client = InProcessClient(flask_app)
+    latencies = []
+    acked = 0
+    user_ids = list(tokens)
+    while time.perf_counter() < deadline:
+        user_id = rng.choice(user_ids)
+        level_id = rng.randint(1, 3)
+        body = {'user_id': user_id, 'data_structure': 'stack', 'level_id': level_id,
+                'time_taken': rng.randint(5, 60), 'operation_log': solution_log('stack', level_id)}
+        start = time.perf_counter()
+        status, _ = client.request('POST', '/api/progress', body, {'Authorization': f'Bearer {tokens[user_id]}'})
+        latencies.append(time.perf_counter() - start)
+        if status == 200:
+            acked += 1
+    results.put((acked, latencies))
+
+
+def run_processes(processes, users, seconds):
+    import app
+    tokens = register(InProcessClient(app.app), users)
+    app.router.close_all()
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    deadline = time.perf_counter() + seconds
+    writers = [context.Process(target=writer, args=(app.app, tokens, i, deadline, results))
+               for i in range(processes)]
+    for process in writers:
+        process.start()
+    collected = [results.get() for _ in writers]
+    for process in writers:
+        process.join()
+    acked = sum(a for a, _ in collected)
+    latencies = sorted(l for _, ls in collected for l in ls)
+    return acked, latencies
+
+
+def child(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(SHARD_COUNT=str(args.shards), SQLITE_SYNCHRONOUS=args.synchronous,
+                          PROGRESS_WRITE_BEHIND='0', DATABASE_PATH=os.path.join(tmp, 'bench.db'))
+        if args.target == 'gunicorn':
+            make_client, server = start_gunicorn(args, tmp)
+            os.environ['DATABASE_PATH'] = os.path.join(tmp, 'loadtest.db')
+            started = time.perf_counter()
+            acked, latencies = drive(make_client, args.users, args.threads, args.seconds)
+            elapsed = time.perf_counter() - started
+            server.terminate()
+            server.wait(timeout=60)
+        else:
+            acked, latencies = run_processes(args.processes, args.users, args.seconds)
+            elapsed = args.seconds
+
+        db = os.environ['DATABASE_PATH']
+        paths = [db] if args.shards == 1 else [f'{os.path.splitext(db)[0]}-shard{n}.db' for n in range(args.shards)]
+        stored = sum(sqlite3.connect(path).execute('SELECT TOTAL(total_attempts) FROM user_stats').fetchone()[0]
+                     for path in paths)
+        print(json.dumps({
+            'shards': args.shards, 'acked': acked, 'stored': int(stored),
+            'writes_per_sec': acked / elapsed,
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+        }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--target', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--shard-counts', default='1,2,4,8', help='comma-separated SHARD_COUNT values')
+    parser.add_argument('--synchronous', choices=('NORMAL', 'FULL'), default='FULL',
+                        help='SQLITE_SYNCHRONOUS for the run')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=1000, help='students writing progress')
+    parser.add_argument('--processes', type=int, default=8, help='writer processes (client target)')
+    parser.add_argument('--threads', type=int, default=16, help='client threads (gunicorn target)')
+    parser.add_argument('--workers', type=int, default=8, help='gunicorn worker processes')
+    parser.add_argument('--worker-threads', type=int, default=2, help='gunicorn threads per worker')
+    parser.add_argument('--shards', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.shards:
+        return child(args)
+
+    print(f'{"shards":>6} {"writes/s":>9} {"speedup":>8} {"p50 ms":>8} {"p99 ms":>8}  stored/acked')
+    baseline = None
+    for shards in args.shard_counts.split(','):
+        out = subprocess.run(
+            [sys.executable, __file__, '--shards', shards, '--target', args.target,
+             '--synchronous', args.synchronous, '--seconds', str(args.seconds), '--users', str(args.users),
+             '--processes', str(args.processes), '--threads', str(args.threads),
+             '--workers', str(args.workers), '--worker-threads', str(args.worker_threads)],
+            capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        baseline = baseline or r['writes_per_sec']
+        check = 'ok' if r['stored'] == r['acked'] else 'MISMATCH'
+        print(f'{r["shards"]:>6} {r["writes_per_sec"]:>9.0f} {r["writes_per_sec"] / baseline:>7.2f}x '
+              f'{r["p50_ms"]:>8.2f} {r["p99_ms"]:>8.2f}  {r["stored"]}/{r["acked"]} {check}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Solve time per level, and hint latency from cold and warm caches.
+
+    python benchmarks/bench_solver.py --midgame 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import solver  # noqa: E402
+from level_catalog import catalog  # noqa: E402
+
+
+def random_walk(data_structure, level, steps, rng):
+    # A plausible mid-game state: a few random legal moves from the start.
+    model, state, _ = solver.make_model(data_structure, level)
+    for _ in range(steps):
+        options = list(model.successors(state))
+        if not options:
+            break
+        state = rng.choice(options)[1]
+    return model.decode(state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--midgame', type=int, default=300, help='random mid-game hint queries')
+    parser.add_argument('--show', type=int, default=10, help='slowest levels to list')
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    timings = []
+    for ds in catalog.data_structures:
+        for level in catalog.levels[ds]:
+            start = time.perf_counter()
+            try:
+                optimum = len(solver.solve(ds, level))
+            except solver.Unsolvable:
+                optimum = None
+            timings.append(((time.perf_counter() - start) * 1000, ds, level, optimum))
+
+    print(f'{"level":<32} {"optimal":>7} {"maxMoves":>8} {"ms":>8}')
+    for ms, ds, level, optimum in sorted(timings, key=lambda t: t[0], reverse=True)[:args.show]:
+        name = f'{ds} {level["id"]} {level["name"]}'
+        print(f'{name:<32} {str(optimum):>7} {level["maxMoves"]:>8} {ms:8.2f}')
+
+    for ds in catalog.data_structures:
+        ms = [t[0] for t in timings if t[1] == ds]
+        print(f'{ds:>10}: mean {statistics.mean(ms):6.2f} ms  max {max(ms):6.2f} ms')
+    unsolvable = [f'{ds} {level["id"]}' for _, ds, level, optimum in timings if optimum is None]
+    print('unsolvable levels:', ', '.join(unsolvable) or 'none')
+
+    queries = []
+    for _ in range(args.midgame):
+        ds = rng.choice(catalog.data_structures)
+        level = rng.choice(catalog.levels[ds])
+        queries.append((ds, level, random_walk(ds, level, rng.randint(0, 4), rng)))
+
+    for label in ('cold cache', 'warm cache'):
+        if label == 'cold cache':
+            solver.hint_cache = solver.HintCache()
+        samples = []
+        for ds, level, state in queries:
+            start = time.perf_counter()
+            try:
+                solver.next_move(ds, level['id'], level, state)
+            except solver.Unsolvable:
+                pass
+            samples.append((time.perf_counter() - start) * 1e6)
+        samples.sort()
+        print(f'hint, {label}: p50 {samples[len(samples) // 2]:8.1f} us  '
+              f'p99 {samples[int(len(samples) * 0.99)]:8.1f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Sustained POST /api/progress writes/sec: synchronous vs. write-behind.
+
+    python benchmarks/bench_write_behind.py --threads 16 --seconds 10
+    python benchmarks/bench_write_behind.py --target gunicorn --workers 4
+
+Models a classroom finishing the same level at once: every thread posts
+attempts for a shared pool of users on a handful of levels. Each mode runs
+in a fresh process on its own database. After a clean shutdown the stored
+total_attempts must equal the number of acknowledged requests.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from random import Random
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import InProcessClient, solution_log, start_gunicorn  # noqa: E402
+
+MODES = {
+    'sync': {'PROGRESS_WRITE_BEHIND': '0'},
+    'write-behind': {'PROGRESS_WRITE_BEHIND': '1'},
+    'write-behind+journal': {'PROGRESS_WRITE_BEHIND': '1', 'WRITE_BEHIND_JOURNAL': '{tmp}/journal'},
+    'write-behind+fsync': {'PROGRESS_WRITE_BEHIND': '1', 'WRITE_BEHIND_JOURNAL': '{tmp}/journal',
+                           'WRITE_BEHIND_FSYNC': '1'},
+}
+
+
+def drive(make_client, users, threads, seconds):
+    tokens = {}
+    client = make_client()
+    for n in range(users):
+        status, body = client.request('POST', '/api/register', {
+            'username': f'student{n}', 'email': f'student{n}@example.com', 'password': 'password'})
+        tokens[body['user']['id']] = body['token']
+    user_ids = list(tokens)
+
+    results = []
+    deadline = time.perf_counter() + seconds
+
+    def worker(index):
+        rng = Random(index)
+        client = make_client()
+        latencies = []
+        acked = 0
+        while time.perf_counter() < deadline:
+            user_id = rng.choice(user_ids)
+            level_id = rng.randint(1, 3)
+            body = {'user_id': user_id, 'data_structure': 'stack', 'level_id': level_id,
+                    'time_taken': rng.randint(5, 60), 'operation_log': solution_log('stack', level_id)}
+            start = time.perf_counter()
+            status, _ = client.request('POST', '/api/progress', body,
+                                       {'Authorization': f'Bearer {tokens[user_id]}'})
+            latencies.append(time.perf_counter() - start)
+            if status in (200, 202):
+                acked += 1
+        results.append((acked, latencies))
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    acked = sum(a for a, _ in results)
+    latencies = sorted(l for _, ls in results for l in ls)
+    return acked, latencies
+
+
+def child(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, value in MODES[args.mode].items():
+            os.environ[name] = value.format(tmp=tmp)
+        if 'WRITE_BEHIND_JOURNAL' in os.environ:
+            os.makedirs(os.environ['WRITE_BEHIND_JOURNAL'], exist_ok=True)
+        db = os.path.join(tmp, 'bench.db')
+        os.environ['DATABASE_PATH'] = db
+
+        server = None
+        if args.target == 'gunicorn':
+            make_client, server = start_gunicorn(args, tmp)
+            db = os.path.join(tmp, 'loadtest.db')
+        else:
+            import app
+            make_client = lambda: InProcessClient(app.app)  # noqa: E731
+
+        started = time.perf_counter()
+        acked, latencies = drive(make_client, args.users, args.threads, args.seconds)
+        elapsed = time.perf_counter() - started
+
+        # Clean shutdown, then everything acknowledged must be in SQLite
+        drain = time.perf_counter()
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=60)
+        else:
+            app.progress_buffer.close()
+        drain = time.perf_counter() - drain
+
+        stored = sqlite3.connect(db).execute('SELECT SUM(total_attempts) FROM user_stats').fetchone()[0] or 0
+        print(json.dumps({
+            'mode': args.mode, 'acked': acked, 'stored': stored,
+            'writes_per_sec': acked / elapsed,
+            'p50_ms': latencies[len(latencies) // 2] * 1000,
+            'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+            'drain_s': drain,
+        }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--target', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=30, help='students sharing the levels')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--worker-threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--modes', default=','.join(MODES), help='comma-separated subset of ' + ', '.join(MODES))
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        return child(args)
+
+    print(f'{"mode":<22} {"writes/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"drain s":>8}  stored/acked')
+    for mode in args.modes.split(','):
+        out = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--target', args.target, '--threads', str(args.threads),
+             '--seconds', str(args.seconds), '--users', str(args.users), '--workers', str(args.workers),
+             '--worker-threads', str(args.worker_threads)],
+            capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        check = 'ok' if r['stored'] == r['acked'] else 'MISMATCH'
+        print(f'{mode:<22} {r["writes_per_sec"]:>9.0f} {r["p50_ms"]:>8.2f} {r["p99_ms"]:>8.2f} '
+              f'{r["drain_s"]:>8.2f}  {r["stored"]}/{r["acked"]} {check}')
+
+
+if __name__ == '__main__':
+    main()
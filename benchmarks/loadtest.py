@@ -0,0 +1,462 @@
+"""Load test for the Flask API: throughput and p50/p95/p99 per endpoint.
+
+Runs in-process through the Flask test client (default) or against a local
+gunicorn started on a throwaway database, so nothing leaves the machine.
+A synthetic population is registered first, then threads drive one of the
+scenarios below. Every thread has its own seeded RNG, so a run replays the
+same request sequence. Results are written as JSON; pass an earlier file
+with --compare to flag regressions (exit status 1).
+
+    python benchmarks/loadtest.py --scenario mixed --threads 8 --seconds 10
+    python benchmarks/loadtest.py --target gunicorn --workers 4 --scenario read-during-writes
+    python benchmarks/loadtest.py --scenario write-contention --compare benchmarks/results/old.json
+
+Scenarios:
+    mixed               a typical session mix of reads, progress writes, logins and signups
+    write-contention    every thread posts progress for a handful of hot users and levels
+    read-during-writes  half the threads hammer progress writes, half read leaderboards and ranks
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from random import Random
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import solver  # noqa: E402
+from level_catalog import catalog  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# scenario -> thread groups of (share of threads, {operation: weight})
+SCENARIOS = {
+    'mixed': [
+        (1.0, {
+            'login': 4, 'register': 1,
+            'progress_get': 12, 'progress_post': 25, 'progress_batch': 2,
+            'leaderboard': 15, 'leaderboard_ds': 8, 'rank': 8,
+            'levels': 10, 'catalog': 10, 'hint': 5,
+        }),
+    ],
+    'write-contention': [
+        (1.0, {'progress_post_hot': 9, 'progress_batch_hot': 1}),
+    ],
+    'read-during-writes': [
+        (0.5, {'progress_post': 9, 'progress_batch': 1}),
+        (0.5, {'leaderboard': 5, 'leaderboard_ds': 3, 'rank': 2}),
+    ],
+}
+
+
+def password_for(n):
+    return f'password{n}'
+
+
+def username_for(n):
+    return f'loaduser{n}'
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, path, payload, headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            return 0, None
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+class Population:
+    def __init__(self, user_ids, tokens, hot_users, hot_levels):
+        self.user_ids = user_ids
+        self.tokens = tokens
+        self.hot_users = hot_users
+        self.hot_levels = hot_levels
+        self.levels = playable_levels()
+        self.catalog_etag = f'"{catalog.version}"'
+
+
+def register_population(client, users, hot_users, rng):
+    user_ids = []
+    tokens = {}
+    for n in range(users):
+        status, body = client.request('POST', '/api/register', {
+            'username': username_for(n), 'email': f'{username_for(n)}@example.com',
+            'password': password_for(n),
+        })
+        if status != 201:
+            raise RuntimeError(f'Registering the population failed with HTTP {status}: {body}')
+        user_ids.append((n, body['user']['id']))
+        tokens[body['user']['id']] = body['token']
+    return Population(user_ids, tokens, rng.sample(user_ids, min(hot_users, users)), rng.sample(playable_levels(), 3))
+
+
+def auth(ctx, user_id):
+    return {'Authorization': f'Bearer {ctx.pop.tokens[user_id]}'}
+
+
+_solutions = {}
+
+
+def solution_log(data_structure, level_id):
+    # The level's optimal play as an operation_log, solved once; None if the
+    # solver cannot finish the level
+    key = (data_structure, level_id)
+    if key not in _solutions:
+        try:
+            _solutions[key] = solver.solve(data_structure, catalog.level(data_structure, level_id))
+        except solver.Unsolvable:
+            _solutions[key] = None
+    return _solutions[key]
+
+
+def playable_levels():
+    # Catalog levels an attempt can carry a winning log for
+    return [(ds, level['id']) for ds in catalog.data_structures for level in catalog.levels[ds]
+            if solution_log(ds, level['id']) is not None]
+
+
+def _attempt(rng, user_id, level):
+    # The server scores attempts by replaying their log: 60% win, the rest
+    # stop partway through the solution
+    ds, level_id = level
+    log = solution_log(ds, level_id)
+    if rng.random() >= 0.6:
+        log = log[:rng.randrange(len(log))]
+    return {
+        'user_id': user_id, 'data_structure': ds, 'level_id': level_id,
+        'time_taken': rng.randint(5, 120), 'operation_log': log,
+    }
+
+
+# Each operation returns (endpoint label, method, path, body, headers).
+def op_login(ctx, rng):
+    n, _ = rng.choice(ctx.pop.user_ids)
+    return 'POST /api/login', 'POST', '/api/login', {'username': username_for(n), 'password': password_for(n)}, None
+
+
+def op_register(ctx, rng):
+    ctx.signups += 1
+    name = f'signup{ctx.index}x{ctx.signups}'
+    return 'POST /api/register', 'POST', '/api/register', {
+        'username': name, 'email': f'{name}@example.com', 'password': 'password',
+    }, None
+
+
+def op_progress_get(ctx, rng):
+    _, user_id = rng.choice(ctx.pop.user_ids)
+    return 'GET /api/progress/<id>', 'GET', f'/api/progress/{user_id}', None, auth(ctx, user_id)
+
+
+def op_progress_post(ctx, rng, users=None, levels=None):
+    _, user_id = rng.choice(users or ctx.pop.user_ids)
+    body = _attempt(rng, user_id, rng.choice(levels or ctx.pop.levels))
+    return 'POST /api/progress', 'POST', '/api/progress', body, auth(ctx, user_id)
+
+
+def op_progress_batch(ctx, rng, users=None, levels=None):
+    # A batch is one student's queued attempts
+    _, user_id = rng.choice(users or ctx.pop.user_ids)
+    attempts = [_attempt(rng, user_id, rng.choice(levels or ctx.pop.levels)) for _ in range(20)]
+    return 'POST /api/progress/batch', 'POST', '/api/progress/batch', {'attempts': attempts}, auth(ctx, user_id)
+
+
+def op_progress_post_hot(ctx, rng):
+    return op_progress_post(ctx, rng, ctx.pop.hot_users, ctx.pop.hot_levels)
+
+
+def op_progress_batch_hot(ctx, rng):
+    return op_progress_batch(ctx, rng, ctx.pop.hot_users, ctx.pop.hot_levels)
+
+
+def op_leaderboard(ctx, rng):
+    return 'GET /api/leaderboard', 'GET', f'/api/leaderboard?limit={rng.choice((10, 50, 100))}', None, None
+
+
+def op_leaderboard_ds(ctx, rng):
+    ds = rng.choice(catalog.data_structures)
+    return 'GET /api/leaderboard/<ds>', 'GET', f'/api/leaderboard/{ds}', None, None
+
+
+def op_rank(ctx, rng):
+    _, user_id = rng.choice(ctx.pop.user_ids)
+    return 'GET /api/rank/<id>', 'GET', f'/api/rank/{user_id}?around=5', None, auth(ctx, user_id)
+
+
+def op_levels(ctx, rng):
+    ds = rng.choice(catalog.data_structures)
+    return 'GET /api/levels/<ds>', 'GET', f'/api/levels/{ds}', None, None
+
+
+def op_catalog(ctx, rng):
+    # Most clients already hold the catalog and only revalidate it
+    headers = {'If-None-Match': ctx.pop.catalog_etag} if rng.random() < 0.8 else None
+    return 'GET /api/levels/catalog', 'GET', '/api/levels/catalog', None, headers
+
+
+def op_hint(ctx, rng):
+    ds, level_id = rng.choice(ctx.pop.levels)
+    return 'GET /api/hint/<ds>/<id>', 'GET', f'/api/hint/{ds}/{level_id}', None, None
+
+
+OPERATIONS = {name[3:]: func for name, func in globals().items() if name.startswith('op_')}
+
+
+class Worker(threading.Thread):
+    def __init__(self, index, client, pop, weights, seed, deadline, warmup_until):
+        super().__init__(daemon=True)
+        self.index = index
+        self.client = client
+        self.pop = pop
+        self.rng = Random(seed * 1000 + index)
+        self.operations = [OPERATIONS[name] for name in weights]
+        self.weights = list(weights.values())
+        self.deadline = deadline
+        self.warmup_until = warmup_until
+        self.signups = 0
+        self.samples = {}
+        self.statuses = {}
+
+    def run(self):
+        rng = self.rng
+        while True:
+            operation = rng.choices(self.operations, self.weights)[0]
+            label, method, path, body, headers = operation(self, rng)
+            start = time.perf_counter()
+            status, _ = self.client.request(method, path, body, headers)
+            end = time.perf_counter()
+            if end >= self.deadline:
+                return
+            if end < self.warmup_until:
+                continue
+            self.samples.setdefault(label, []).append(end - start)
+            counts = self.statuses.setdefault(label, {})
+            counts[status] = counts.get(status, 0) + 1
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(samples, statuses, seconds):
+    latencies = sorted(samples)
+    errors = sum(count for status, count in statuses.items() if status == 0 or status >= 500)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput_rps': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def run(args, make_client):
+    setup_client = make_client()
+    pop = register_population(setup_client, args.users, args.hot_users, Random(args.seed))
+
+    threads = []
+    start = time.perf_counter()
+    warmup_until = start + args.warmup
+    deadline = warmup_until + args.seconds
+    for share, weights in SCENARIOS[args.scenario]:
+        for _ in range(max(1, round(args.threads * share))):
+            threads.append(Worker(len(threads), make_client(), pop, weights, args.seed, deadline, warmup_until))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    samples, statuses = {}, {}
+    for thread in threads:
+        for label, values in thread.samples.items():
+            samples.setdefault(label, []).extend(values)
+        for label, counts in thread.statuses.items():
+            merged = statuses.setdefault(label, {})
+            for status, count in counts.items():
+                merged[status] = merged.get(status, 0) + count
+
+    endpoints = {label: summarize(samples[label], statuses[label], args.seconds) for label in sorted(samples)}
+    everything = [value for values in samples.values() for value in values]
+    all_statuses = {}
+    for counts in statuses.values():
+        for status, count in counts.items():
+            all_statuses[status] = all_statuses.get(status, 0) + count
+    return endpoints, summarize(everything, all_statuses, args.seconds), len(threads)
+
+
+def in_process(args, db_dir):
+    os.environ['DATABASE_PATH'] = os.path.join(db_dir, 'loadtest.db')
+    import app as api
+    return lambda: InProcessClient(api.app), None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(args, db_dir):
+    port = free_port()
+    env = dict(os.environ, DATABASE_PATH=os.path.join(db_dir, 'loadtest.db'),
+               METRICS_DIR=os.path.join(db_dir, 'metrics'))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.worker_threads),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+        cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        status, _ = HttpClient(port).request('GET', '/api/health')
+        if status == 200:
+            return (lambda: HttpClient(port)), server
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not become healthy within 30 s')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(result, baseline_path, tolerance):
+    # Prints per-endpoint deltas; returns the labels that regressed.
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f'\nvs. {baseline_path} ({baseline["meta"].get("revision")}, {baseline["meta"]["started_at"]}):')
+    rows = dict(result['endpoints'], total=result['total'])
+    old_rows = dict(baseline['endpoints'], total=baseline['total'])
+    for label, row in rows.items():
+        old = old_rows.get(label)
+        if not old or not old['requests']:
+            continue
+        rps = (row['throughput_rps'] - old['throughput_rps']) / old['throughput_rps'] if old['throughput_rps'] else 0.0
+        p95 = (row['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+        regressed = rps < -tolerance or p95 > tolerance
+        if regressed:
+            regressions.append(label)
+        print(f'{label:<30} rps {rps:+7.1%}  p95 {p95:+7.1%}{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+def print_table(endpoints, total):
+    print(f'{"endpoint":<30} {"requests":>8} {"errors":>6} {"rps":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for label, row in list(endpoints.items()) + [('total', total)]:
+        print(f'{label:<30} {row["requests"]:>8} {row["errors"]:>6} {row["throughput_rps"]:>8.1f} '
+              f'{row["p50_ms"]:>8.2f} {row["p95_ms"]:>8.2f} {row["p99_ms"]:>8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=__doc__[__doc__.index('Scenarios:'):])
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    parser.add_argument('--target', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent load threads')
+    parser.add_argument('--seconds', type=float, default=10, help='measured duration')
+    parser.add_argument('--warmup', type=float, default=1, help='unmeasured ramp-up')
+    parser.add_argument('--users', type=int, default=500, help='synthetic users registered up front')
+    parser.add_argument('--hot-users', type=int, default=5, help='users targeted by write-contention')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--worker-threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<scenario>-<target>-<time>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed throughput drop / p95 increase before flagging a regression')
+    args = parser.parse_args()
+
+    started_at = datetime.now()
+    server = None
+    with tempfile.TemporaryDirectory() as db_dir:
+        try:
+            if args.target == 'gunicorn':
+                make_client, server = start_gunicorn(args, db_dir)
+            else:
+                make_client, _ = in_process(args, db_dir)
+            endpoints, total, threads = run(args, make_client)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+    result = {
+        'meta': {
+            'scenario': args.scenario,
+            'target': args.target,
+            'threads': threads,
+            'workers': args.workers if args.target == 'gunicorn' else None,
+            'seconds': args.seconds,
+            'users': args.users,
+            'seed': args.seed,
+            'revision': git_revision(),
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'cpus': os.cpu_count(),
+        },
+        'endpoints': endpoints,
+        'total': total,
+    }
+
+    print(f'{args.scenario} on {args.target}, {threads} threads, {args.seconds:g} s')
+    print_table(endpoints, total)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f'{args.scenario}-{args.target}-{started_at.strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'results written to {output}')
+
+    if args.compare and compare(result, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Bulk-load synthetic users and game progress into a game database.
+
+    python benchmarks/seed.py --db /tmp/big.db --users 1000000 --progress 10000000
+
+The schema comes from app.py. The secondary indexes are dropped for the
+load and rebuilt once at the end by the normal migrations. Everything is
+inserted with executemany in one transaction, with rollback journaling and
+fsync switched off. The file is put back into WAL mode when the load is
+done. Rows are generated in primary-key order so every B-tree insert is an
+append. user_stats totals agree with the generated game_progress rows.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from random import Random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from level_catalog import catalog  # noqa: E402
+import migrations  # noqa: E402
+
+LOAD_PRAGMAS = (
+    ('journal_mode', 'OFF'),
+    ('synchronous', 'OFF'),
+    ('locking_mode', 'EXCLUSIVE'),
+    ('cache_size', -512000),     # 512 MiB
+    ('temp_store', 'MEMORY'),
+)
+
+BATCH = 50000
+PASSWORD = 'password'
+
+
+def create_schema(path):
+    # Importing app creates the schema (and runs migrations) on DATABASE_PATH
+    os.environ['DATABASE_PATH'] = path
+    import app
+    import passwords
+    app.router.close_all()
+    # One hash shared by every row: a salt each would cost minutes of scrypt
+    return passwords.derive(PASSWORD)
+
+
+def generate(rng, first_id, users, per_user, levels, password_hash):
+    # Yields ('users'|'user_stats'|'game_progress', row) in id order
+    max_levels = len(levels)
+    for user_id in range(first_id, first_id + users):
+        yield 'users', (user_id, f'user{user_id}', f'user{user_id}@example.com', password_hash)
+
+        count = min(max_levels, int(rng.expovariate(1 / per_user))) if per_user else 0
+        total_score = total_time = completed_count = total_attempts = 0
+        for ds, level_id in sorted(rng.sample(levels, count)):
+            completed = rng.random() < 0.7
+            attempts = 1 + int(rng.expovariate(0.5))
+            score = rng.randint(50, 200) if completed else 0
+            best_time = rng.randint(5, 300) if completed else 0
+            moves = rng.randint(2, 20) if completed else 0
+            yield 'game_progress', (user_id, ds, level_id, completed, score, best_time, moves, attempts)
+            total_attempts += attempts
+            if completed:
+                total_score += score
+                total_time += best_time
+                completed_count += 1
+        yield 'user_stats', (user_id, total_score, total_time, completed_count, total_attempts)
+
+
+INSERTS = {
+    'users': 'INSERT INTO users (id, username, email, password_hash) VALUES (?, ?, ?, ?)',
+    'user_stats': '''
+        INSERT INTO user_stats (user_id, total_score, total_time, levels_completed, total_attempts)
+        VALUES (?, ?, ?, ?, ?)
+    ''',
+    'game_progress': '''
+        INSERT INTO game_progress
+            (user_id, data_structure, level_id, completed, best_score, best_time, best_moves, attempts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+}
+
+
+def seed(path, users, progress, seed_value=1):
+    password_hash = create_schema(path)
+    conn = sqlite3.connect(path, isolation_level=None)
+    for name, value in LOAD_PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    cursor = conn.cursor()
+
+    levels = [(ds, level['id']) for ds in catalog.data_structures for level in catalog.levels[ds]]
+    first_id = (cursor.execute('SELECT MAX(id) FROM users').fetchone()[0] or 0) + 1
+    per_user = progress / users if users else 0
+
+    started = time.perf_counter()
+    cursor.execute('BEGIN')
+    # Secondary indexes are rebuilt in one sorted pass at the end
+    for index in migrations.index_names():
+        cursor.execute(f'DROP INDEX IF EXISTS {index}')
+    cursor.execute('PRAGMA user_version = 0')
+
+    buffers = {table: [] for table in INSERTS}
+    counts = dict.fromkeys(INSERTS, 0)
+    for table, row in generate(Random(seed_value), first_id, users, per_user, levels, password_hash):
+        buffer = buffers[table]
+        buffer.append(row)
+        if len(buffer) >= BATCH:
+            # users rows must land before the stats and progress that
+            # reference them
+            for name in INSERTS:
+                cursor.executemany(INSERTS[name], buffers[name])
+                counts[name] += len(buffers[name])
+                buffers[name].clear()
+    for name in INSERTS:
+        cursor.executemany(INSERTS[name], buffers[name])
+        counts[name] += len(buffers[name])
+    loaded = time.perf_counter()
+
+    migrations.migrate(cursor)
+    cursor.execute('UPDATE leaderboard_version SET version = version + 1')
+    cursor.execute('COMMIT')
+    indexed = time.perf_counter()
+
+    cursor.execute('PRAGMA analysis_limit = 1000')
+    cursor.execute('ANALYZE')
+    cursor.execute('PRAGMA locking_mode = NORMAL')
+    cursor.execute('PRAGMA journal_mode = WAL')
+    conn.close()
+
+    print(f'{counts["users"]} users, {counts["game_progress"]} progress rows '
+          f'loaded in {loaded - started:.1f} s, indexed in {indexed - loaded:.1f} s, '
+          f'analyzed in {time.perf_counter() - indexed:.1f} s '
+          f'({os.path.getsize(path) / 2 ** 20:.0f} MiB)')
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', required=True, help='database file (created if missing)')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--progress', type=int, default=10000000, help='approximate game_progress rows')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    seed(args.db, args.users, args.progress, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Pooled SQLite connections for the Flask API.
+
+Connections are opened once per worker process and reused across requests
+instead of connecting on every hit. Every connection runs in WAL mode so
+leaderboard reads no longer block progress writes.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from metrics import METRICS_ENABLED, TimedConnection
+
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'game_database.db')
+
+# Applied to every new connection. journal_mode is persistent in the file,
+# the rest are per-connection settings.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    # WAL + NORMAL only fsyncs on checkpoint; FULL fsyncs every commit
+    ('synchronous', os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+    ('cache_size', -16000),       # negative means KiB, i.e. 16 MiB
+    ('mmap_size', 268435456),     # 256 MiB
+    ('busy_timeout', 5000),       # milliseconds
+    ('temp_store', 'MEMORY'),
+)
+
+
+def is_busy_error(exc):
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    message = str(exc).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_busy(func, *args, retries=5, base_delay=0.01):
+    # busy_timeout already waits inside SQLite; this covers the cases it
+    # cannot (e.g. a lock upgrade that would deadlock) with a jittered backoff.
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except sqlite3.OperationalError as e:
+            if attempt == retries or not is_busy_error(e):
+                raise
+            time.sleep(base_delay * (2 ** attempt) * (0.5 + random.random()))
+
+
+class ConnectionPool:
+    def __init__(self, path, max_idle=16, statement_cache_size=256, retries=5, attach=()):
+        self.path = path
+        # (alias, path) databases ATTACHed read-only to every connection
+        self.attach = tuple(attach)
+        self.max_idle = max_idle
+        self.statement_cache_size = statement_cache_size
+        self.retries = retries
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        # isolation_level=None: we issue BEGIN ourselves so writes can take
+        # the write lock up front with BEGIN IMMEDIATE.
+        conn = sqlite3.connect(
+            self.path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+            factory=TimedConnection if METRICS_ENABLED else sqlite3.Connection,
+            uri=bool(self.attach),
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in PRAGMAS:
+            retry_on_busy(conn.execute, f'PRAGMA {name} = {value}', retries=self.retries)
+        for alias, path in self.attach:
+            # Read-only, so BEGIN IMMEDIATE does not take the attached
+            # database's write lock as well
+            conn.execute(f'ATTACH DATABASE ? AS {alias}', (f'file:{quote(os.path.abspath(path))}?mode=ro',))
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked (e.g. gunicorn preload): never share the parent's
+                # connections, just forget them.
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            retry_on_busy(conn.execute, 'BEGIN IMMEDIATE', retries=self.retries)
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            retry_on_busy(conn.commit, retries=self.retries)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class PeriodicClaim:
+    # Runs a job at most once per interval seconds across every worker
+    # sharing a database. A worker starts it in a background thread only if
+    # it moves claimed_at forward in `table`, a one-row (id = 1) table. Each
+    # worker looks at the row at most every 10 seconds.
+    def __init__(self, table, name):
+        self.table = table
+        self.name = name
+        self.running = False
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+
+    def start_if_due(self, pool, interval, job):
+        if not interval or time.monotonic() < self._next_check:
+            return False
+        with self._lock:
+            if self.running:
+                return False
+            self._next_check = time.monotonic() + min(interval, 10)
+            now = time.time()
+            with pool.transaction() as conn:
+                claimed = conn.execute(f'UPDATE {self.table} SET claimed_at = ? WHERE id = 1 AND claimed_at <= ?',
+                                       (now, now - interval)).rowcount
+            if not claimed:
+                return False
+            self.running = True
+        threading.Thread(target=self._run, args=(job,), name=self.name, daemon=True).start()
+        return True
+
+    def _run(self, job):
+        try:
+            job()
+        finally:
+            with self._lock:
+                self.running = False
+
+
+pool = ConnectionPool(DATABASE_PATH)
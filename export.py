@@ -0,0 +1,134 @@
+"""Streaming NDJSON exports of game_progress and user_stats.
+
+GET /api/export/progress and /api/export/stats write one JSON object per
+line, straight from an open SQLite cursor read EXPORT_CHUNK_SIZE rows at a
+time. So a dump of any size runs in constant memory, with no per-user round
+trips. Rows come in key order, (user_id, data_structure, level_id) or
+user_id, merged across shards, which gives keyset pagination:
+
+  * after=<key of the last row received> resumes just past it, e.g.
+    after=42,stack,3 for progress or after=42 for stats
+  * limit=<n> ends the response after n rows
+  * since=<timestamp> returns only rows written at or after it (last_played
+    / last_updated, UTC), in (timestamp, key) order off an index, so an
+    incremental pull reads only what changed. Resume it with the last
+    row's timestamp as since and its key as after. A row written again
+    during a long pull moves to the end of that order and can come twice;
+    keep the newest copy per key.
+
+Rows still waiting in a write-behind buffer appear once flushed. The body
+is gzip-compressed on the fly when the client sends Accept-Encoding: gzip.
+"""
+import heapq
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
+
+def parse_since(value):
+    # ISO 8601 in, SQLite CURRENT_TIMESTAMP format (UTC) out
+    if value is None:
+        return None
+    try:
+        since = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError('since must be an ISO 8601 timestamp')
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc)
+    return since.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Export:
+    def __init__(self, table, key, columns, since_column):
+        self.table = table
+        self.key = key
+        self.columns = key + columns
+        self.since_column = since_column
+
+    def parse_after(self, value):
+        # 'user_id[,data_structure,level_id]' -> key tuple
+        if value is None:
+            return None
+        parts = value.split(',', len(self.key) - 1)
+        if len(parts) != len(self.key):
+            raise ValueError(f'after must be {",".join(self.key)}')
+        try:
+            return tuple(int(part) if name in ('user_id', 'level_id') else part
+                         for name, part in zip(self.key, parts))
+        except ValueError:
+            raise ValueError('after: user_id and level_id must be integers')
+
+    def order(self, since):
+        return ((self.since_column,) if since is not None else ()) + self.key
+
+    def query(self, after, since):
+        order = self.order(since)
+        if after is not None:
+            # Strictly past the (timestamp and) key of the last row received
+            values = ((since,) if since is not None else ()) + after
+            where = f' WHERE ({", ".join(order)}) > ({", ".join("?" * len(order))})'
+        elif since is not None:
+            values = (since,)
+            where = f' WHERE {self.since_column} >= ?'
+        else:
+            values, where = (), ''
+        return f'SELECT {", ".join(self.columns)} FROM {self.table}{where} ORDER BY {", ".join(order)}', values
+
+    def rows(self, pools, after=None, since=None, limit=None):
+        # Yields row tuples from every pool, merged into query order
+        sql, params = self.query(after, since)
+        streams = [self._stream(pool, sql, params) for pool in pools]
+        positions = [self.columns.index(column) for column in self.order(since)]
+        merged = streams[0] if len(streams) == 1 else heapq.merge(
+            *streams, key=lambda row: [row[i] for i in positions])
+        for count, row in enumerate(merged):
+            if limit is not None and count >= limit:
+                break
+            yield row
+
+    @staticmethod
+    def _stream(pool, sql, params):
+        # One statement, so one read snapshot, per shard for the whole export
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            while True:
+                chunk = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield from (tuple(row) for row in chunk)
+
+
+EXPORTS = {
+    'progress': Export(
+        'game_progress', ('user_id', 'data_structure', 'level_id'),
+        ('completed', 'best_score', 'best_time', 'best_moves', 'attempts', 'last_played'),
+        'last_played'),
+    'stats': Export(
+        'user_stats', ('user_id',),
+        ('total_score', 'total_time', 'levels_completed', 'total_attempts', 'last_updated'),
+        'last_updated'),
+}
+
+
+def ndjson(columns, rows, compress=False, lines_per_write=EXPORT_CHUNK_SIZE):
+    # Encodes rows as NDJSON, in writes of lines_per_write lines
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(columns, row))))
+        if len(lines) >= lines_per_write:
+            data = ('\n'.join(lines) + '\n').encode()
+            lines = []
+            data = gzip.compress(data) if gzip else data
+            if data:
+                yield data
+    data = ('\n'.join(lines) + '\n').encode() if lines else b''
+    if gzip:
+        data = gzip.compress(data) + gzip.flush()
+    if data:
+        yield data
@@ -0,0 +1,276 @@
+"""Procedurally generated puzzles, graded by their optimal move count.
+
+    python generator.py --per-difficulty 200     # rebuilds generated_levels.json
+
+Each data structure has a generator that picks a set of operations from
+the ones its hand-written levels use, then a random initial and target
+configuration that those operations can connect. The solver's A* search
+finds each puzzle's optimal number of moves, which sets its difficulty
+(EASY_MAX_MOVES / MEDIUM_MAX_MOVES) and maxMoves. Puzzles that differ only
+in which letters or numbers they use count as duplicates, and so do
+puzzles that repeat a hand-written level.
+
+Building runs the generators and searches on a process pool, one task per
+batch of candidates. Results are merged in task order, so the same --seed
+and --processes give the same pool. The pool is written to
+GENERATED_LEVELS_PATH and loaded once at startup; GET
+/api/levels/<ds>/generated then only samples from it.
+"""
+import argparse
+import json
+import os
+import random
+import string
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from level_catalog import catalog
+from solver import Unsolvable, solve
+
+GENERATED_LEVELS_PATH = os.environ.get(
+    'GENERATED_LEVELS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generated_levels.json'))
+
+DIFFICULTIES = ('Easy', 'Medium', 'Hard')
+EASY_MAX_MOVES = 2
+MEDIUM_MAX_MOVES = 5
+MAX_SAMPLE = 50
+
+# Generated level ids start here, clear of the hand-written ones
+FIRST_ID = 1001
+
+LETTERS = string.ascii_uppercase[:8]
+
+
+def grade(optimal):
+    if optimal <= EASY_MAX_MOVES:
+        return 'Easy'
+    if optimal <= MEDIUM_MAX_MOVES:
+        return 'Medium'
+    return 'Hard'
+
+
+def max_moves_for(optimal):
+    # About twice the optimal count, as for the hand-written levels
+    return optimal + max(2, optimal)
+
+
+def _letters(rng, low, high, pool):
+    return [rng.choice(pool) for _ in range(rng.randint(low, high))]
+
+
+def _pool(rng):
+    return LETTERS[:rng.randint(2, 5)]
+
+
+def _sequence(rng, ops, add, remove):
+    # (initial, target, operations) for the stack, queue and linked list:
+    # add-only targets extend the initial state, remove-only ones shrink it
+    pool = _pool(rng)
+    if ops == (add,):
+        initial = _letters(rng, 0, 3, pool)
+        return initial, initial + _letters(rng, 1, 4, pool)
+    if ops == (remove,):
+        initial = _letters(rng, 2, 6, pool)
+        return initial, None
+    return _letters(rng, 0, 4, pool), _letters(rng, 1, 6, pool)
+
+
+def gen_stack(rng):
+    ops = rng.choice((('push',), ('pop',), ('push', 'pop'), ('push', 'pop')))
+    initial, target = _sequence(rng, ops, 'push', 'pop')
+    if target is None:
+        target = initial[:rng.randint(1, len(initial) - 1)]
+    return initial, target, ops
+
+
+def gen_queue(rng):
+    ops = rng.choice((('enqueue',), ('dequeue',), ('enqueue', 'dequeue'), ('enqueue', 'dequeue')))
+    initial, target = _sequence(rng, ops, 'enqueue', 'dequeue')
+    if target is None:
+        target = initial[rng.randint(1, len(initial) - 1):]
+    return initial, target, ops
+
+
+def gen_linkedlist(rng):
+    ops = rng.choice((('insert',), ('delete',), ('insert', 'delete'), ('insert', 'delete')))
+    initial, target = _sequence(rng, ops, 'insert', 'delete')
+    if target is None:
+        kept = sorted(rng.sample(range(len(initial)), rng.randint(1, len(initial) - 1)))
+        target = [initial[i] for i in kept]
+    elif ops == ('insert',):
+        # Same letters added, but anywhere in the list
+        target = list(initial)
+        for value in _letters(rng, 1, 4, _pool(rng)):
+            target.insert(rng.randint(0, len(target)), value)
+    return initial, target, ops
+
+
+def gen_tree(rng):
+    # Distinct keys; the target lists them in an insertion order that
+    # builds the tree, and the initial tree is a prefix of it
+    values = rng.sample(range(1, 100), rng.randint(1, 10))
+    if rng.random() < 0.15:
+        return values[:4], values[:4], ('search',)
+    return values[:rng.randint(0, len(values) - 1)], values, ('insert_tree',)
+
+
+def gen_graph(rng):
+    ops = rng.choice((('addVertex',), ('removeVertex',), ('addVertex', 'removeVertex'),
+                      ('addVertex', 'removeVertex')))
+    letters = list(LETTERS)
+    rng.shuffle(letters)
+    if ops == ('addVertex',):
+        size = rng.randint(0, 3)
+        return letters[:size], letters[:size + rng.randint(1, 4)], ops
+    if ops == ('removeVertex',):
+        initial = letters[:rng.randint(2, 6)]
+        return initial, [v for v in initial if rng.random() < 0.6] or initial[:1], ops
+    initial = letters[:rng.randint(0, 4)]
+    target = rng.sample(LETTERS, rng.randint(1, 6))
+    return initial, target, ops
+
+
+GENERATORS = {
+    'stack': gen_stack,
+    'queue': gen_queue,
+    'linkedlist': gen_linkedlist,
+    'tree': gen_tree,
+    'graph': gen_graph,
+}
+
+
+def canonical(data_structure, initial, target, operations):
+    # Key that ignores which values a puzzle uses: letters are renamed in
+    # order of first appearance, BST keys replaced by their rank
+    values = initial + target
+    if data_structure == 'tree':
+        rank = {value: n for n, value in enumerate(sorted(set(values)))}
+    else:
+        rank = {}
+        for value in values:
+            rank.setdefault(value, len(rank))
+    return (data_structure, tuple(rank[v] for v in initial), tuple(rank[v] for v in target),
+            tuple(sorted(operations)))
+
+
+def generate_batch(data_structure, seed, size):
+    # Runs in a pool process: up to `size` solved, locally deduplicated
+    # puzzles, in generation order
+    rng = random.Random(seed)
+    seen = set()
+    puzzles = []
+    for _ in range(size):
+        initial, target, operations = GENERATORS[data_structure](rng)
+        if initial == target and operations != ('search',):
+            continue
+        key = canonical(data_structure, initial, target, operations)
+        if key in seen:
+            continue
+        seen.add(key)
+        level = {'initial': initial, 'target': target, 'operations': list(operations)}
+        try:
+            optimal = len(solve(data_structure, level))
+        except Unsolvable:
+            continue
+        puzzles.append((key, dict(level, optimalMoves=optimal)))
+    return puzzles
+
+
+def build(per_difficulty, processes=None, seed=1, batch_size=200, max_rounds=50):
+    # {ds: [level, ...]} with up to per_difficulty levels per difficulty
+    seen = {canonical(ds, level['initial'], level['target'], level['operations'])
+            for ds, levels in catalog.levels.items() for level in levels}
+    pools = {ds: {difficulty: [] for difficulty in DIFFICULTIES} for ds in GENERATORS}
+    processes = processes or os.cpu_count() or 1
+    task_seeds = iter(range(seed * 1000003, seed * 1000003 + 10 ** 6))
+
+    with ProcessPoolExecutor(processes) as executor:
+        for _ in range(max_rounds):
+            short = [ds for ds, by_difficulty in pools.items()
+                     if any(len(levels) < per_difficulty for levels in by_difficulty.values())]
+            if not short:
+                break
+            tasks = [(ds, next(task_seeds)) for ds in short for _ in range(processes)]
+            results = executor.map(generate_batch, [ds for ds, _ in tasks], [s for _, s in tasks],
+                                   [batch_size] * len(tasks))
+            for (ds, _), puzzles in zip(tasks, results):
+                for key, level in puzzles:
+                    levels = pools[ds][grade(level['optimalMoves'])]
+                    if key in seen or len(levels) >= per_difficulty:
+                        continue
+                    seen.add(key)
+                    levels.append(level)
+
+    generated = {}
+    for ds, by_difficulty in pools.items():
+        generated[ds] = []
+        for difficulty in DIFFICULTIES:
+            for level in by_difficulty[difficulty]:
+                level_id = FIRST_ID + len(generated[ds])
+                generated[ds].append({
+                    'id': level_id,
+                    'name': f'Generated {level_id}',
+                    'difficulty': difficulty,
+                    'initial': level['initial'],
+                    'target': level['target'],
+                    'operations': level['operations'],
+                    'maxMoves': max_moves_for(level['optimalMoves']),
+                    'optimalMoves': level['optimalMoves'],
+                })
+    return generated
+
+
+class GeneratedPool:
+    def __init__(self, path=GENERATED_LEVELS_PATH):
+        self.path = path
+        self.levels = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.levels = json.load(f)
+        self._by_difficulty = {
+            (ds, difficulty): [level for level in levels if level['difficulty'] == difficulty]
+            for ds, levels in self.levels.items() for difficulty in DIFFICULTIES
+        }
+        self._by_id = {(ds, level['id']): level for ds, levels in self.levels.items() for level in levels}
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def sample(self, data_structure, difficulty=None, count=1):
+        # Up to count distinct random levels, of one difficulty or any
+        if difficulty is None:
+            candidates = self.levels.get(data_structure, [])
+        else:
+            candidates = self._by_difficulty.get((data_structure, difficulty), [])
+        with self._lock:
+            return self._random.sample(candidates, min(count, len(candidates)))
+
+    def level(self, data_structure, level_id):
+        return self._by_id.get((data_structure, level_id))
+
+
+generated_pool = GeneratedPool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--per-difficulty', type=int, default=200, help='levels per data structure and difficulty')
+    parser.add_argument('--processes', type=int, default=None, help='default: one per CPU')
+    parser.add_argument('--batch-size', type=int, default=200, help='candidates per pool task')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=GENERATED_LEVELS_PATH)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    generated = build(args.per_difficulty, args.processes, args.seed, args.batch_size)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(generated, f, separators=(',', ':'))
+        f.write('\n')
+    for ds, levels in generated.items():
+        counts = ', '.join(f'{d} {sum(level["difficulty"] == d for level in levels)}' for d in DIFFICULTIES)
+        print(f'{ds:<11} {counts}')
+    print(f'built in {time.perf_counter() - started:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Append-only journal of progress attempts, with daily and weekly rollups.
+
+game_progress keeps only each level's best result and user_stats only
+lifetime totals. Every attempt the progress routes record (single, batch
+and write-behind flushes alike) is also appended to the attempts table and
+added to the player's rows in rollup_day and rollup_week, in the same
+transaction as the progress write. Days are UTC days and weeks run Monday
+to Sunday, both numbered from 1970-01-01. The rollups hold the same
+totals as user_stats (score and time of completed attempts, completions,
+attempts), so GET /api/leaderboard?window=day|week walks one index over
+the current period of one rollup per shard and never reads the journal.
+
+The journal keeps the last ATTEMPTS_RETENTION_DAYS days (default 28, at
+least 7). Compaction folds older days into attempt_weeks, one row per
+player, level and week with the attempt and completion counts, summed
+score and time and the best score, time and moves, deletes them from the
+journal, and drops rollup rows past the retention. attempt_weeks in turn
+keeps the last ATTEMPTS_WEEKS_RETENTION weeks (default 104; 0 keeps every
+week), so the database grows with the levels each player touches per week
+over that span, not with every attempt. Compaction runs at most once per ATTEMPTS_COMPACTION_INTERVAL seconds (default
+3600; 0 turns it off) in a background thread of whichever worker first
+claims it, checked after a progress write commits, or on demand with `python history.py`. Each transaction folds
+at most ATTEMPTS_COMPACTION_CHUNK journal rows, so progress writes never
+wait long behind it.
+"""
+import logging
+import os
+import time
+
+from database import PeriodicClaim
+from progress import stats_row
+from shards import router
+
+ATTEMPTS_RETENTION_DAYS = max(7, int(os.environ.get('ATTEMPTS_RETENTION_DAYS', 28)))
+# Folded weeks outlive the journal days they came from
+ATTEMPTS_WEEKS_RETENTION = int(os.environ.get('ATTEMPTS_WEEKS_RETENTION', 104))
+if ATTEMPTS_WEEKS_RETENTION:
+    ATTEMPTS_WEEKS_RETENTION = max(ATTEMPTS_WEEKS_RETENTION, ATTEMPTS_RETENTION_DAYS // 7 + 1)
+ATTEMPTS_COMPACTION_INTERVAL = float(os.environ.get('ATTEMPTS_COMPACTION_INTERVAL', 3600))
+ATTEMPTS_COMPACTION_CHUNK = int(os.environ.get('ATTEMPTS_COMPACTION_CHUNK', 50000))
+
+# window -> rollup table
+WINDOWS = {'day': 'rollup_day', 'week': 'rollup_week'}
+
+INSERT_ATTEMPT = '''
+    INSERT INTO attempts (day, user_id, data_structure, level_id, completed, score, time_taken, moves)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# The deltas UPDATE_USER_STATS adds, for one period
+UPSERT_ROLLUP = '''
+    INSERT INTO {table} (period, user_id, total_score, total_time, levels_completed, total_attempts)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(period, user_id) DO UPDATE SET
+        total_score = total_score + excluded.total_score,
+        total_time = total_time + excluded.total_time,
+        levels_completed = levels_completed + excluded.levels_completed,
+        total_attempts = total_attempts + excluded.total_attempts
+'''
+
+_UPSERTS = {table: UPSERT_ROLLUP.format(table=table) for table in WINDOWS.values()}
+
+# A day's journal rows up to an id, added into attempt_weeks
+FOLD_ATTEMPTS = '''
+    INSERT INTO attempt_weeks
+        (week, user_id, data_structure, level_id, attempts, completions,
+         total_score, total_time, best_score, best_time, best_moves)
+    SELECT (day + 3) / 7, user_id, data_structure, level_id, COUNT(*),
+           SUM(CASE WHEN completed THEN 1 ELSE 0 END),
+           SUM(CASE WHEN completed THEN score ELSE 0 END),
+           SUM(CASE WHEN completed THEN time_taken ELSE 0 END),
+           MAX(score), MIN(NULLIF(time_taken, 0)), MIN(NULLIF(moves, 0))
+    FROM attempts
+    WHERE day = ? AND id <= ?
+    GROUP BY user_id, data_structure, level_id
+    ON CONFLICT(user_id, data_structure, level_id, week) DO UPDATE SET
+        attempts = attempts + excluded.attempts,
+        completions = completions + excluded.completions,
+        total_score = total_score + excluded.total_score,
+        total_time = total_time + excluded.total_time,
+        best_score = MAX(best_score, excluded.best_score),
+        best_time = COALESCE(MIN(best_time, excluded.best_time), best_time, excluded.best_time),
+        best_moves = COALESCE(MIN(best_moves, excluded.best_moves), best_moves, excluded.best_moves)
+'''
+
+_LAST_ID = 2 ** 63 - 1
+
+log = logging.getLogger('history')
+
+
+def today():
+    return int(time.time() // 86400)
+
+
+def week_of(day):
+    # 1970-01-01 was a Thursday; week 0 starts on Monday 1969-12-29
+    return (day + 3) // 7
+
+
+def period(window, day=None):
+    day = today() if day is None else day
+    return day if window == 'day' else week_of(day)
+
+
+def record(cursor, attempts, day=None):
+    # Journal rows and rollup deltas for attempts; call inside the progress
+    # write transaction
+    day = today() if day is None else day
+    cursor.executemany(INSERT_ATTEMPT, [(day,) + tuple(attempt) for attempt in attempts])
+    deltas = _deltas(attempts)
+    for window, table in WINDOWS.items():
+        current = period(window, day)
+        cursor.executemany(_UPSERTS[table], [(current,) + delta for delta in deltas])
+
+
+def _deltas(attempts):
+    # (user_id, score, time, completions, attempts) rollup deltas, summed per
+    # player. A batch is usually one player's, so that is one upsert per
+    # rollup.
+    totals = {}
+    for score, time_taken, completed, count, user_id in map(stats_row, attempts):
+        total = totals.get(user_id)
+        if total is None:
+            totals[user_id] = [score, time_taken, completed, count]
+        else:
+            total[0] += score
+            total[1] += time_taken
+            total[2] += completed
+            total[3] += count
+    return [(user_id,) + tuple(total) for user_id, total in totals.items()]
+
+
+def top_keyed(conn, window, current, limit):
+    # One shard's best `limit` players of a period, with the sort keys
+    # merge_top() expects
+    cursor = conn.execute(f'''
+        SELECT r.user_id, u.username, r.total_score, r.levels_completed, r.total_time
+        FROM {WINDOWS[window]} r
+        JOIN users u ON u.id = r.user_id
+        WHERE r.period = ?
+        ORDER BY r.total_score DESC, r.user_id
+        LIMIT ?
+    ''', (current, limit))
+    return [((-row['total_score'], row['user_id']), {
+        'username': row['username'],
+        'total_score': row['total_score'],
+        'levels_completed': row['levels_completed'],
+        'total_time': row['total_time'],
+    }) for row in cursor]
+
+
+class Compactor:
+    def __init__(self, router=router, retention_days=ATTEMPTS_RETENTION_DAYS,
+                 interval=ATTEMPTS_COMPACTION_INTERVAL, chunk=ATTEMPTS_COMPACTION_CHUNK,
+                 retention_weeks=ATTEMPTS_WEEKS_RETENTION):
+        self.router = router
+        self.retention_days = retention_days
+        self.retention_weeks = retention_weeks
+        self.interval = interval
+        self.chunk = chunk
+        self.periodic = PeriodicClaim('attempts_compaction', 'attempts-compaction')
+
+    def compact(self, day=None):
+        # Folds journal days before the retention into attempt_weeks and
+        # drops expired rollup and attempt_weeks rows. Returns the journal
+        # rows folded.
+        day = today() if day is None else day
+        cutoff = day - self.retention_days
+        folded = 0
+        for shard in self.router.shards:
+            folded += self._compact_shard(shard.pool, cutoff)
+            if self.retention_weeks:
+                self._expire_weeks(shard.pool, week_of(day) - self.retention_weeks)
+        return folded
+
+    @staticmethod
+    def _expire_weeks(pool, cutoff):
+        # One week per transaction, oldest first
+        while True:
+            with pool.transaction() as conn:
+                week = conn.execute('SELECT MIN(week) FROM attempt_weeks').fetchone()[0]
+                if week is None or week >= cutoff:
+                    return
+                conn.execute('DELETE FROM attempt_weeks WHERE week = ?', (week,))
+
+    def _compact_shard(self, pool, cutoff):
+        folded = 0
+        while True:
+            with pool.transaction() as conn:
+                day = conn.execute('SELECT MIN(day) FROM attempts').fetchone()[0]
+                if day is None or day >= cutoff:
+                    break
+                # The oldest day's first `chunk` rows, or all of them
+                row = conn.execute('SELECT id FROM attempts WHERE day = ? ORDER BY id LIMIT 1 OFFSET ?',
+                                   (day, self.chunk - 1)).fetchone()
+                last = row[0] if row else _LAST_ID
+                conn.execute(FOLD_ATTEMPTS, (day, last))
+                folded += conn.execute('DELETE FROM attempts WHERE day = ? AND id <= ?', (day, last)).rowcount
+        with pool.transaction() as conn:
+            conn.execute('DELETE FROM rollup_day WHERE period < ?', (cutoff,))
+            conn.execute('DELETE FROM rollup_week WHERE period < ?', (week_of(cutoff),))
+        return folded
+
+    # Periodic compaction
+
+    def compact_if_due(self):
+        # Called after progress writes; starts a background compaction in
+        # this worker if ATTEMPTS_COMPACTION_INTERVAL has passed since any
+        # worker last claimed one
+        return self.periodic.start_if_due(self.router.directory, self.interval, self._background_compact)
+
+    def _background_compact(self):
+        try:
+            started = time.perf_counter()
+            folded = self.compact()
+            log.info('Folded %d journaled attempts in %.1f s', folded, time.perf_counter() - started)
+        except Exception:
+            log.exception('Attempts compaction failed')
+
+compactor = Compactor()
+
+
+def main():
+    import app  # noqa: F401  creates the schema
+    started = time.perf_counter()
+    folded = compactor.compact()
+    print(f'folded {folded} journaled attempts in {time.perf_counter() - started:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""In-memory top-K leaderboards, kept current from the write path.
+
+Each worker holds the global board plus one board per data structure. Every
+write bumps a version counter stored in SQLite in the same transaction, logs
+the (user_id, data_structure) pairs it touched under that version in
+leaderboard_changes, and each board remembers the version it is current at.
+A worker applies its own writes incrementally. When a read sees a version
+its board did not reach (another gunicorn worker wrote), it re-reads just
+the users logged since then with the same single-user queries the write path
+uses, at most once per LEADERBOARD_REFRESH_INTERVAL seconds (default 1), so
+a read usually costs one single-row lookup and other workers' writes show up
+within the interval. The log keeps the last LEADERBOARD_CHANGE_RETENTION
+versions (default 10000); a board further behind than that, or one a local
+write could not update (a score went down on a full board), is rebuilt from
+the full table on its next read.
+
+With several shards (shards.py) each shard has its own counter and boards;
+merge_top() combines them on read.
+"""
+import bisect
+import heapq
+import itertools
+import os
+import threading
+import time
+
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 100))
+LEADERBOARD_REFRESH_INTERVAL = float(os.environ.get('LEADERBOARD_REFRESH_INTERVAL', 1))
+LEADERBOARD_CHANGE_RETENTION = int(os.environ.get('LEADERBOARD_CHANGE_RETENTION', 10000))
+DATA_STRUCTURES = ('stack', 'queue', 'linkedlist', 'tree', 'graph')
+GLOBAL = 'global'
+BOARDS = (GLOBAL,) + DATA_STRUCTURES
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS leaderboard_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'INSERT OR IGNORE INTO leaderboard_version (id, version) VALUES (1, 0)',
+    # Who each version touched; data_structure is NULL for global-only changes
+    '''
+    CREATE TABLE IF NOT EXISTS leaderboard_changes (
+        version INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        data_structure TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_leaderboard_changes_version ON leaderboard_changes (version, data_structure)',
+)
+
+_GLOBAL_QUERY = '''
+    SELECT us.user_id, u.username, us.total_score, us.levels_completed, us.total_time
+    FROM users u
+    JOIN user_stats us ON u.id = us.user_id
+'''
+
+_DS_QUERY = '''
+    SELECT gp.user_id, u.username,
+           SUM(gp.best_score) AS total_score,
+           SUM(CASE WHEN gp.completed THEN 1 ELSE 0 END) AS levels_completed,
+           SUM(gp.best_time) AS total_time
+    FROM game_progress gp
+    JOIN users u ON u.id = gp.user_id
+    WHERE gp.data_structure = ?
+'''
+
+
+def _entry(row):
+    return {
+        'username': row['username'],
+        'total_score': row['total_score'],
+        'levels_completed': row['levels_completed'],
+        'total_time': row['total_time'],
+    }
+
+
+def _sort_key(row):
+    return (-row['total_score'], row['user_id'])
+
+
+def _read_row(cursor, board, user_id):
+    # One user's row for the board, or None
+    if board == GLOBAL:
+        cursor.execute(_GLOBAL_QUERY + ' WHERE us.user_id = ?', (user_id,))
+    else:
+        cursor.execute(_DS_QUERY + ' AND gp.user_id = ? GROUP BY gp.user_id', (board, user_id))
+    return cursor.fetchone()
+
+
+class Leaderboard:
+    def __init__(self, size=LEADERBOARD_SIZE, refresh_interval=LEADERBOARD_REFRESH_INTERVAL,
+                 change_retention=LEADERBOARD_CHANGE_RETENTION):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.change_retention = change_retention
+        self._lock = threading.Lock()
+        # board name -> sorted list of ((-score, user_id), entry)
+        self._boards = {}
+        # board name -> {user_id: sort key} for the users currently on it
+        self._members = {}
+        # board name -> version it is current at, None when it must be rebuilt
+        self._versions = {}
+        self._loaded_at = {}
+
+    def load(self, conn):
+        for board in BOARDS:
+            self.load_board(conn, board)
+
+    def load_board(self, conn, board):
+        cursor = conn.cursor()
+        # Read the version first: a write landing during the rebuild then
+        # shows up as a newer version and triggers another rebuild.
+        version = self._read_version(cursor)
+
+        if board == GLOBAL:
+            cursor.execute(_GLOBAL_QUERY + ' ORDER BY us.total_score DESC, us.user_id LIMIT ?',
+                           (self.size,))
+        else:
+            cursor.execute(_DS_QUERY + ' GROUP BY gp.user_id ORDER BY total_score DESC, gp.user_id LIMIT ?',
+                           (board, self.size))
+        rows = [(_sort_key(row), _entry(row)) for row in cursor.fetchall()]
+
+        with self._lock:
+            self._boards[board] = rows
+            self._members[board] = {key[1]: key for key, _ in rows}
+            self._versions[board] = version
+            self._loaded_at[board] = time.monotonic()
+
+    def top(self, conn, board=GLOBAL, limit=10):
+        return [entry for _, entry in self.top_keyed(conn, board, limit)]
+
+    def top_keyed(self, conn, board=GLOBAL, limit=10):
+        # top() with each entry's sort key, for merge_top()
+        if board not in BOARDS:
+            return []
+        version = self._read_version(conn.cursor())
+        current = self._versions.get(board)
+        if current != version and (
+                current is None or time.monotonic() - self._loaded_at[board] >= self.refresh_interval):
+            if current is None or not 0 < version - current <= self.change_retention:
+                self.load_board(conn, board)
+            else:
+                self.catch_up(conn, board, current, version)
+        with self._lock:
+            return self._boards.get(board, [])[:limit]
+
+    def catch_up(self, conn, board, current, version):
+        # Re-reads the users leaderboard_changes logged after current, up to
+        # version, instead of rebuilding the whole board
+        cursor = conn.cursor()
+        if board == GLOBAL:
+            cursor.execute('SELECT DISTINCT user_id FROM leaderboard_changes WHERE version > ? AND version <= ?',
+                           (current, version))
+        else:
+            cursor.execute('SELECT DISTINCT user_id FROM leaderboard_changes '
+                           'WHERE version > ? AND version <= ? AND data_structure = ?', (current, version, board))
+        updates = [(user_id, _read_row(cursor, board, user_id)) for user_id, in cursor.fetchall()]
+
+        with self._lock:
+            for user_id, row in updates:
+                if self._versions.get(board) is None:
+                    break
+                if not (self._update(board, row) if row is not None else self._remove(board, user_id)):
+                    self._versions[board] = None
+            # A local write may have moved the board past version meanwhile
+            if self._versions.get(board) is not None:
+                self._versions[board] = max(self._versions[board], version)
+            self._loaded_at[board] = time.monotonic()
+
+    def collect(self, cursor, changes):
+        # Call inside the write transaction with (user_id, data_structure)
+        # pairs (data_structure may be None). Returns what apply() needs
+        # once the transaction has committed.
+        cursor.execute('UPDATE leaderboard_version SET version = version + 1 RETURNING version')
+        version = cursor.fetchone()[0]
+        changes = set(changes)
+        cursor.executemany('INSERT INTO leaderboard_changes (version, user_id, data_structure) VALUES (?, ?, ?)',
+                           [(version, user_id, data_structure) for user_id, data_structure in changes])
+        cursor.execute('DELETE FROM leaderboard_changes WHERE version <= ?', (version - self.change_retention,))
+
+        rows = {}
+        for user_id, data_structure in changes:
+            if (GLOBAL, user_id) not in rows:
+                rows[(GLOBAL, user_id)] = _read_row(cursor, GLOBAL, user_id)
+            if data_structure in DATA_STRUCTURES:
+                rows[(data_structure, user_id)] = _read_row(cursor, data_structure, user_id)
+
+        return version, [(board, row) for (board, _), row in rows.items() if row is not None]
+
+    def apply(self, collected):
+        # Local writes are always applied. A board moves to the new version
+        # only if it was current at the one before; one that missed a write
+        # (another worker's, or threads committing out of order) stays
+        # behind until a read rebuilds it.
+        version, updates = collected
+        with self._lock:
+            for board, row in updates:
+                if self._versions.get(board) is not None and not self._update(board, row):
+                    self._versions[board] = None
+            for board, current in self._versions.items():
+                if current == version - 1:
+                    self._versions[board] = version
+
+    def _update(self, name, row):
+        board = self._boards.setdefault(name, [])
+        members = self._members.setdefault(name, {})
+        user_id = row['user_id']
+        key = _sort_key(row)
+        full = len(board) >= self.size
+
+        old_key = members.pop(user_id, None)
+        if old_key is not None:
+            del board[bisect.bisect_left(board, (old_key,))]
+            if full and key > old_key:
+                # Score went down on a full board: someone below the cut
+                # may now belong on it, which only a rebuild can tell.
+                return False
+        elif full and key > board[-1][0]:
+            return True
+
+        bisect.insort(board, (key, _entry(row)))
+        members[user_id] = key
+        if len(board) > self.size:
+            _, evicted_user = board.pop()[0]
+            del members[evicted_user]
+        return True
+
+    def _remove(self, name, user_id):
+        # A user who no longer has a row for the board. False when it was
+        # full, as someone below the cut may now belong on it.
+        board = self._boards.setdefault(name, [])
+        key = self._members.setdefault(name, {}).pop(user_id, None)
+        if key is None:
+            return True
+        full = len(board) >= self.size
+        del board[bisect.bisect_left(board, (key,))]
+        return not full
+
+    @staticmethod
+    def _read_version(cursor):
+        cursor.execute('SELECT version FROM leaderboard_version WHERE id = 1')
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+
+def merge_top(boards, limit):
+    # k-way merge of top_keyed() lists from several shards. Every user lives
+    # on exactly one shard, so the first `limit` merged entries are the
+    # overall top `limit`.
+    return [entry for _, entry in itertools.islice(heapq.merge(*boards), limit)]
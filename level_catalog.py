@@ -0,0 +1,60 @@
+"""Level catalog, loaded once at import and served as pre-encoded JSON.
+
+levels.json holds every puzzle definition (the same data script.js ships).
+Each response body is serialized once at startup together with a content
+hash. Requests then only compare ETags or write out bytes that are already
+encoded. The catalog version is that hash, so a versioned URL can be cached
+forever.
+"""
+import hashlib
+import json
+import os
+
+LEVELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels.json')
+
+SUMMARY_FIELDS = ('id', 'name', 'difficulty')
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def _digest(body):
+    return hashlib.sha256(body).hexdigest()[:16]
+
+
+class EncodedBody:
+    def __init__(self, value):
+        self.body = _encode(value)
+        self.etag = _digest(self.body)
+
+
+class LevelCatalog:
+    def __init__(self, path=LEVELS_PATH):
+        with open(path, encoding='utf-8') as f:
+            self.levels = json.load(f)
+
+        self._by_id = {
+            (ds, level['id']): level
+            for ds, ds_levels in self.levels.items()
+            for level in ds_levels
+        }
+        self.data_structures = tuple(self.levels)
+
+        # /api/levels/<ds> keeps its original shape: id, name, difficulty
+        self.summaries = {
+            ds: EncodedBody([{field: level[field] for field in SUMMARY_FIELDS} for level in ds_levels])
+            for ds, ds_levels in self.levels.items()
+        }
+        self.empty = EncodedBody([])
+        self.full = EncodedBody(self.levels)
+        self.version = self.full.etag
+
+    def summary(self, data_structure):
+        return self.summaries.get(data_structure, self.empty)
+
+    def level(self, data_structure, level_id):
+        return self._by_id.get((data_structure, level_id))
+
+
+catalog = LevelCatalog()
@@ -0,0 +1,385 @@
+"""Request and SQL instrumentation, exposed in Prometheus text format.
+
+Request hooks record a latency histogram and status counts per route. The
+pool hands out TimedConnection objects, whose cursors time every statement
+and count the rows it returned or changed. Each request also records how
+much of its time went to SQLite, so slow requests can be split into lock
+waits and queries vs. Python and JSON work. A statement slower than
+SLOW_QUERY_MS is logged together with its EXPLAIN QUERY PLAN.
+
+Each worker keeps its own counters in memory. With METRICS_DIR set, every
+worker also writes a snapshot to METRICS_DIR/metrics-<pid>-<start>.json
+about once per METRICS_FLUSH_INTERVAL seconds, and /api/metrics merges all of
+them. <start> is when the process first flushed, so a new worker that gets
+an old worker's pid writes a file of its own. Old files are kept so counters
+never go backwards when a worker restarts; clear the directory before
+starting the server.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 50))
+SLOW_QUERY_LOG_INTERVAL = 60
+
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+slow_query_log = logging.getLogger('metrics.slow_query')
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, key, amount=1):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+    def merge(self, samples):
+        for key, value in samples:
+            self.inc(tuple(key), value)
+
+    def render(self, lines):
+        for key, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_labels(self.labels, key)} {value}')
+
+
+class Histogram:
+    # values[key] is [count per bucket..., count in +Inf, sum]; the
+    # cumulative counts Prometheus wants are only built when rendering.
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, key, seconds):
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    def snapshot(self):
+        return [[list(key), counts] for key, counts in self.values.items()]
+
+    def merge(self, samples):
+        for key, counts in samples:
+            key = tuple(key)
+            mine = self.values.get(key)
+            if mine is None:
+                self.values[key] = list(counts)
+            else:
+                for i, value in enumerate(counts):
+                    mine[i] += value
+
+    def render(self, lines):
+        for key, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = _labels(self.labels + ('le',), key + (str(bound),))
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            labels = _labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {counts[-1]:.6f}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def reset(self):
+        # Runs in a freshly forked child, where the old lock may be held
+        self.lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.values = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def merged(self, snapshots):
+        # A fresh registry with the same metrics holding the sum of snapshots
+        total = Registry()
+        for metric in self.metrics.values():
+            if metric.kind == 'histogram':
+                total.histogram(metric.name, metric.help, metric.labels, metric.buckets)
+            else:
+                total.counter(metric.name, metric.help, metric.labels)
+        for snapshot in snapshots:
+            for name, samples in snapshot.items():
+                if name in total.metrics:
+                    total.metrics[name].merge(samples)
+        return total
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'http_requests_total', 'HTTP requests by route and status.', ('method', 'route', 'status'))
+http_duration = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by route.', ('route',))
+http_sql_duration = registry.histogram(
+    'http_request_sql_seconds', 'Time each request spent in SQLite, by route.', ('route',))
+sql_duration = registry.histogram(
+    'sqlite_statement_duration_seconds', 'SQL statement latency, including lock waits.',
+    ('statement',), SQL_BUCKETS)
+sql_rows = registry.counter(
+    'sqlite_rows_total', 'Rows returned or changed by SQL statements.', ('statement',))
+sql_slow = registry.counter(
+    'sqlite_slow_statements_total', 'Statements slower than SLOW_QUERY_MS.', ('statement',))
+
+# Metrics recorded before a fork belong to the parent (gunicorn --preload)
+os.register_at_fork(after_in_child=registry.reset)
+
+
+class _RequestState(threading.local):
+    sql_seconds = 0.0
+
+
+_request_state = _RequestState()
+
+_STATEMENT_RE = re.compile(
+    r'^\s*(?:(insert)(?:\s+or\s+\w+)?\s+into|(update)|(delete)\s+from|(select)\b.*?\bfrom'
+    r'|(explain)|(\w+))\s*(\w+)?',
+    re.IGNORECASE | re.DOTALL)
+_statement_names = {}
+
+
+def statement_name(sql):
+    # A low-cardinality label for a statement: its verb and first table,
+    # e.g. "insert game_progress" or "select user_stats".
+    name = _statement_names.get(sql)
+    if name is None:
+        match = _STATEMENT_RE.match(sql)
+        if match is None:
+            name = 'other'
+        else:
+            verb = next(g for g in match.groups()[:6] if g).lower()
+            table = match.group(7)
+            name = f'{verb} {table}' if table and verb in ('insert', 'update', 'delete', 'select') else verb
+        if len(_statement_names) < 1000:
+            _statement_names[sql] = name
+    return name
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            first = seq_of_parameters[0] if seq_of_parameters else ()
+            self._record(sql, first, time.perf_counter() - start)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._count_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count_rows(len(rows))
+        return rows
+
+    def _record(self, sql, parameters, elapsed):
+        self._statement = name = statement_name(sql)
+        _request_state.sql_seconds += elapsed
+        with registry.lock:
+            sql_duration.observe((name,), elapsed)
+            if self.rowcount > 0:
+                sql_rows.inc((name,), self.rowcount)
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                sql_slow.inc((name,))
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            _log_slow_query(self.connection, sql, parameters, elapsed)
+
+    def _count_rows(self, count):
+        if count:
+            with registry.lock:
+                sql_rows.inc((getattr(self, '_statement', 'other'),), count)
+
+
+class TimedConnection(sqlite3.Connection):
+    # The C Connection.execute() makes a plain cursor, so execute() and
+    # executemany() go through cursor() here. BEGIN and PRAGMA statements
+    # are timed too.
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_state.sql_seconds += elapsed
+            with registry.lock:
+                sql_duration.observe(('commit',), elapsed)
+
+
+_slow_logged = {}
+
+
+def _log_slow_query(conn, sql, parameters, elapsed):
+    # One plan per statement per SLOW_QUERY_LOG_INTERVAL, so a lock storm
+    # doesn't turn into a log storm.
+    now = time.monotonic()
+    if now - _slow_logged.get(sql, -SLOW_QUERY_LOG_INTERVAL) < SLOW_QUERY_LOG_INTERVAL:
+        return
+    _slow_logged[sql] = now
+    plan = []
+    if statement_name(sql).split(' ')[0] in ('insert', 'update', 'delete', 'select'):
+        try:
+            # A plain cursor, so the EXPLAIN itself is not timed
+            cursor = sqlite3.Cursor(conn)
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, parameters)
+            plan = [row[-1] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            plan = [f'(no plan: {e})']
+    slow_query_log.warning('Slow query (%.1f ms): %s | plan: %s',
+                           elapsed * 1000, ' '.join(sql.split()), '; '.join(plan) or '-')
+
+
+def init_app(app):
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        _request_state.sql_seconds = 0.0
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        with registry.lock:
+            http_requests.inc((request.method, route, str(response.status_code)))
+            http_duration.observe((route,), elapsed)
+            http_sql_duration.observe((route,), _request_state.sql_seconds)
+        if METRICS_DIR:
+            try:
+                flush()
+            except OSError as e:
+                print(f"Metrics flush error: {str(e)}")
+        return response
+
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+
+
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+# pid -> snapshot file of this process
+_snapshot_paths = {}
+
+
+def _snapshot_path(pid):
+    if pid not in _snapshot_paths:
+        _snapshot_paths[pid] = os.path.join(METRICS_DIR, f'metrics-{pid}-{time.time_ns()}.json')
+    return _snapshot_paths[pid]
+
+
+def flush(force=False):
+    # Write this worker's snapshot for the other workers to merge.
+    global _last_flush
+    if not force and time.monotonic() - _last_flush < METRICS_FLUSH_INTERVAL:
+        return
+    with _flush_lock:
+        _last_flush = time.monotonic()
+        path = _snapshot_path(os.getpid())
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(tmp, path)
+
+
+def exposition():
+    # Prometheus text for this worker, or for all workers with METRICS_DIR.
+    if not METRICS_DIR:
+        with registry.lock:
+            return registry.render()
+
+    flush(force=True)
+    snapshots = []
+    for name in sorted(os.listdir(METRICS_DIR)):
+        if name.startswith('metrics-') and name.endswith('.json'):
+            try:
+                with open(os.path.join(METRICS_DIR, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return registry.merged(snapshots).render()
@@ -0,0 +1,205 @@
+"""Numbered schema migrations on top of the tables created in init_db().
+
+PRAGMA user_version records the last migration applied. init_db() runs
+migrate() inside its BEGIN IMMEDIATE transaction, so when several gunicorn
+workers start at once exactly one of them applies each step.
+"""
+
+MIGRATIONS = (
+    (1, (
+        # Global leaderboard: ORDER BY total_score DESC, user_id is now an
+        # index walk with no temp B-tree. Read backwards, the same index
+        # serves the ascending rank-neighbour queries.
+        'DROP INDEX IF EXISTS idx_user_stats_total_score',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_user_stats_score_desc
+        ON user_stats (total_score DESC, user_id)
+        ''',
+        # Per-data-structure leaderboards: covers WHERE data_structure = ?
+        # GROUP BY user_id without touching the table.
+        '''
+        CREATE INDEX IF NOT EXISTS idx_game_progress_ds_user
+        ON game_progress (data_structure, user_id, best_score, completed, best_time)
+        ''',
+    )),
+    (2, (
+        # Journal segments already applied by the write-behind buffer, so
+        # crash recovery never replays one twice (see write_behind.py).
+        '''
+        CREATE TABLE IF NOT EXISTS write_behind_segments (
+            name TEXT PRIMARY KEY
+        )
+        ''',
+    )),
+    (3, (
+        # Incremental exports (since=...) read rows changed after a time in
+        # (timestamp, key) order; see export.py.
+        '''
+        CREATE INDEX IF NOT EXISTS idx_game_progress_last_played
+        ON game_progress (last_played, user_id, data_structure, level_id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_user_stats_last_updated
+        ON user_stats (last_updated, user_id)
+        ''',
+    )),
+    (4, (
+        # Logged-out sessions, read incrementally by id by every worker (see
+        # sessions.py); AUTOINCREMENT so pruned ids are never handed out again
+        '''
+        CREATE TABLE IF NOT EXISTS revoked_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT UNIQUE NOT NULL,
+            expires INTEGER NOT NULL
+        )
+        ''',
+    )),
+    (5, (
+        # Per-level difficulty summary, rebuilt periodically by analytics.py
+        '''
+        CREATE TABLE IF NOT EXISTS level_stats (
+            data_structure TEXT NOT NULL,
+            level_id INTEGER NOT NULL,
+            players INTEGER NOT NULL,
+            completions INTEGER NOT NULL,
+            completion_rate REAL,
+            attempts_mean REAL,
+            attempts_p50 INTEGER,
+            attempts_p90 INTEGER,
+            attempts_p99 INTEGER,
+            attempt_buckets TEXT NOT NULL,
+            moves_p50 INTEGER,
+            moves_p90 INTEGER,
+            moves_at_limit REAL,
+            time_p50 INTEGER,
+            time_p90 INTEGER,
+            time_p99 INTEGER,
+            drop_off REAL,
+            refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (data_structure, level_id)
+        )
+        ''',
+        # When a worker last claimed a rebuild, so only one runs per interval
+        '''
+        CREATE TABLE IF NOT EXISTS level_stats_refresh (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            claimed_at REAL NOT NULL DEFAULT 0
+        )
+        ''',
+        'INSERT OR IGNORE INTO level_stats_refresh (id, claimed_at) VALUES (1, 0)',
+    )),
+    (6, (
+        # Every recorded attempt, for the last ATTEMPTS_RETENTION_DAYS days;
+        # day is days since 1970-01-01 UTC (see history.py)
+        '''
+        CREATE TABLE IF NOT EXISTS attempts (
+            id INTEGER PRIMARY KEY,
+            day INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            data_structure TEXT NOT NULL,
+            level_id INTEGER NOT NULL,
+            completed BOOLEAN,
+            score INTEGER,
+            time_taken INTEGER,
+            moves INTEGER
+        )
+        ''',
+        # Compaction takes the oldest day first, in id order
+        '''
+        CREATE INDEX IF NOT EXISTS idx_attempts_day
+        ON attempts (day)
+        ''',
+        # Per-player totals by day and by week, updated with every write
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_day (
+            period INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            total_score INTEGER NOT NULL DEFAULT 0,
+            total_time INTEGER NOT NULL DEFAULT 0,
+            levels_completed INTEGER NOT NULL DEFAULT 0,
+            total_attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, user_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_week (
+            period INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            total_score INTEGER NOT NULL DEFAULT 0,
+            total_time INTEGER NOT NULL DEFAULT 0,
+            levels_completed INTEGER NOT NULL DEFAULT 0,
+            total_attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, user_id)
+        ) WITHOUT ROWID
+        ''',
+        # Windowed leaderboards: the top of one period is an index walk
+        '''
+        CREATE INDEX IF NOT EXISTS idx_rollup_day_score
+        ON rollup_day (period, total_score DESC, user_id)
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_rollup_week_score
+        ON rollup_week (period, total_score DESC, user_id)
+        ''',
+        # Journal days past the retention, folded per player, level and week
+        '''
+        CREATE TABLE IF NOT EXISTS attempt_weeks (
+            user_id INTEGER NOT NULL,
+            data_structure TEXT NOT NULL,
+            level_id INTEGER NOT NULL,
+            week INTEGER NOT NULL,
+            attempts INTEGER NOT NULL,
+            completions INTEGER NOT NULL,
+            total_score INTEGER,
+            total_time INTEGER,
+            best_score INTEGER,
+            best_time INTEGER,
+            best_moves INTEGER,
+            PRIMARY KEY (user_id, data_structure, level_id, week)
+        ) WITHOUT ROWID
+        ''',
+        # When a worker last claimed a compaction, so only one runs per interval
+        '''
+        CREATE TABLE IF NOT EXISTS attempts_compaction (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            claimed_at REAL NOT NULL DEFAULT 0
+        )
+        ''',
+        'INSERT OR IGNORE INTO attempts_compaction (id, claimed_at) VALUES (1, 0)',
+    )),
+    (7, (
+        # Compaction drops attempt_weeks past ATTEMPTS_WEEKS_RETENTION, oldest
+        # week first
+        '''
+        CREATE INDEX IF NOT EXISTS idx_attempt_weeks_week
+        ON attempt_weeks (week)
+        ''',
+    )),
+)
+
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(cursor):
+    cursor.execute('PRAGMA user_version')
+    return cursor.fetchone()[0]
+
+
+def migrate(cursor, target=LATEST):
+    # Applies every migration newer than the database's user_version, up
+    # to target. Call inside a transaction.
+    version = current_version(cursor)
+    for number, statements in MIGRATIONS:
+        if version < number <= target:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            version = number
+    return version
+
+
+def index_names():
+    # Every index the migrations create, e.g. to drop them for a bulk load
+    # and rebuild them with migrate(cursor) afterwards
+    return [statement.split()[5] for _, statements in MIGRATIONS for statement in statements
+            if statement.split()[:2] == ['CREATE', 'INDEX']]
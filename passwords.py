@@ -0,0 +1,142 @@
+"""Salted scrypt password hashes, computed in a small process pool.
+
+Stored hashes look like
+
+    scrypt$<n>$<r>$<p>$<salt>$<key>
+
+with a random 16-byte salt per user (base64). The cost comes from
+PASSWORD_SCRYPT_N / _R / _P; scrypt at the default n=2**14, r=8 takes
+16 MiB and tens of milliseconds per hash. Rows written before this module
+hold an unsalted SHA-256 hex digest. They still verify, and verify() hands
+back a fresh scrypt hash for them (and for hashes made with older cost
+settings), which login() stores in place.
+
+Hashing runs in PASSWORD_HASH_PROCESSES processes per worker, niced by
+PASSWORD_HASH_NICE, so a burst of logins takes its CPU from those processes
+rather than from request threads, and the kernel serves other endpoints
+first. The request thread waits for its result. At most
+PASSWORD_HASH_MAX_QUEUED more requests may wait for a process; past that
+PasswordQueueFull is raised and the route answers 503. With
+PASSWORD_HASH_PROCESSES=0 hashes are computed in the calling thread.
+"""
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+PASSWORD_HASH_PROCESSES = int(os.environ.get('PASSWORD_HASH_PROCESSES', 2))
+PASSWORD_HASH_MAX_QUEUED = int(os.environ.get('PASSWORD_HASH_MAX_QUEUED', 32))
+PASSWORD_HASH_NICE = int(os.environ.get('PASSWORD_HASH_NICE', 10))
+
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+hash_duration = metrics.registry.histogram(
+    'password_hash_seconds', 'Password hash and verify latency, including the wait for a process.')
+hash_rejected = metrics.registry.counter(
+    'password_hash_rejected_total', 'Password hashes refused because the queue was full.')
+
+
+class PasswordQueueFull(Exception):
+    pass
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p, dklen=KEY_BYTES)
+
+
+def derive(password, n=PASSWORD_SCRYPT_N, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P):
+    salt = secrets.token_bytes(SALT_BYTES)
+    return f'scrypt${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}'
+
+
+def check(password, stored):
+    # (matches, new hash to store or None)
+    if stored.startswith('scrypt$'):
+        _, n, r, p, salt, key = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        matches = hmac.compare_digest(_scrypt(password, base64.b64decode(salt), n, r, p), base64.b64decode(key))
+        current = (n, r, p) == (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+    else:
+        # Legacy unsalted SHA-256
+        matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+        current = False
+    return matches, (derive(password) if matches and not current else None)
+
+
+# Checked when the username does not exist, so that costs a full hash too
+UNKNOWN_USER_HASH = (f'scrypt${PASSWORD_SCRYPT_N}${PASSWORD_SCRYPT_R}${PASSWORD_SCRYPT_P}$'
+                     f'{_b64(bytes(SALT_BYTES))}${_b64(bytes(KEY_BYTES))}')
+
+
+def _lower_priority(nice):
+    if nice:
+        os.nice(nice)
+
+
+class PasswordHasher:
+    def __init__(self, processes=PASSWORD_HASH_PROCESSES, max_queued=PASSWORD_HASH_MAX_QUEUED,
+                 nice=PASSWORD_HASH_NICE):
+        self.processes = processes
+        self.nice = nice
+        self._slots = threading.BoundedSemaphore(processes + max_queued)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def hash(self, password):
+        return self._run(derive, password)
+
+    def verify(self, password, stored):
+        # (matches, new hash to store or None); see check()
+        return self._run(check, password, stored)
+
+    def _run(self, func, *args):
+        if not self.processes:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            with metrics.registry.lock:
+                hash_rejected.inc(())
+            raise PasswordQueueFull('Too many logins in progress, retry shortly')
+        try:
+            start = time.perf_counter()
+            result = self._pool().submit(func, *args).result()
+            with metrics.registry.lock:
+                hash_duration.observe((), time.perf_counter() - start)
+            return result
+        except BrokenProcessPool:
+            # A hashing process died; start a fresh pool for the next call
+            with self._lock:
+                self._executor = None
+            raise
+        finally:
+            self._slots.release()
+
+    def _pool(self):
+        # Started on first use, inside the gunicorn worker. forkserver
+        # children start clean instead of copying the worker's threads,
+        # connections and caches.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=_lower_priority, initargs=(self.nice,))
+            return self._executor
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,215 @@
+"""Read and write paths for game progress.
+
+A completed attempt is one UPSERT on game_progress plus one UPDATE on
+user_stats. The best score/time/moves are worked out by SQLite inside the
+UPSERT, so there is no read-modify-write round trip in Python. The single
+and batch endpoints share the same statements, so both give the same totals.
+A user's progress is read back with one indexed range scan. The per data
+structure totals are summed from those rows in Python.
+
+Every attempt carries an operation_log, which is replayed server-side (see
+replay.py). The replayed result replaces the client's completed, score and
+moves. An attempt without a log is rejected. With REQUIRE_VERIFIED_PROGRESS=0
+it is accepted instead, for old clients, but only as an uncompleted play
+worth no points: it adds to the attempt count and nothing else.
+"""
+import os
+
+from generator import generated_pool
+from level_catalog import catalog
+from replay import InvalidReplay, verify_many
+
+MAX_BATCH_SIZE = 1000
+# Bounds on the client-reported values. Real games stay far below them
+# (a score is at most 50 + 10 per spare move + 60, see replay.py).
+MAX_SCORE = 100000
+MAX_TIME_TAKEN = 86400
+MAX_MOVES = 100000
+REQUIRE_VERIFIED_PROGRESS = os.environ.get('REQUIRE_VERIFIED_PROGRESS', '1') == '1'
+
+# A time or move count of 0 means "not recorded" and never replaces the
+# stored best, same as the old Python-side merge.
+UPSERT_PROGRESS = '''
+    INSERT INTO game_progress
+        (user_id, data_structure, level_id, completed, best_score, best_time, best_moves, attempts)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, data_structure, level_id) DO UPDATE SET
+        completed = excluded.completed,
+        best_score = MAX(best_score, excluded.best_score),
+        best_time = CASE WHEN excluded.best_time > 0
+                         THEN MIN(best_time, excluded.best_time) ELSE best_time END,
+        best_moves = CASE WHEN excluded.best_moves > 0
+                          THEN MIN(best_moves, excluded.best_moves) ELSE best_moves END,
+        attempts = attempts + excluded.attempts,
+        last_played = CURRENT_TIMESTAMP
+'''
+
+UPDATE_USER_STATS = '''
+    UPDATE user_stats
+    SET total_score = total_score + ?,
+        total_time = total_time + ?,
+        levels_completed = levels_completed + ?,
+        total_attempts = total_attempts + ?,
+        last_updated = CURRENT_TIMESTAMP
+    WHERE user_id = ?
+'''
+
+
+def parse_attempt(data):
+    # Returns (user_id, data_structure, level_id, completed, score, time_taken, moves)
+    # or raises ValueError with a message suitable for the client.
+    if not isinstance(data, dict):
+        raise ValueError('Attempt must be an object')
+
+    user_id = data.get('user_id')
+    data_structure = data.get('data_structure')
+    level_id = data.get('level_id')
+
+    if not all([user_id, data_structure, level_id]):
+        raise ValueError('Missing required fields')
+    if not isinstance(data_structure, str) or data_structure not in catalog.data_structures:
+        raise ValueError('Unknown data_structure')
+    # Catalog and generated levels both have integer ids
+    if not isinstance(level_id, int) or isinstance(level_id, bool) or not (
+            catalog.level(data_structure, level_id) or generated_pool.level(data_structure, level_id)):
+        raise ValueError('Unknown level')
+
+    return (
+        user_id,
+        data_structure,
+        level_id,
+        data.get('completed', False),
+        _bounded(data, 'score', MAX_SCORE),
+        _bounded(data, 'time_taken', MAX_TIME_TAKEN),
+        _bounded(data, 'moves', MAX_MOVES),
+    )
+
+
+def _bounded(data, field, maximum):
+    # An integer (or integral float) between 0 and maximum; missing is 0
+    value = data.get(field)
+    if value is None:
+        return 0
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError(f'{field} must be an integer')
+    if not 0 <= value <= maximum:
+        raise ValueError(f'{field} must be between 0 and {maximum}')
+    return value
+
+
+def parse_verified(items):
+    # parse_attempt() for each item, plus replay of any operation logs in a
+    # single verify_many() call. Returns an attempt tuple or a ValueError
+    # (InvalidReplay for a rejected log) per item.
+    parsed = []
+    pending = []
+    submissions = []
+    for data in items:
+        try:
+            attempt = parse_attempt(data)
+        except ValueError as e:
+            parsed.append(e)
+            continue
+
+        log = data.get('operation_log')
+        if log is None:
+            parsed.append(ValueError('Operation log required') if REQUIRE_VERIFIED_PROGRESS else unverified(attempt))
+            continue
+
+        pending.append((len(parsed), attempt))
+        submissions.append((attempt[1], attempt[2], log, attempt[5], data.get('hints', 0)))
+        parsed.append(None)
+
+    for (index, attempt), result in zip(pending, verify_many(submissions)):
+        if not result.valid:
+            parsed[index] = InvalidReplay(result.error)
+            continue
+        user_id, data_structure, level_id, _, _, time_taken, _ = attempt
+        parsed[index] = (user_id, data_structure, level_id, result.won, result.score, time_taken, result.moves)
+    return parsed
+
+
+def unverified(attempt):
+    # All an attempt without a log may claim: that the level was played.
+    # A time and move count of 0 are "not recorded".
+    user_id, data_structure, level_id = attempt[:3]
+    return (user_id, data_structure, level_id, False, 0, 0, 0)
+
+
+def progress_row(attempt):
+    user_id, data_structure, level_id, completed, score, time_taken, moves = attempt
+    return (user_id, data_structure, level_id, completed, score, time_taken, moves, 1)
+
+
+def stats_row(attempt):
+    user_id, _, _, completed, score, time_taken, _ = attempt
+    if completed:
+        return (score, time_taken, 1, 1, user_id)
+    return (0, 0, 0, 1, user_id)
+
+
+def score_deltas(attempts):
+    # user_id -> total_score increase the attempts add to user_stats
+    deltas = {}
+    for attempt in attempts:
+        score, _, _, _, user_id = stats_row(attempt)
+        deltas[user_id] = deltas.get(user_id, 0) + score
+    return deltas
+
+
+def record_attempt(cursor, attempt):
+    cursor.execute(UPSERT_PROGRESS, progress_row(attempt))
+    cursor.execute(UPDATE_USER_STATS, stats_row(attempt))
+
+
+def record_attempts(cursor, attempts):
+    # Rows are applied in order, so the result matches calling
+    # record_attempt() once per attempt.
+    cursor.executemany(UPSERT_PROGRESS, [progress_row(a) for a in attempts])
+    cursor.executemany(UPDATE_USER_STATS, [stats_row(a) for a in attempts])
+
+
+def read_progress(cursor, user_id):
+    # The GET /api/progress/<user_id> payload.
+    return summarize_progress(*load_progress(cursor, user_id))
+
+
+def load_progress(cursor, user_id):
+    # (user_stats dict or None, game_progress dicts). Rows come back in the
+    # order of the UNIQUE(user_id, data_structure, level_id) index.
+    cursor.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
+    stats = cursor.fetchone()
+    cursor.execute(
+        'SELECT * FROM game_progress WHERE user_id = ? ORDER BY data_structure, level_id',
+        (user_id,)
+    )
+    return (dict(stats) if stats else None), [dict(row) for row in cursor.fetchall()]
+
+
+def summarize_progress(stats, all_progress):
+    ds_progress = {}
+    for row in all_progress:
+        totals = ds_progress.get(row['data_structure'])
+        if totals is None:
+            totals = ds_progress[row['data_structure']] = {
+                'data_structure': row['data_structure'],
+                'total_levels': 0,
+                'completed_levels': 0,
+                'total_ds_score': 0,
+            }
+        totals['total_levels'] += 1
+        totals['completed_levels'] += 1 if row['completed'] else 0
+        totals['total_ds_score'] += row['best_score'] or 0
+
+    return {
+        'stats': stats or {
+            'total_score': 0,
+            'total_time': 0,
+            'levels_completed': 0,
+            'total_attempts': 0,
+        },
+        'data_structure_progress': list(ds_progress.values()),
+        'all_progress': all_progress,
+    }
@@ -0,0 +1,261 @@
+"""O(log n) "what is my rank" index over user_stats.total_score.
+
+A Fenwick tree over score values counts how many players hold each score,
+so rank and percentile take O(log n) instead of a COUNT(*) scan. The index
+is built from SQLite at startup and moved by the write path. A change from
+another gunicorn worker shows up as a leaderboard_version this worker did
+not produce. The index is then rebuilt at most once per RANK_REFRESH_INTERVAL
+seconds, so ranks can lag other workers' writes by that much.
+
+The tree covers scores 0..RANK_DENSE_SCORES-1 (default 2^20) and grows
+up to that as scores arrive. Scores at or above it are kept in a sorted
+list instead, so memory stays bounded however high a score gets, and
+ranks among those few players cost O(log n) bisects.
+
+Each shard (shards.py) has its own index; the *_across() helpers combine
+them.
+"""
+import bisect
+import heapq
+import itertools
+import os
+import threading
+import time
+from array import array
+
+RANK_REFRESH_INTERVAL = float(os.environ.get('RANK_REFRESH_INTERVAL', 5))
+RANK_DENSE_SCORES = int(os.environ.get('RANK_DENSE_SCORES', 2 ** 20))
+MIN_CAPACITY = 1024
+
+# Matches the leaderboard ordering: higher score first, then lower user id.
+_ABOVE_QUERIES = (
+    '''
+    SELECT us.user_id, u.username, us.total_score
+    FROM user_stats us JOIN users u ON u.id = us.user_id
+    WHERE us.total_score = ? AND us.user_id < ?
+    ORDER BY us.user_id DESC LIMIT ?
+    ''',
+    '''
+    SELECT us.user_id, u.username, us.total_score
+    FROM user_stats us JOIN users u ON u.id = us.user_id
+    WHERE us.total_score > ?
+    ORDER BY us.total_score ASC, us.user_id DESC LIMIT ?
+    ''',
+)
+
+_BELOW_QUERIES = (
+    '''
+    SELECT us.user_id, u.username, us.total_score
+    FROM user_stats us JOIN users u ON u.id = us.user_id
+    WHERE us.total_score = ? AND us.user_id > ?
+    ORDER BY us.user_id ASC LIMIT ?
+    ''',
+    '''
+    SELECT us.user_id, u.username, us.total_score
+    FROM user_stats us JOIN users u ON u.id = us.user_id
+    WHERE us.total_score < ?
+    ORDER BY us.total_score DESC, us.user_id ASC LIMIT ?
+    ''',
+)
+
+
+class FenwickTree:
+    def __init__(self, counts):
+        # O(n) construction: push each node's total into its parent.
+        n = len(counts)
+        tree = array('q', [0])
+        tree.extend(counts)
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self.size = n
+
+    def add(self, index, delta):
+        tree = self._tree
+        i = index + 1
+        while i <= self.size:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, index):
+        # Sum of counts[0..index], inclusive.
+        tree = self._tree
+        total = 0
+        i = min(index + 1, self.size)
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+
+def _bucket(score):
+    return max(0, int(score or 0))
+
+
+class RankIndex:
+    def __init__(self, refresh_interval=RANK_REFRESH_INTERVAL, dense_scores=RANK_DENSE_SCORES):
+        self.refresh_interval = refresh_interval
+        self.dense_scores = dense_scores
+        self._lock = threading.Lock()
+        self._counts = array('q', [0]) * self._capacity_for(0)
+        self._tree = FenwickTree(self._counts)
+        # Sorted scores of the players at or above dense_scores
+        self._overflow = []
+        self._total = 0
+        self._version = None
+        self._loaded_at = 0.0
+
+    def load(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('SELECT version FROM leaderboard_version WHERE id = 1')
+        row = cursor.fetchone()
+        version = row[0] if row else 0
+
+        cursor.execute('SELECT total_score, COUNT(*) FROM user_stats GROUP BY total_score')
+        rows = cursor.fetchall()
+        top = max((_bucket(score) for score, _ in rows if _bucket(score) < self.dense_scores), default=0)
+        counts = array('q', [0]) * self._capacity_for(top)
+        overflow = []
+        total = 0
+        for score, count in rows:
+            bucket = _bucket(score)
+            if bucket < self.dense_scores:
+                counts[bucket] += count
+            else:
+                overflow.extend([bucket] * count)
+            total += count
+        overflow.sort()
+
+        tree = FenwickTree(counts)
+        with self._lock:
+            self._counts, self._tree, self._overflow, self._total = counts, tree, overflow, total
+            self._version = version
+            self._loaded_at = time.monotonic()
+
+    def refresh(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('SELECT version FROM leaderboard_version WHERE id = 1')
+        row = cursor.fetchone()
+        version = row[0] if row else 0
+        if version != self._version and time.monotonic() - self._loaded_at >= self.refresh_interval:
+            self.load(conn)
+
+    def collect(self, cursor, score_deltas):
+        # Call inside the write transaction after user_stats was updated.
+        # score_deltas maps user_id -> points added in this transaction.
+        moves = []
+        for user_id, delta in score_deltas.items():
+            cursor.execute('SELECT total_score FROM user_stats WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+            if row is not None and delta:
+                moves.append((row[0] - delta, row[0]))
+        return moves
+
+    def apply(self, version, moves):
+        # Moves are (old_score, new_score); old_score None adds a player.
+        # Local moves are always applied. Only an unbroken version sequence
+        # marks the index current, so a gap leads to a periodic rebuild.
+        with self._lock:
+            for old, new in moves:
+                if old is not None:
+                    self._add(_bucket(old), -1)
+                    self._total -= 1
+                self._add(_bucket(new), 1)
+                self._total += 1
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+    def rank(self, score):
+        # Standard competition ranking: ties share the best rank.
+        return 1 + self.above(score)
+
+    def percentile(self, score):
+        # Share of players with a strictly lower score.
+        with self._lock:
+            if self._total == 0:
+                return 0.0
+            below = self._below(_bucket(score))
+            return round(100.0 * below / self._total, 2)
+
+    def above(self, score):
+        # Players with a strictly higher score
+        with self._lock:
+            return self._above(_bucket(score))
+
+    def below(self, score):
+        # Players with a strictly lower score
+        with self._lock:
+            return self._below(_bucket(score))
+
+    def _above(self, bucket):
+        if bucket >= self.dense_scores:
+            return len(self._overflow) - bisect.bisect_right(self._overflow, bucket)
+        return self._total - self._tree.prefix_sum(bucket)
+
+    def _below(self, bucket):
+        if bucket >= self.dense_scores:
+            return self._total - len(self._overflow) + bisect.bisect_left(self._overflow, bucket)
+        return self._tree.prefix_sum(bucket - 1)
+
+    @property
+    def total(self):
+        return self._total
+
+    def _add(self, bucket, delta):
+        if bucket >= self.dense_scores:
+            if delta > 0:
+                bisect.insort(self._overflow, bucket)
+            else:
+                index = bisect.bisect_left(self._overflow, bucket)
+                if index < len(self._overflow) and self._overflow[index] == bucket:
+                    del self._overflow[index]
+            return
+        if bucket >= len(self._counts):
+            self._counts.extend(array('q', [0]) * (self._capacity_for(bucket) - len(self._counts)))
+            self._tree = FenwickTree(self._counts)
+        self._counts[bucket] += delta
+        self._tree.add(bucket, delta)
+
+    def _capacity_for(self, bucket):
+        # Powers of two up to dense_scores, which holds every dense bucket
+        capacity = min(MIN_CAPACITY, self.dense_scores)
+        while capacity <= bucket:
+            capacity = min(capacity * 2, self.dense_scores)
+        return capacity
+
+
+def neighbours(cursor, user_id, score, count):
+    # Up to `count` players directly above and below (user_id, score),
+    # closest first.
+    def gather(queries):
+        cursor.execute(queries[0], (score, user_id, count))
+        rows = cursor.fetchall()
+        if len(rows) < count:
+            cursor.execute(queries[1], (score, count - len(rows)))
+            rows += cursor.fetchall()
+        return rows
+
+    return gather(_ABOVE_QUERIES), gather(_BELOW_QUERIES)
+
+
+def rank_across(indexes, score):
+    # rank() over the union of several shards' indexes
+    return 1 + sum(index.above(score) for index in indexes)
+
+
+def percentile_across(indexes, score):
+    total = sum(index.total for index in indexes)
+    if total == 0:
+        return 0.0
+    return round(100.0 * sum(index.below(score) for index in indexes) / total, 2)
+
+
+def neighbours_across(cursors, user_id, score, count):
+    # neighbours() over several shards: each shard's closest players,
+    # merged closest first
+    above, below = zip(*(neighbours(cursor, user_id, score, count) for cursor in cursors))
+    above = heapq.merge(*above, key=lambda row: (row['total_score'], -row['user_id']))
+    below = heapq.merge(*below, key=lambda row: (-row['total_score'], row['user_id']))
+    return list(itertools.islice(above, count)), list(itertools.islice(below, count))
@@ -0,0 +1,315 @@
+"""Server-side replay of client operation logs.
+
+A completed attempt may carry the list of operations the player performed.
+Replaying it against the level (from the catalog, or the generated pool
+for ids from 1001) tells whether the level was really
+won and in how many counted moves. The score is then recomputed with the
+same formula as calculateScore() in script.js, instead of trusting the
+client's number.
+
+Replay follows script.js move for move. It checks for a win after every
+operation. Pushing an empty value or popping an empty stack does not count
+as a move. delete() with a blank position never removes anything. Levels
+are compiled once and cached. Each structure is a plain list (or dict for
+the graph) that is mutated in place, never copied per operation.
+verify_many() checks a whole batch in one call, looking each level up once
+however many submissions replay it.
+"""
+from collections import namedtuple
+
+from generator import generated_pool
+from level_catalog import catalog
+from solver import normalize_values
+
+MAX_LOG_LENGTH = 500
+
+ReplayResult = namedtuple('ReplayResult', 'valid won moves score error')
+
+
+class InvalidReplay(ValueError):
+    pass
+
+
+def calculate_score(won, max_moves, moves, time_taken, hints):
+    # Mirrors calculateScore() in script.js
+    if not won:
+        return 0
+    score = 50
+    score += max(0, max_moves - moves) * 10
+    score += max(0, 30 - time_taken) * 2
+    score -= hints * 5
+    return max(0, score)
+
+
+def _empty(value):
+    # prompt() answers of null or '' are ignored by the game
+    return value is None or value == ''
+
+
+class StackReplay:
+    __slots__ = ('items', 'target')
+
+    def __init__(self, level):
+        self.items = list(level.initial)
+        self.target = level.target
+
+    def apply(self, operation, value, position):
+        if operation == 'push':
+            if _empty(value):
+                return False
+            self.items.append(value)
+            return True
+        if not self.items:
+            return False
+        self.items.pop()
+        return True
+
+    def matches(self):
+        return self.items == self.target
+
+
+class QueueReplay:
+    # Dequeue advances a head index instead of shifting the list.
+    __slots__ = ('items', 'head', 'target')
+
+    def __init__(self, level):
+        self.items = list(level.initial)
+        self.head = 0
+        self.target = level.target
+
+    def apply(self, operation, value, position):
+        if operation == 'enqueue':
+            if _empty(value):
+                return False
+            self.items.append(value)
+            return True
+        if self.head == len(self.items):
+            return False
+        self.head += 1
+        return True
+
+    def matches(self):
+        items, head = self.items, self.head
+        if len(items) - head != len(self.target):
+            return False
+        return all(items[head + i] == v for i, v in enumerate(self.target))
+
+
+class LinkedListReplay:
+    __slots__ = ('items', 'target')
+
+    def __init__(self, level):
+        self.items = list(level.initial)
+        self.target = level.target
+
+    def apply(self, operation, value, position):
+        items = self.items
+        if operation == 'insert':
+            if _empty(value):
+                return False
+            if position == 0 or not items:
+                items.insert(0, value)
+            elif position is None or position >= len(items):
+                items.append(value)
+            else:
+                # A negative position walks zero nodes and lands after the head
+                items.insert(max(position, 1), value)
+            return True
+
+        if not items:
+            return False
+        if position is None or position >= len(items):
+            return False
+        if position < 0:
+            raise InvalidReplay('Negative delete position')
+        del items[position]
+        return True
+
+    def matches(self):
+        return self.items == self.target
+
+
+class TreeReplay:
+    # toArray() is an in-order walk, so only the multiset of values matters.
+    __slots__ = ('counts', 'size', 'target', 'target_size')
+
+    def __init__(self, level):
+        self.counts = dict(level.initial_counts)
+        self.size = len(level.initial)
+        self.target = level.target_counts
+        self.target_size = len(level.target)
+
+    def apply(self, operation, value, position):
+        if _empty(value):
+            return False
+        if operation == 'insert_tree':
+            self.counts[value] = self.counts.get(value, 0) + 1
+            self.size += 1
+        return True
+
+    def matches(self):
+        return self.size == self.target_size and self.counts == self.target
+
+
+class GraphReplay:
+    # A dict keeps insertion order, like the Map behind Graph.toArray().
+    __slots__ = ('vertices', 'target')
+
+    def __init__(self, level):
+        self.vertices = dict.fromkeys(level.initial)
+        self.target = level.target
+
+    def apply(self, operation, value, position):
+        if _empty(value):
+            return False
+        if operation == 'addVertex':
+            self.vertices.setdefault(value)
+        else:
+            self.vertices.pop(value, None)
+        return True
+
+    def matches(self):
+        vertices = self.vertices
+        if len(vertices) != len(self.target):
+            return False
+        return all(a == b for a, b in zip(vertices, self.target))
+
+
+REPLAYS = {
+    'stack': StackReplay,
+    'queue': QueueReplay,
+    'linkedlist': LinkedListReplay,
+    'tree': TreeReplay,
+    'graph': GraphReplay,
+}
+
+
+class CompiledLevel:
+    # Everything a replay needs from a level, normalized once.
+    def __init__(self, data_structure, level):
+        self.replay = REPLAYS[data_structure]
+        self.operations = frozenset(level['operations'])
+        self.max_moves = level['maxMoves']
+        self.sample = level['target'] + level['initial']
+        self.initial = normalize_values(level['initial'], self.sample)
+        self.target = normalize_values(level['target'], self.sample)
+        if data_structure == 'graph':
+            # Duplicate target vertices collapse, as addVertex() does
+            self.initial = list(dict.fromkeys(self.initial))
+            self.target = list(dict.fromkeys(self.target))
+        self.target_counts = _counts(self.target)
+        self.initial_counts = _counts(self.initial)
+        self.numeric = self.sample and all(isinstance(v, int) for v in self.sample)
+
+    def value(self, value):
+        if _empty(value):
+            return None
+        if self.numeric:
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return value
+        return value if isinstance(value, str) else str(value)
+
+
+def _counts(values):
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    return counts
+
+
+_compiled = {}
+
+
+def compiled_level(data_structure, level_id):
+    try:
+        level_id = int(level_id)
+    except (TypeError, ValueError):
+        return None
+    key = (data_structure, level_id)
+    level = _compiled.get(key)
+    if level is None:
+        definition = catalog.level(data_structure, level_id) or generated_pool.level(data_structure, level_id)
+        if definition is None or data_structure not in REPLAYS:
+            return None
+        level = _compiled[key] = CompiledLevel(data_structure, definition)
+    return level
+
+
+def _unpack(operation):
+    # {"operation": "insert", "value": "B", "position": 1} or the compact
+    # form ["insert", "B", 1]
+    if isinstance(operation, dict):
+        return operation.get('operation'), operation.get('value'), operation.get('position')
+    if isinstance(operation, (list, tuple)) and 1 <= len(operation) <= 3:
+        operation = tuple(operation) + (None, None)
+        return operation[0], operation[1], operation[2]
+    raise InvalidReplay('Malformed operation')
+
+
+def _replay(level, operations):
+    # Returns (won, moves) or raises InvalidReplay
+    if not isinstance(operations, list):
+        raise InvalidReplay('Operation log must be a list')
+    if len(operations) > MAX_LOG_LENGTH:
+        raise InvalidReplay('Operation log too long')
+
+    state = level.replay(level)
+    allowed = level.operations
+    max_moves = level.max_moves
+    last = len(operations) - 1
+    moves = 0
+
+    for n, operation in enumerate(operations):
+        name, value, position = _unpack(operation)
+        if name not in allowed:
+            raise InvalidReplay(f'Operation not allowed in this level: {name}')
+        if position is not None and (isinstance(position, bool) or not isinstance(position, int)):
+            raise InvalidReplay('Position must be an integer')
+
+        if state.apply(name, level.value(value), position):
+            moves += 1
+
+        # checkWinCondition() runs after every operation
+        won = state.matches()
+        if won or moves > max_moves:
+            if n != last:
+                raise InvalidReplay('Operations continue after the game ended')
+            return won, moves
+
+    return False, moves
+
+
+def verify(data_structure, level_id, operations, time_taken=0, hints=0):
+    return _verify(compiled_level(data_structure, level_id), operations, time_taken, hints)
+
+
+def _verify(level, operations, time_taken, hints):
+    if level is None:
+        return ReplayResult(False, False, 0, 0, 'Unknown level')
+    try:
+        time_taken = max(0, int(time_taken or 0))
+        hints = max(0, int(hints or 0))
+    except (TypeError, ValueError):
+        return ReplayResult(False, False, 0, 0, 'time_taken and hints must be integers')
+    try:
+        won, moves = _replay(level, operations)
+    except InvalidReplay as e:
+        return ReplayResult(False, False, 0, 0, str(e))
+    score = calculate_score(won, level.max_moves, moves, time_taken, hints)
+    return ReplayResult(True, won, moves, score, None)
+
+
+def verify_many(submissions):
+    # submissions: iterable of (data_structure, level_id, operations,
+    # time_taken, hints). Returns one ReplayResult per submission.
+    levels = {}
+    results = []
+    for data_structure, level_id, operations, time_taken, hints in submissions:
+        # As client JSON: the ids may be any type, and "3" is level 3 too
+        key = (str(data_structure), str(level_id))
+        if key not in levels:
+            levels[key] = compiled_level(data_structure, level_id)
+        results.append(_verify(levels[key], operations, time_taken, hints))
+    return results
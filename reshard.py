@@ -0,0 +1,181 @@
+"""Move user_stats, game_progress and the attempt history to a different number of shards.
+
+    SHARD_COUNT=1 python reshard.py 4    # then start the server with SHARD_COUNT=4
+    SHARD_COUNT=4 python reshard.py 1    # and back to a single file
+
+Run it with the server stopped. SHARD_COUNT, DATABASE_PATH and SHARD_PATH
+describe the current layout, as for the server. Each new shard file (for a
+single shard, a copy of the directory database) is built under a temporary
+name, row counts and totals are checked against the
+old layout, and only then are the old files dropped and the new ones moved
+into place. Row ids in game_progress and user_stats are renumbered; users
+never moves. Back the files up first all the same: a crash during that last
+step leaves a mix of both layouts.
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+import app
+import migrations
+from database import DATABASE_PATH
+from shards import SHARD_COUNT, shard_index, shard_paths
+
+LOAD_PRAGMAS = (
+    ('journal_mode', 'OFF'),
+    ('synchronous', 'OFF'),
+    ('cache_size', -256000),     # 256 MiB
+)
+
+# Everything but the row id, which each file assigns itself
+COPIES = {
+    'user_stats': 'user_id, total_score, total_time, levels_completed, total_attempts, last_updated',
+    'game_progress': ('user_id, data_structure, level_id, completed, best_score, best_time, best_moves, '
+                      'attempts, last_played'),
+    'attempts': 'day, user_id, data_structure, level_id, completed, score, time_taken, moves',
+    'rollup_day': 'period, user_id, total_score, total_time, levels_completed, total_attempts',
+    'rollup_week': 'period, user_id, total_score, total_time, levels_completed, total_attempts',
+    'attempt_weeks': ('user_id, data_structure, level_id, week, attempts, completions, total_score, total_time, '
+                      'best_score, best_time, best_moves'),
+}
+
+CHECKSUM = '''
+    SELECT (SELECT COUNT(*) FROM {db}.user_stats),
+           (SELECT TOTAL(total_score) FROM {db}.user_stats),
+           (SELECT TOTAL(total_attempts) FROM {db}.user_stats),
+           (SELECT COUNT(*) FROM {db}.game_progress),
+           (SELECT TOTAL(attempts) FROM {db}.game_progress)
+'''
+
+
+def checksum(paths):
+    totals = [0] * 5
+    for path in paths:
+        conn = sqlite3.connect(path)
+        for i, value in enumerate(conn.execute(CHECKSUM.format(db='main')).fetchone()):
+            totals[i] += value
+        conn.close()
+    return totals
+
+
+def remove(path, suffixes=('', '-wal', '-shm')):
+    for suffix in suffixes:
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def copy_rows(conn, sources, index, count):
+    # Appends this shard's rows from every source file, one transaction each
+    conn.create_function('shard_of', 1, lambda user_id: shard_index(user_id, count), deterministic=True)
+    for source in sources:
+        conn.execute('ATTACH DATABASE ? AS source', (source,))
+        conn.execute('BEGIN')
+        for table, columns in COPIES.items():
+            conn.execute(f'INSERT INTO main.{table} ({columns}) SELECT {columns} FROM source.{table} '
+                         'WHERE shard_of(user_id) = ? ORDER BY user_id', (index,))
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE source')
+
+
+def build(path, sources, index, count):
+    # A complete shard file at path, with the secondary indexes built once
+    # after the load (as benchmarks/seed.py does)
+    remove(path)
+    conn = sqlite3.connect(path, isolation_level=None)
+    for name, value in LOAD_PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    app._create_schema(cursor, users=False)
+    for name in migrations.index_names():
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    cursor.execute('PRAGMA user_version = 0')
+    cursor.execute('COMMIT')
+
+    copy_rows(conn, sources, index, count)
+
+    cursor.execute('BEGIN')
+    migrations.migrate(cursor)
+    cursor.execute('COMMIT')
+    cursor.execute('PRAGMA analysis_limit = 1000')
+    cursor.execute('ANALYZE')
+    cursor.execute('PRAGMA journal_mode = WAL')
+    conn.close()
+
+
+def reshard(target):
+    sources, targets = shard_paths(SHARD_COUNT), shard_paths(target)
+    if SHARD_COUNT == target:
+        print(f'Already {target} shard(s), nothing to do')
+        return
+    # Importing app created and migrated the current layout (and replayed
+    # any write-behind journal); nothing else may hold these files now.
+    app.router.close_all()
+    expected = checksum(sources)
+    started = time.perf_counter()
+
+    if target == 1:
+        # Back into the directory database, whose copies must be empty. The
+        # rows go into a copy of it, so a failed run leaves it untouched.
+        existing = checksum([DATABASE_PATH])
+        if existing[0] or existing[3]:
+            raise SystemExit(f'{DATABASE_PATH} already holds progress rows; refusing to merge into it')
+        moved = [DATABASE_PATH + '.resharding']
+        remove(moved[0])
+        conn = sqlite3.connect(DATABASE_PATH, isolation_level=None)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('VACUUM INTO ?', (moved[0],))
+        conn.close()
+        conn = sqlite3.connect(moved[0], isolation_level=None)
+        copy_rows(conn, sources, 0, 1)
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.close()
+    else:
+        moved = [path + '.resharding' for path in targets]
+        for index, path in enumerate(moved):
+            build(path, sources, index, target)
+            print(f'built {targets[index]} in {time.perf_counter() - started:.1f} s')
+
+    actual = checksum(moved)
+    if actual != expected:
+        for path in moved:
+            remove(path)
+        raise SystemExit(f'Checksum mismatch, old layout left in place: {expected} != {actual}')
+
+    # Switch over
+    if SHARD_COUNT == 1:
+        conn = sqlite3.connect(DATABASE_PATH, isolation_level=None)
+        conn.execute('BEGIN IMMEDIATE')
+        for table in COPIES:
+            conn.execute(f'DELETE FROM {table}')
+        conn.execute('DELETE FROM write_behind_segments')
+        conn.execute('COMMIT')
+        conn.close()
+    else:
+        for path in sources:
+            remove(path)
+    for path, final in zip(moved, targets):
+        os.replace(path, final)
+    if target == 1:
+        # Checkpointed above, so the old -wal and -shm held nothing
+        remove(DATABASE_PATH, suffixes=('-wal', '-shm'))
+
+    print(f'{SHARD_COUNT} -> {target} shard(s): {expected[0]} users, {expected[3]} progress rows '
+          f'in {time.perf_counter() - started:.1f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('shards', type=int, help='new SHARD_COUNT')
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error('shards must be at least 1')
+    reshard(args.shards)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Short-lived cache of encoded JSON responses for hot read routes, with single-flight.
+
+GET /api/leaderboard[/<ds>] and GET /api/progress keep their response
+bodies here as the bytes jsonify() produced, keyed by route and parameters
+(board and limit, or user id). A hit costs a dict lookup and no query or
+JSON encoding. Entries live RESPONSE_CACHE_TTL seconds (default 1; 0 turns
+the cache off), and the least recently used are evicted beyond
+RESPONSE_CACHE_BYTES of bodies (default 32 MiB).
+
+Misses are coalesced: while one request fills a key, identical requests
+wait for its result instead of running the same queries, so a burst of N
+clients costs one database read.
+
+Every entry carries tags. Progress writes invalidate the writer's
+'progress:<user_id>' and 'leaderboard' at once in the worker that
+handles them, including a fill already in flight, which then is not
+stored. Writes handled by other workers show up within the TTL.
+
+/api/metrics counts response_cache_requests_total by route and result
+(hit, miss, coalesced) and response_cache_evictions_total.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 1))
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES', 32 * 2 ** 20))
+
+requests = metrics.registry.counter(
+    'response_cache_requests_total', 'Cacheable reads by route and result (hit, miss, coalesced).',
+    ('route', 'result'))
+evictions = metrics.registry.counter(
+    'response_cache_evictions_total', 'Cached responses evicted to stay under RESPONSE_CACHE_BYTES.')
+
+
+class _Flight:
+    # One fill in progress; identical misses wait on it
+    __slots__ = ('tags', 'done', 'body', 'error')
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.done = threading.Event()
+        self.body = None
+        self.error = None
+
+
+class ResponseCache:
+    def __init__(self, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (expires, body, tags), least recently used first
+        self._entries = OrderedDict()
+        # tag -> keys of the entries carrying it
+        self._tagged = {}
+        self._flights = {}
+        self._bytes = 0
+        self.hits = self.misses = self.coalesced = self.evictions = 0
+
+    def get(self, key, tags, fill):
+        # Encoded body for key; fill() produces it on a miss
+        if not self.ttl:
+            return fill()
+        tags = frozenset(tags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._count(key, 'hit', entry[1])
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(tags)
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._count(key, 'coalesced', flight.body)
+
+        try:
+            flight.body = fill()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                # Invalidated meanwhile if the flight is no longer registered
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                    if flight.error is None:
+                        self._store(key, flight.body, tags)
+            flight.done.set()
+        return self._count(key, 'miss', flight.body)
+
+    def _store(self, key, body, tags):
+        self._drop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, body, tags)
+        self._bytes += len(body)
+        for tag in tags:
+            self._tagged.setdefault(tag, set()).add(key)
+        while self._bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+            with metrics.registry.lock:
+                evictions.inc(())
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= len(entry[1])
+        for tag in entry[2]:
+            keys = self._tagged[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tagged[tag]
+
+    @staticmethod
+    def _count(key, result, body):
+        with metrics.registry.lock:
+            requests.inc((key[0], result))
+        return body
+
+    def invalidate(self, *tags):
+        # Drops entries with any of the tags, and detaches fills in flight
+        # for them so later requests start a fresh one
+        tags = set(tags)
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tagged.get(tag, ())):
+                    self._drop(key)
+            for key in [key for key, flight in self._flights.items() if tags & flight.tags]:
+                del self._flights[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tagged.clear()
+            self._flights.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
@@ -532,7 +532,7 @@ function setupAuth() {
             
             if (response.ok) {
                 const data = await response.json();
-                gameState.currentUser = { ...data.user, isGuest: false };
+                gameState.currentUser = { ...data.user, token: data.token, isGuest: false };
                 showMessage('Login successful!', 'success');
                 setTimeout(() => showMainMenu(), 1000);
             } else {
@@ -567,7 +567,7 @@ function setupAuth() {
             
             if (response.ok) {
                 const data = await response.json();
-                gameState.currentUser = { ...data.user, isGuest: false };
+                gameState.currentUser = { ...data.user, token: data.token, isGuest: false };
                 showMessage('Registration successful!', 'success');
                 setTimeout(() => showMainMenu(), 1000);
             } else {
@@ -611,6 +611,13 @@ function setupMainMenu() {
     
     document.getElementById('logoutBtn').addEventListener('click', () => {
         if (confirm('Are you sure you want to logout?')) {
+            const token = gameState.currentUser && gameState.currentUser.token;
+            if (token) {
+                fetch('http://localhost:5000/api/logout', {
+                    method: 'POST',
+                    headers: { 'Authorization': `Bearer ${token}` }
+                }).catch(() => {});
+            }
             gameState.currentUser = null;
             showScreen('loginScreen');
         }
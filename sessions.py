@@ -0,0 +1,178 @@
+"""Signed session tokens, checked without a database round trip.
+
+login() and register() issue a token
+
+    <user_id>.<expiry>.<session id>.<signature>
+
+where expiry is a Unix time in hex, the session id 9 random bytes and the
+signature the first 16 bytes of HMAC-SHA256 over the rest, both base64url.
+Routes wrapped in app.require_session read it from `Authorization:
+Bearer`, and the user_id they act on comes from the token, never from the
+request.
+
+Each worker keeps the sessions it has seen in an LRU cache
+(SESSION_CACHE_SIZE) keyed by the whole token, together with the user's
+metadata. A cache hit costs a dict lookup and an expiry check; a token this
+worker has not seen yet (issued by another worker, or evicted) costs one
+HMAC. An expired entry is dropped when next looked up, or pushed out by
+newer ones.
+
+POST /api/logout revokes a session. The worker that handles it forgets the
+token at once; the others read revoked_sessions at most once per
+SESSION_REFRESH_INTERVAL seconds, so there a revoked token works for up to
+that long. That periodic read is the only database access here.
+
+SESSION_SECRET must be the same in every worker. When it is unset, a random
+secret is created once in SESSION_SECRET_PATH (default '<DATABASE_PATH
+stem>.secret') and read from there, so tokens survive restarts.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from database import DATABASE_PATH
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 7 * 24 * 3600))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 100000))
+SESSION_REFRESH_INTERVAL = float(os.environ.get('SESSION_REFRESH_INTERVAL', 5))
+SESSION_SECRET_PATH = os.environ.get('SESSION_SECRET_PATH', os.path.splitext(DATABASE_PATH)[0] + '.secret')
+
+SIGNATURE_BYTES = 16
+
+
+def load_secret(path=SESSION_SECRET_PATH):
+    secret = os.environ.get('SESSION_SECRET')
+    if secret:
+        return secret.encode()
+    if not os.path.exists(path):
+        # Written aside and linked into place, so a worker racing this one
+        # never reads a half-written file; the first link wins
+        temporary = f'{path}.{os.getpid()}'
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+    with open(path) as f:
+        return f.read().strip().encode()
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+class Session:
+    __slots__ = ('user_id', 'expires', 'session_id', 'username', 'email')
+
+    def __init__(self, user_id, expires, session_id, username=None, email=None):
+        self.user_id = user_id
+        self.expires = expires
+        self.session_id = session_id
+        self.username = username
+        self.email = email
+
+
+class SessionStore:
+    def __init__(self, secret=None, ttl=SESSION_TTL, cache_size=SESSION_CACHE_SIZE,
+                 refresh_interval=SESSION_REFRESH_INTERVAL):
+        self._secret = secret
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        # session id -> expiry, for every revoked session not yet expired
+        self._revoked = {}
+        self._revoked_id = 0
+        self._next_refresh = 0.0
+
+    @property
+    def secret(self):
+        # Read on first use, after DATABASE_PATH's directory exists
+        if self._secret is None:
+            self._secret = load_secret()
+        return self._secret
+
+    def _sign(self, payload):
+        return _b64(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES])
+
+    def issue(self, user_id, username=None, email=None):
+        session = Session(user_id, int(time.time()) + self.ttl, secrets.token_urlsafe(9), username, email)
+        payload = f'{user_id}.{session.expires:x}.{session.session_id}'
+        token = f'{payload}.{self._sign(payload)}'
+        self._remember(token, session)
+        return token, session
+
+    def validate(self, token):
+        # The token's Session, or None if it is malformed, forged, expired
+        # or revoked
+        now = time.time()
+        with self._lock:
+            session = self._cache.get(token)
+            if session is not None:
+                if session.expires > now and session.session_id not in self._revoked:
+                    self._cache.move_to_end(token)
+                    return session
+                del self._cache[token]
+                return None
+
+        # Real tokens are ASCII, and compare_digest() raises TypeError on
+        # any other str
+        if not token.isascii():
+            return None
+        parts = token.split('.')
+        if len(parts) != 4:
+            return None
+        payload = token[:-len(parts[3]) - 1]
+        if not hmac.compare_digest(parts[3], self._sign(payload)):
+            return None
+        user_id, expires, session_id = parts[:3]
+        session = Session(int(user_id), int(expires, 16), session_id)
+        if session.expires <= now or session_id in self._revoked:
+            return None
+        self._remember(token, session)
+        return session
+
+    def _remember(self, token, session):
+        with self._lock:
+            self._cache[token] = session
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def revoke(self, conn, session):
+        conn.execute('INSERT OR IGNORE INTO revoked_sessions (session_id, expires) VALUES (?, ?)',
+                     (session.session_id, session.expires))
+        # Revocations of expired tokens are no longer needed
+        conn.execute('DELETE FROM revoked_sessions WHERE expires <= ?', (int(time.time()),))
+        with self._lock:
+            self._revoked[session.session_id] = session.expires
+
+    def refresh_due(self):
+        return time.monotonic() >= self._next_refresh
+
+    def refresh(self, conn):
+        # Picks up sessions other workers revoked since the last call
+        self._next_refresh = time.monotonic() + self.refresh_interval
+        cursor = conn.execute('SELECT id, session_id, expires FROM revoked_sessions WHERE id > ?',
+                              (self._revoked_id,))
+        rows = cursor.fetchall()
+        now = time.time()
+        with self._lock:
+            revoked = {sid: expires for sid, expires in self._revoked.items() if expires > now}
+            for row_id, session_id, expires in rows:
+                self._revoked_id = max(self._revoked_id, row_id)
+                if expires > now:
+                    revoked[session_id] = expires
+            self._revoked = revoked
+
+
+sessions = SessionStore()
@@ -0,0 +1,92 @@
+"""Routes per-user tables to SQLite shard files by user_id.
+
+users always lives in the directory database (DATABASE_PATH). With the
+default SHARD_COUNT=1 user_stats and game_progress live there too and the
+single shard is the directory itself. With SHARD_COUNT=N they are spread
+over N files (SHARD_PATH, default '<DATABASE_PATH stem>-shard{n}.db') by a
+hash of user_id. Each file has its own write lock, so writes for users on
+different shards commit in parallel.
+
+Every shard keeps its own leaderboard_version, in-memory leaderboard and
+rank index. Reads about one user go to that user's shard only; leaderboard
+and rank reads ask every shard and merge. Shard connections attach the
+directory read-only as `directory`, so queries that join users work
+unchanged.
+
+Change SHARD_COUNT only with reshard.py, with the server stopped.
+"""
+import os
+import zlib
+
+from database import DATABASE_PATH, ConnectionPool, pool
+from leaderboard import Leaderboard
+from rank_index import RankIndex
+
+SHARD_COUNT = max(1, int(os.environ.get('SHARD_COUNT', 1)))
+SHARD_PATH = os.environ.get('SHARD_PATH', os.path.splitext(DATABASE_PATH)[0] + '-shard{n}.db')
+
+
+def shard_index(user_id, count):
+    # Multiplicative hash, so sequential ids spread evenly. Ids that are
+    # not integers (they match no user) still route somewhere stable.
+    try:
+        key = int(user_id)
+    except (TypeError, ValueError):
+        key = zlib.crc32(str(user_id).encode())
+    return ((key * 2654435761) & 0xFFFFFFFF) % count
+
+
+def shard_paths(count, template=SHARD_PATH):
+    # Files holding user_stats and game_progress for a SHARD_COUNT
+    if count == 1:
+        return [DATABASE_PATH]
+    return [template.format(n=n) for n in range(count)]
+
+
+class Shard:
+    def __init__(self, index, pool):
+        self.index = index
+        self.pool = pool
+        self.leaderboard = Leaderboard()
+        self.rank_index = RankIndex()
+
+
+class ShardRouter:
+    def __init__(self, directory, pools):
+        self.directory = directory
+        self.shards = [Shard(n, shard_pool) for n, shard_pool in enumerate(pools)]
+
+    def for_user(self, user_id):
+        return self.shards[shard_index(user_id, len(self.shards))]
+
+    def group(self, items, user_id=lambda item: item[0]):
+        # {shard: [items]} in first-seen order, keeping item order per shard
+        groups = {}
+        for item in items:
+            groups.setdefault(self.for_user(user_id(item)), []).append(item)
+        return groups
+
+    @property
+    def sharded(self):
+        return any(shard.pool is not self.directory for shard in self.shards)
+
+    def load(self):
+        for shard in self.shards:
+            with shard.pool.connection() as conn:
+                shard.leaderboard.load(conn)
+                shard.rank_index.load(conn)
+
+    def close_all(self):
+        self.directory.close_all()
+        for shard in self.shards:
+            shard.pool.close_all()
+
+
+def from_env(count=SHARD_COUNT):
+    if count == 1:
+        return ShardRouter(pool, [pool])
+    return ShardRouter(pool, [ConnectionPool(path, attach=[('directory', DATABASE_PATH)])
+                              for path in shard_paths(count)])
+
+
+router = from_env()
@@ -0,0 +1,366 @@
+"""Optimal-move solver and hint engine for the puzzle levels.
+
+Each data structure is modelled with the same operations and move counting
+as script.js. A state is encoded as a compact `bytes` string of value
+indices. A* runs over these states with a per-structure lower bound, which
+is exact for every structure the game has, so searches expand little more
+than the optimal path. Every state on a solved path is memoized in a bounded
+LRU cache, so later hints along the same line of play are dictionary lookups.
+
+The game checks for a win only after a move, so a solution always has at
+least one move, even when the start state already matches the target.
+"""
+import heapq
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+HINT_CACHE_SIZE = int(os.environ.get('HINT_CACHE_SIZE', 50000))
+MAX_EXPANSIONS = 200000
+
+
+class Unsolvable(Exception):
+    pass
+
+
+def _value_key(value):
+    # JS compares numbers numerically and strings lexically; levels never
+    # mix the two, but keep the ordering total anyway.
+    return (isinstance(value, str), value)
+
+
+def normalize_values(values, like):
+    # Coerce client values ("5") to the level's value type (5) so a state
+    # read from the page compares equal to the level definition.
+    if like and all(isinstance(v, int) and not isinstance(v, bool) for v in like):
+        normalized = []
+        for value in values:
+            try:
+                normalized.append(int(value))
+            except (TypeError, ValueError):
+                normalized.append(value)
+        return normalized
+    return [str(value) if isinstance(value, (int, float)) else value for value in values]
+
+
+class PuzzleModel:
+    # Subclasses implement successors() and lower_bound() on encoded states.
+    name = None
+
+    def __init__(self, operations, target, *extra_values):
+        self.operations = frozenset(operations)
+        values = {}
+        for value in itertools.chain(target, *extra_values):
+            values.setdefault(value, None)
+        self.values = sorted(values, key=_value_key)
+        self.index = {value: i for i, value in enumerate(self.values)}
+        # Only target values are ever worth adding
+        self.useful = bytes(sorted({self.index[v] for v in target}))
+        if len(self.values) > 255:
+            raise ValueError('Too many distinct values in puzzle')
+
+    def build(self, items):
+        # State after adding items one by one, as initializeGame() does.
+        state = b''
+        for item in items:
+            state = self.add(state, self.index[item])
+        return state
+
+    def decode(self, state):
+        return [self.values[i] for i in state]
+
+    def add(self, state, value):
+        return state + bytes((value,))
+
+    def move(self, operation, value=None, position=None):
+        move = {'operation': operation}
+        if value is not None:
+            move['value'] = self.values[value]
+        if position is not None:
+            move['position'] = position
+        return move
+
+
+class StackModel(PuzzleModel):
+    name = 'stack'
+
+    def successors(self, state):
+        if 'push' in self.operations:
+            for v in self.useful:
+                yield ('push', v, None), state + bytes((v,))
+        if 'pop' in self.operations and state:
+            yield ('pop', None, None), state[:-1]
+
+    def lower_bound(self, state, target):
+        p = _common_prefix(state, target)
+        if p < len(state) and 'pop' not in self.operations:
+            return None
+        if p < len(target) and 'push' not in self.operations:
+            return None
+        return (len(state) - p) + (len(target) - p)
+
+
+class QueueModel(PuzzleModel):
+    name = 'queue'
+
+    def successors(self, state):
+        if 'enqueue' in self.operations:
+            for v in self.useful:
+                yield ('enqueue', v, None), state + bytes((v,))
+        if 'dequeue' in self.operations and state:
+            yield ('dequeue', None, None), state[1:]
+
+    def lower_bound(self, state, target):
+        # Dequeue k from the front, then what is left must prefix the target.
+        n = len(state)
+        for k in range(n + 1):
+            if k and 'dequeue' not in self.operations:
+                return None
+            if target.startswith(state[k:]):
+                if len(target) > n - k and 'enqueue' not in self.operations:
+                    return None
+                return k + len(target) - (n - k)
+        return None
+
+
+class LinkedListModel(PuzzleModel):
+    name = 'linkedlist'
+
+    def successors(self, state):
+        n = len(state)
+        if 'insert' in self.operations:
+            for v in self.useful:
+                single = bytes((v,))
+                for i in range(n + 1):
+                    yield ('insert', v, i), state[:i] + single + state[i:]
+        if 'delete' in self.operations:
+            # delete() with a blank position never removes anything in the
+            # game, so only explicit positions are real moves.
+            for i in range(n):
+                yield ('delete', None, i), state[:i] + state[i + 1:]
+
+    def lower_bound(self, state, target):
+        common = _lcs_length(state, target)
+        if common < len(state) and 'delete' not in self.operations:
+            return None
+        if common < len(target) and 'insert' not in self.operations:
+            return None
+        return len(state) + len(target) - 2 * common
+
+
+class TreeModel(PuzzleModel):
+    name = 'tree'
+
+    # toArray() is an in-order walk, so a BST compares by its sorted
+    # contents. Value indices are assigned in sorted order, so sorting the
+    # bytes sorts the values.
+    def add(self, state, value):
+        return bytes(sorted(state + bytes((value,))))
+
+    def successors(self, state):
+        if 'insert_tree' in self.operations:
+            for v in self.useful:
+                yield ('insert_tree', v, None), self.add(state, v)
+        if 'search' in self.operations and (state or self.useful):
+            # Searching counts as a move and changes nothing.
+            yield ('search', (state or self.useful)[0], None), state
+
+    def lower_bound(self, state, target):
+        remaining = list(target)
+        for v in state:
+            if v not in remaining:
+                return None
+            remaining.remove(v)
+        if remaining and 'insert_tree' not in self.operations:
+            return None
+        return len(remaining)
+
+
+class GraphModel(PuzzleModel):
+    name = 'graph'
+
+    # toArray() lists vertices in insertion order, without duplicates.
+    def add(self, state, value):
+        return state if value in state else state + bytes((value,))
+
+    def successors(self, state):
+        if 'addVertex' in self.operations:
+            for v in self.useful:
+                yield ('addVertex', v, None), self.add(state, v)
+        if 'removeVertex' in self.operations:
+            for v in state:
+                yield ('removeVertex', v, None), state.replace(bytes((v,)), b'')
+            # Removing a missing vertex still counts as a move.
+            absent = next((v for v in range(len(self.values)) if v not in state), None)
+            if absent is not None:
+                yield ('removeVertex', absent, None), state
+
+    def lower_bound(self, state, target):
+        # Keep the longest prefix of the target that appears in order,
+        # remove everything else, then add the rest.
+        p = 0
+        for v in state:
+            if p < len(target) and target[p] == v:
+                p += 1
+        if p < len(state) and 'removeVertex' not in self.operations:
+            return None
+        if p < len(target) and 'addVertex' not in self.operations:
+            return None
+        return (len(state) - p) + (len(target) - p)
+
+
+MODELS = {model.name: model for model in (StackModel, QueueModel, LinkedListModel, TreeModel, GraphModel)}
+
+
+def _common_prefix(a, b):
+    p = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        p += 1
+    return p
+
+
+def _lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def make_model(data_structure, level, state=None):
+    if data_structure not in MODELS:
+        raise ValueError(f'Unknown data structure: {data_structure}')
+    initial = level['initial']
+    if state is not None:
+        # A client state: flat, and no bigger than play could make it
+        if not all(isinstance(v, (str, int)) and not isinstance(v, bool) for v in state):
+            raise ValueError('state values must be strings or integers')
+        if len(state) > len(initial) + default_max_depth(level):
+            raise ValueError('state is larger than this level allows')
+    current = initial if state is None else normalize_values(state, level['target'] + initial)
+    model = MODELS[data_structure](level['operations'], level['target'], initial, current)
+    return model, model.build(current), model.build(level['target'])
+
+
+def search(model, start, target, max_depth, max_expansions=MAX_EXPANSIONS):
+    # A* over (state, has_moved). Returns a list of (move, next_state).
+    bound = model.lower_bound(start, target)
+    if bound is None or bound > max_depth:
+        raise Unsolvable()
+
+    counter = itertools.count()
+    root = (start, False)
+    frontier = [(bound, 0, next(counter), root)]
+    parents = {root: None}
+    best = {root: 0}
+    expansions = 0
+
+    while frontier:
+        _, neg_g, _, node = heapq.heappop(frontier)
+        g = -neg_g
+        if g > best.get(node, g):
+            continue
+        state, moved = node
+        if moved and state == target:
+            return _path(parents, node)
+
+        expansions += 1
+        if expansions > max_expansions:
+            break
+
+        for move, child_state in model.successors(state):
+            child = (child_state, True)
+            child_g = g + 1
+            if child_g >= best.get(child, max_depth + 1):
+                continue
+            h = model.lower_bound(child_state, target)
+            if h is None or child_g + h > max_depth:
+                continue
+            best[child] = child_g
+            parents[child] = (node, move)
+            # Ties broken towards deeper nodes so exact bounds walk straight
+            # down the optimal path.
+            heapq.heappush(frontier, (child_g + h, -child_g, next(counter), child))
+
+    raise Unsolvable()
+
+
+def _path(parents, node):
+    steps = []
+    while parents[node] is not None:
+        parent, move = parents[node]
+        steps.append((move, node[0]))
+        node = parent
+    steps.reverse()
+    return steps
+
+
+def default_max_depth(level):
+    return max(2 * level.get('maxMoves', 0), len(level['initial']) + len(level['target']) + 2)
+
+
+def solve(data_structure, level, state=None, max_depth=None):
+    # Optimal list of moves from `state` (default: the level's initial
+    # state) to the target. Raises Unsolvable.
+    model, start, target = make_model(data_structure, level, state)
+    steps = search(model, start, target, max_depth or default_max_depth(level))
+    return [model.move(*move) for move, _ in steps]
+
+
+class HintCache:
+    def __init__(self, maxsize=HINT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+hint_cache = HintCache()
+
+
+def next_move(data_structure, level_id, level, state=None):
+    # Returns (move, moves_remaining) for the best next move from `state`.
+    model, start, target = make_model(data_structure, level, state)
+    key = (data_structure, level_id, tuple(model.decode(start)))
+    cached = hint_cache.get(key)
+    if cached is not None:
+        return cached
+
+    steps = search(model, start, target, default_max_depth(level))
+
+    # Every suffix of an optimal path is optimal, so cache the whole line.
+    # The final state is left out: from there the game still needs one
+    # more move, which is not what the path says.
+    state = start
+    for i, (move, next_state) in enumerate(steps):
+        hint_cache.put((data_structure, level_id, tuple(model.decode(state))),
+                       (model.move(*move), len(steps) - i))
+        state = next_state
+
+    return model.move(*steps[0][0]), len(steps)
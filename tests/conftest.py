@@ -0,0 +1,66 @@
+import functools
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads its configuration at import: a throwaway database, cheap
+# password hashing in-process, no background compaction and a known
+# operator key
+_tmp = tempfile.mkdtemp(prefix='game-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(_tmp, 'game.db')
+os.environ['PASSWORD_HASH_PROCESSES'] = '0'
+os.environ['PASSWORD_SCRYPT_N'] = '16'
+os.environ['SESSION_SECRET'] = 'test-secret'
+os.environ['ATTEMPTS_COMPACTION_INTERVAL'] = '0'
+os.environ['OPERATOR_KEY'] = 'test-operator-key'
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import app as api  # noqa: E402
+from generator import generated_pool  # noqa: E402
+from level_catalog import catalog  # noqa: E402
+from solver import solve  # noqa: E402
+
+_names = itertools.count(1)
+
+
+@pytest.fixture
+def client():
+    return api.app.test_client()
+
+
+@pytest.fixture
+def register(client):
+    # Registers a new player; returns (user_id, headers with their token)
+    def register():
+        n = next(_names)
+        body = client.post('/api/register', json={
+            'username': f'player{n}', 'email': f'player{n}@example.com', 'password': 'secret1'}).get_json()
+        return body['user']['id'], {'Authorization': f'Bearer {body["token"]}'}
+    return register
+
+
+@pytest.fixture
+def operator():
+    return {'Authorization': f'Bearer {os.environ["OPERATOR_KEY"]}'}
+
+
+@functools.lru_cache(maxsize=None)
+def _solution(data_structure, level_id):
+    level = catalog.level(data_structure, level_id) or generated_pool.level(data_structure, level_id)
+    return tuple(solve(data_structure, level))
+
+
+@pytest.fixture
+def play():
+    # A progress body whose operation_log wins the level after the detour
+    # operations, or stops one move short of winning with won=False. The
+    # server scores it from the replay.
+    def play(data_structure, level_id, won=True, time_taken=10, detour=(), **fields):
+        log = list(detour) + list(_solution(data_structure, level_id))
+        return dict({'data_structure': data_structure, 'level_id': level_id, 'time_taken': time_taken,
+                     'operation_log': log if won else log[:-1]}, **fields)
+    return play
@@ -0,0 +1,73 @@
+import math
+from random import Random
+from types import SimpleNamespace
+
+import app
+import pytest
+from analytics import MAX_ATTEMPTS, LevelStats
+from database import ConnectionPool
+from level_catalog import catalog
+
+
+def nearest_rank(values, q):
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * q), 1) - 1] if values else None
+
+
+@pytest.fixture
+def progress(tmp_path):
+    # A one-shard router over its own file, filled with random progress
+    pool = ConnectionPool(str(tmp_path / 'analytics.db'))
+    with pool.transaction() as conn:
+        app._create_schema(conn.cursor())
+    rng = Random(3)
+    rows = []
+    for user_id in range(1, 301):
+        for level_id in range(1, rng.randint(1, 4) + 1):
+            completed = rng.random() < 0.7
+            rows.append((user_id, 'stack', level_id, completed, rng.randint(0, 20),
+                         rng.randint(0, 9) if completed else 0, rng.randint(0, 200) if completed else 0))
+    rows.append((1, 'stack', 1000, True, 5, 5, 5))
+    rows.append((2, 'heap', 1, True, 5, 5, 5))
+    rows.append((1000, 'stack', 2, True, MAX_ATTEMPTS + 50, 1, 1))
+    with pool.transaction() as conn:
+        conn.executemany('INSERT INTO game_progress (user_id, data_structure, level_id, completed, attempts, '
+                         'best_moves, best_time) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    router = SimpleNamespace(shards=[SimpleNamespace(pool=pool)], directory=pool)
+    yield router, [row for row in rows if row[1] == 'stack' and row[2] < 1000]
+    pool.close_all()
+
+
+def test_level_stats_match_a_python_scan(progress):
+    router, rows = progress
+    # A small chunk size so the scan takes several ranges
+    computed = {(row[0], row[1]): row for row in LevelStats(router=router, chunk_size=97).compute()}
+    stack_levels = sorted(level['id'] for level in catalog.levels['stack'])
+    for level_id in (1, 2, 3):
+        level = [row for row in rows if row[2] == level_id]
+        attempts = [min(row[4], MAX_ATTEMPTS - 1) for row in level]
+        completed = [row for row in level if row[3]]
+        moves = [row[5] for row in completed if row[5] > 0]
+        times = [row[6] for row in completed if row[6] > 0]
+        (_, _, players, completions, rate, mean, a50, a90, a99, _, m50, m90, _, t50, t90, t99,
+         drop_off) = computed[('stack', level_id)]
+        assert (players, completions) == (len(level), len(completed))
+        assert rate == pytest.approx(len(completed) / len(level))
+        assert mean == pytest.approx(sum(attempts) / len(level))
+        assert (a50, a90, a99) == tuple(nearest_rank(attempts, q) for q in (0.5, 0.9, 0.99))
+        assert (m50, m90) == tuple(nearest_rank(moves, q) for q in (0.5, 0.9))
+        assert (t50, t90, t99) == tuple(nearest_rank(times, q) for q in (0.5, 0.9, 0.99))
+        following = stack_levels[stack_levels.index(level_id) + 1]
+        reached = sum(1 for row in rows if row[2] == following)
+        assert drop_off == pytest.approx(max(0.0, 1 - reached / len(level)))
+    # Levels nobody played have no percentiles
+    assert computed[('queue', 1)][2:4] == (0, 0) and computed[('queue', 1)][6] is None
+
+
+def test_stats_route(client):
+    from analytics import level_stats
+    level_stats.refresh()
+    body = client.get('/api/levels/stack/stats').get_json()
+    assert [level['level_id'] for level in body['levels']] == sorted(level['id'] for level in catalog.levels['stack'])
+    assert body['refreshed_at'] is not None
+    assert client.get('/api/levels/heap/stats').status_code == 404
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+from asgi import AsyncBridge
+from app import app as flask_app
+
+
+def call(bridge, method, path, body=b'', headers=(), query=b''):
+    # Runs one request through the bridge; returns (status, headers, body)
+    async def run():
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        disconnected = asyncio.Event()
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'http_version': '1.1',
+                 'headers': [(name.encode(), value.encode()) for name, value in headers]}
+        await bridge(scope, receive, send)
+        disconnected.set()
+        start = sent[0]
+        return (start['status'], dict((k.decode().lower(), v.decode()) for k, v in start['headers']),
+                b''.join(message.get('body', b'') for message in sent[1:]))
+
+    return asyncio.run(run())
+
+
+def test_requests_behave_as_under_wsgi(client):
+    bridge = AsyncBridge(flask_app, threads=2)
+    status, headers, body = call(bridge, 'GET', '/api/health')
+    assert status == 200 and json.loads(body)['status'] == 'healthy'
+    status, _, body = call(bridge, 'POST', '/api/register', json.dumps({
+        'username': 'asgi-user', 'email': 'asgi@example.com', 'password': 'secret1'}).encode(),
+        [('content-type', 'application/json')])
+    assert status == 201
+    token = json.loads(body)['token']
+    status, _, body = call(bridge, 'GET', '/api/session', headers=[('authorization', f'Bearer {token}')])
+    assert status == 200 and json.loads(body)['user']['username'] == 'asgi-user'
+    status, _, body = call(bridge, 'GET', '/api/leaderboard', query=b'limit=3')
+    assert status == 200 and json.loads(body) == client.get('/api/leaderboard?limit=3').get_json()
+
+
+def test_large_bodies_are_streamed(client, operator, register):
+    for _ in range(3):
+        register()
+    bridge = AsyncBridge(flask_app, threads=2, buffer_bytes=64)
+    status, _, body = call(bridge, 'GET', '/api/export/stats',
+                           headers=[('authorization', operator['Authorization'])])
+    assert status == 200
+    assert body == client.get('/api/export/stats', headers=operator).get_data()
+    assert len(body) > 64
+
+
+def test_limits():
+    bridge = AsyncBridge(flask_app, threads=1, max_queued=0, max_body=10)
+    status, _, body = call(bridge, 'POST', '/api/register', b'x' * 11)
+    assert status == 413 and json.loads(body) == {'error': 'Request body too large'}
+    bridge._admitted = 1
+    status, headers, _ = call(bridge, 'GET', '/api/health')
+    assert status == 503 and headers['retry-after'] == '1'
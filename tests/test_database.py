@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+
+import pytest
+from database import ConnectionPool, PeriodicClaim, is_busy_error, retry_on_busy
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), max_idle=2)
+    with pool.transaction() as conn:
+        conn.execute('CREATE TABLE counter (n INTEGER)')
+        conn.execute('INSERT INTO counter VALUES (0)')
+    yield pool
+    pool.close_all()
+
+
+def test_connections_are_reused_in_wal_mode(pool):
+    with pool.connection() as conn:
+        first = conn
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    with pool.connection() as conn:
+        assert conn is first
+    # Only max_idle connections are kept
+    with pool.connection(), pool.connection(), pool.connection():
+        pass
+    assert len(pool._idle) == 2
+
+
+def test_failed_transactions_roll_back(pool):
+    with pytest.raises(ZeroDivisionError):
+        with pool.transaction() as conn:
+            conn.execute('UPDATE counter SET n = 5')
+            1 / 0
+    with pool.connection() as conn:
+        assert conn.execute('SELECT n FROM counter').fetchone()[0] == 0
+        assert not conn.in_transaction
+
+
+def test_concurrent_writers_lose_no_updates(pool):
+    def work():
+        for _ in range(50):
+            with pool.transaction() as conn:
+                conn.execute('UPDATE counter SET n = n + 1')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with pool.connection() as conn:
+        assert conn.execute('SELECT n FROM counter').fetchone()[0] == 200
+
+
+def test_readers_are_not_blocked_by_a_writer(pool):
+    with pool.transaction() as writer:
+        writer.execute('UPDATE counter SET n = 9')
+        with pool.connection() as reader:
+            assert reader.execute('SELECT n FROM counter').fetchone()[0] == 0
+
+
+def test_retry_on_busy_retries_only_lock_errors():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise sqlite3.OperationalError('database is locked')
+        return 'ok'
+
+    assert retry_on_busy(flaky, base_delay=0) == 'ok' and len(calls) == 3
+    assert is_busy_error(sqlite3.OperationalError('database table is locked'))
+    assert not is_busy_error(sqlite3.OperationalError('no such table: nope'))
+
+    def locked():
+        calls.append(1)
+        raise sqlite3.OperationalError('database is locked')
+
+    del calls[:]
+    with pytest.raises(sqlite3.OperationalError):
+        retry_on_busy(locked, retries=1, base_delay=0)
+    assert len(calls) == 2
+
+
+def test_periodic_jobs_run_in_one_worker_per_interval(pool):
+    with pool.transaction() as conn:
+        conn.execute('CREATE TABLE job_claim (id INTEGER PRIMARY KEY, claimed_at REAL NOT NULL)')
+        conn.execute('INSERT INTO job_claim VALUES (1, 0)')
+    release = threading.Event()
+    runs = []
+
+    def job():
+        runs.append(threading.current_thread().name)
+        release.wait(10)
+
+    first, second = PeriodicClaim('job_claim', 'job'), PeriodicClaim('job_claim', 'job')
+    assert first.start_if_due(pool, 3600, job)
+    # Not while it runs, nor in another worker within the interval
+    assert not first.start_if_due(pool, 3600, job)
+    assert not second.start_if_due(pool, 3600, job)
+    assert not second.start_if_due(pool, 0, job)
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name == 'job':
+            thread.join(10)
+    assert not first.running
+    assert runs == ['job']
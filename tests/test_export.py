@@ -0,0 +1,57 @@
+import gzip
+import json
+
+import pytest
+from export import EXPORTS, ndjson, parse_since
+
+
+def lines(response):
+    body = response.get_data()
+    if response.headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return [json.loads(line) for line in body.decode().splitlines()]
+
+
+@pytest.fixture
+def players(client, register, play):
+    users = []
+    for n in range(3):
+        user_id, headers = register()
+        for level_id in (1, 2):
+            client.post('/api/progress', headers=headers, json=play('queue', level_id, time_taken=5 + n))
+        users.append(user_id)
+    return users
+
+
+def test_export_streams_in_key_order_and_resumes(client, operator, players):
+    rows = lines(client.get('/api/export/progress', headers=operator))
+    keys = [(row['user_id'], row['data_structure'], row['level_id']) for row in rows]
+    assert keys == sorted(keys)
+    assert {(user_id, 'queue', level_id) for user_id in players for level_id in (1, 2)} <= set(keys)
+
+    first = lines(client.get('/api/export/progress?limit=2', headers=operator))
+    last = first[-1]
+    rest = lines(client.get(f'/api/export/progress?after={last["user_id"]},{last["data_structure"]},'
+                            f'{last["level_id"]}', headers=operator))
+    assert first + rest == rows
+
+
+def test_export_gzip_and_since(client, operator, players):
+    plain = lines(client.get('/api/export/stats', headers=operator))
+    compressed = client.get('/api/export/stats', headers=dict(operator, **{'Accept-Encoding': 'gzip'}))
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert lines(compressed) == plain
+    assert lines(client.get('/api/export/stats?since=2999-01-01T00:00:00Z', headers=operator)) == []
+    assert client.get('/api/export/stats?since=yesterday', headers=operator).status_code == 400
+    assert client.get('/api/export/progress?after=1', headers=operator).status_code == 400
+    assert client.get('/api/export/stats?limit=0', headers=operator).status_code == 400
+
+
+def test_parse_helpers_and_encoder():
+    assert parse_since('2024-05-01T02:00:00+02:00') == '2024-05-01 00:00:00'
+    assert EXPORTS['progress'].parse_after('4,stack,2') == (4, 'stack', 2)
+    rows = [(n, n * 2) for n in range(5)]
+    chunks = list(ndjson(('a', 'b'), rows, lines_per_write=2))
+    assert len(chunks) == 3
+    assert [json.loads(line) for line in b''.join(chunks).splitlines()] == [{'a': n, 'b': n * 2} for n in range(5)]
+    assert gzip.decompress(b''.join(ndjson(('a', 'b'), rows, compress=True))) == b''.join(chunks)
@@ -0,0 +1,51 @@
+from random import Random
+
+from generator import (DIFFICULTIES, FIRST_ID, GENERATORS, canonical, generate_batch, generated_pool, grade,
+                       max_moves_for)
+from level_catalog import catalog
+from solver import solve
+
+
+def test_pool_levels_are_graded_unique_and_solvable():
+    rng = Random(5)
+    for ds, levels in generated_pool.levels.items():
+        ids = [level['id'] for level in levels]
+        assert ids == list(range(FIRST_ID, FIRST_ID + len(levels)))
+        keys = {canonical(ds, level['initial'], level['target'], level['operations']) for level in levels}
+        assert len(keys) == len(levels)
+        handwritten = {canonical(ds, level['initial'], level['target'], level['operations'])
+                       for level in catalog.levels[ds]}
+        assert not keys & handwritten
+        for level in levels:
+            assert level['difficulty'] == grade(level['optimalMoves'])
+            assert level['maxMoves'] == max_moves_for(level['optimalMoves'])
+        for level in rng.sample(levels, min(10, len(levels))):
+            assert len(solve(ds, level)) == level['optimalMoves']
+
+
+def test_canonical_ignores_the_values_used():
+    assert canonical('stack', ['A', 'B'], ['A'], ('pop',)) == canonical('stack', ['C', 'D'], ['C'], ('pop',))
+    assert canonical('stack', ['A', 'B'], ['A'], ('pop',)) != canonical('stack', ['A', 'B'], ['B'], ('pop',))
+    assert canonical('tree', [50, 20], [50, 20, 70], ('insert_tree',)) == \
+        canonical('tree', [5, 2], [5, 2, 9], ('insert_tree',))
+
+
+def test_batches_are_deterministic_and_deduplicated():
+    for ds in GENERATORS:
+        batch = generate_batch(ds, 7, 40)
+        assert batch == generate_batch(ds, 7, 40)
+        assert len({key for key, _ in batch}) == len(batch)
+        for _, level in batch:
+            assert len(solve(ds, level)) == level['optimalMoves']
+
+
+def test_generated_route(client):
+    levels = client.get('/api/levels/queue/generated?difficulty=hard&count=5').get_json()
+    assert len(levels) == 5
+    assert {level['difficulty'] for level in levels} == {'Hard'}
+    assert len({level['id'] for level in levels}) == 5
+    assert len(client.get('/api/levels/queue/generated').get_json()) == 1
+    assert client.get('/api/levels/queue/generated?count=51').status_code == 400
+    assert client.get('/api/levels/queue/generated?difficulty=impossible').status_code == 400
+    assert client.get('/api/levels/heap/generated').status_code == 404
+    assert set(DIFFICULTIES) == {level['difficulty'] for level in generated_pool.levels['queue']}
@@ -0,0 +1,109 @@
+import time
+
+import history
+from shards import router
+
+
+def record(user_id, day, attempts):
+    with router.for_user(user_id).pool.transaction() as conn:
+        history.record(conn.cursor(), [(user_id,) + attempt for attempt in attempts], day)
+
+
+def query(user_id, sql):
+    with router.for_user(user_id).pool.connection() as conn:
+        return [tuple(row) for row in conn.execute(sql, (user_id,))]
+
+
+def test_weeks_start_on_monday():
+    # 1970-01-05 (day 4) was a Monday
+    assert history.week_of(3) == 0
+    assert history.week_of(4) == history.week_of(10) == 1
+    assert history.period('day', 10) == 10
+    assert history.period('week', 10) == 1
+
+
+def test_windowed_leaderboards(client, register, play):
+    first, first_headers = register()
+    second, second_headers = register()
+    old = history.today() - 8
+    record(first, old, [('stack', 1, True, 500, 10, 3)])
+    # One move of 3 on stack level 2: 70 points, plus 2 per second under 30
+    for user_id, headers, time_taken in ((first, first_headers, 30), (second, second_headers, 15)):
+        response = client.post('/api/progress', headers=headers, json=play('stack', 2, time_taken=time_taken))
+        assert response.status_code == 200
+    # The two players' rows of today, ignoring other tests' players
+    day = {entry['username']: entry['total_score']
+             for entry in client.get('/api/leaderboard?window=day&limit=100').get_json()}
+    week = {entry['username']: entry['total_score']
+            for entry in client.get('/api/leaderboard?window=week&limit=100').get_json()}
+    [first_name] = [row[0] for row in query(first, 'SELECT username FROM users WHERE id = ?')]
+    [second_name] = [row[0] for row in query(second, 'SELECT username FROM users WHERE id = ?')]
+    assert (day[first_name], day[second_name]) == (70, 100)
+    assert (week[first_name], week[second_name]) == (70, 100)
+    assert client.get('/api/leaderboard?window=year').status_code == 400
+
+
+def test_compaction_folds_old_days_into_weeks(register):
+    user_id, _ = register()
+    today = history.today()
+    old = today - 40
+    record(user_id, old, [
+        ('stack', 1, False, 0, 50, 0),
+        ('stack', 1, True, 80, 30, 6),
+        ('stack', 1, True, 95, 40, 4),
+        ('queue', 1, True, 70, 25, 5),
+    ])
+    record(user_id, old + 1, [('stack', 1, True, 60, 20, 7)])
+    record(user_id, today, [('stack', 1, True, 90, 10, 3)])
+
+    folded = history.Compactor(chunk=2).compact()
+    assert folded >= 5
+    assert query(user_id, 'SELECT day FROM attempts WHERE user_id = ?') == [(today,)]
+    weeks = query(user_id, '''
+        SELECT data_structure, week, attempts, completions, total_score, total_time,
+               best_score, best_time, best_moves
+        FROM attempt_weeks WHERE user_id = ? ORDER BY data_structure, week''')
+    stack = [row[1:] for row in weeks if row[0] == 'stack']
+    if history.week_of(old) == history.week_of(old + 1):
+        assert stack == [(history.week_of(old), 4, 3, 235, 90, 95, 20, 4)]
+    else:
+        assert stack == [(history.week_of(old), 3, 2, 175, 70, 95, 30, 4),
+                         (history.week_of(old + 1), 1, 1, 60, 20, 60, 20, 7)]
+    assert [row[1:] for row in weeks if row[0] == 'queue'] == [(history.week_of(old), 1, 1, 70, 25, 70, 25, 5)]
+    # Rollup rows past the retention are gone, today's stay
+    assert query(user_id, 'SELECT period FROM rollup_day WHERE user_id = ?') == [(today,)]
+    assert history.Compactor().compact() == 0
+
+
+def test_compaction_expires_old_weeks(register):
+    user_id, _ = register()
+    today = history.today()
+    for weeks_ago in (60, 10, 6):
+        record(user_id, today - 7 * weeks_ago, [('stack', 1, True, 80, 30, 6)])
+
+    history.Compactor(retention_weeks=8).compact()
+    kept = query(user_id, 'SELECT week FROM attempt_weeks WHERE user_id = ?')
+    assert kept == [(history.week_of(today - 42),)]
+    history.Compactor(retention_weeks=0).compact()
+    assert query(user_id, 'SELECT week FROM attempt_weeks WHERE user_id = ?') == kept
+
+
+def test_compaction_is_checked_after_the_write(client, register, play, monkeypatch):
+    user_id, headers = register()
+    seen = []
+    monkeypatch.setattr(history.compactor, 'compact_if_due',
+                        lambda: seen.append(query(user_id, 'SELECT attempts FROM game_progress WHERE user_id = ?')))
+    client.post('/api/progress', headers=headers, json=play('stack', 1))
+    client.post('/api/progress/batch', headers=headers, json=[play('stack', 1)])
+    assert seen == [[(1,)], [(2,)]]
+
+
+def test_compaction_is_claimed_by_one_worker_per_interval():
+    first = history.Compactor(interval=3600)
+    assert first.compact_if_due()
+    assert not first.compact_if_due()
+    assert not history.Compactor(interval=3600).compact_if_due()
+    deadline = time.monotonic() + 10
+    while first.periodic.running and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not first.periodic.running
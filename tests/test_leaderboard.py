@@ -0,0 +1,131 @@
+import sqlite3
+
+from leaderboard import GLOBAL, SCHEMA, Leaderboard, merge_top
+
+
+def board_db(scores):
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)')
+    conn.execute('''CREATE TABLE user_stats (user_id INTEGER UNIQUE, total_score INTEGER,
+                    total_time INTEGER DEFAULT 0, levels_completed INTEGER DEFAULT 0)''')
+    conn.execute('''CREATE TABLE game_progress (user_id INTEGER, data_structure TEXT, level_id INTEGER,
+                    completed BOOLEAN, best_score INTEGER, best_time INTEGER)''')
+    for statement in SCHEMA:
+        conn.execute(statement)
+    for user_id, score in enumerate(scores, 1):
+        conn.execute('INSERT INTO users VALUES (?, ?)', (user_id, f'u{user_id}'))
+        conn.execute('INSERT INTO user_stats (user_id, total_score) VALUES (?, ?)', (user_id, score))
+        conn.execute('INSERT INTO game_progress VALUES (?, ?, 1, 1, ?, 5)', (user_id, 'stack', score))
+    conn.commit()
+    return conn
+
+
+def set_score(conn, board, user_id, score):
+    # A progress write as the routes do it; board None is another worker
+    conn.execute('UPDATE user_stats SET total_score = ? WHERE user_id = ?', (score, user_id))
+    conn.execute('UPDATE game_progress SET best_score = ? WHERE user_id = ?', (score, user_id))
+    collected = (board or Leaderboard()).collect(conn.cursor(), [(user_id, 'stack')])
+    conn.commit()
+    if board is not None:
+        board.apply(collected)
+
+
+def names(board, conn, name=GLOBAL, limit=10):
+    return [entry['username'] for entry in board.top(conn, name, limit)]
+
+
+def rebuilds(conn):
+    statements = []
+    conn.set_trace_callback(lambda sql: statements.append(sql) if 'ORDER BY total_score DESC' in sql
+                            or 'ORDER BY us.total_score DESC' in sql else None)
+    return statements
+
+
+def test_local_writes_apply_without_rebuilding():
+    conn = board_db([10, 20, 30])
+    board = Leaderboard(size=3, refresh_interval=3600)
+    board.load(conn)
+    statements = rebuilds(conn)
+    set_score(conn, board, 1, 40)
+    assert names(board, conn) == ['u1', 'u3', 'u2']
+    assert names(board, conn, 'stack') == ['u1', 'u3', 'u2']
+    assert statements == []
+
+
+def catch_ups(conn):
+    statements = []
+    conn.set_trace_callback(lambda sql: statements.append(sql) if 'FROM leaderboard_changes' in sql
+                            and sql.startswith('SELECT') else None)
+    return statements
+
+
+def test_foreign_write_catches_up_only_the_board_read():
+    conn = board_db([10, 20, 30])
+    board = Leaderboard(size=3, refresh_interval=0)
+    board.load(conn)
+    statements = catch_ups(conn)
+    set_score(conn, None, 1, 40)
+    assert names(board, conn, 'stack') == ['u1', 'u3', 'u2']
+    assert len(statements) == 1
+    assert names(board, conn, 'stack') == ['u1', 'u3', 'u2']
+    assert len(statements) == 1
+    assert names(board, conn) == ['u1', 'u3', 'u2']
+    assert len(statements) == 2
+    # An unknown board costs nothing
+    assert board.top(conn, 'heap') == []
+
+
+def test_foreign_writes_are_rebuilt_at_most_once_per_interval():
+    conn = board_db([10, 20, 30])
+    board = Leaderboard(size=3, refresh_interval=3600)
+    board.load(conn)
+    set_score(conn, None, 1, 40)
+    # Still the old board, until the interval passes
+    assert names(board, conn) == ['u3', 'u2', 'u1']
+    # A local write after the gap is applied all the same
+    set_score(conn, board, 2, 50)
+    assert names(board, conn) == ['u2', 'u3', 'u1']
+    board.refresh_interval = 0
+    assert names(board, conn) == ['u2', 'u1', 'u3']
+
+
+def test_foreign_writes_never_rebuild_a_board():
+    conn = board_db([10, 20, 30, 40])
+    board = Leaderboard(size=3, refresh_interval=0)
+    board.load(conn)
+    statements = rebuilds(conn)
+    set_score(conn, None, 1, 50)
+    set_score(conn, None, 2, 45)
+    assert names(board, conn) == ['u1', 'u2', 'u4']
+    assert names(board, conn, 'stack') == ['u1', 'u2', 'u4']
+    assert statements == []
+    # Only the last versions stay logged; a board further behind is rebuilt
+    writer = Leaderboard(change_retention=2)
+    for user_id, score in ((3, 60), (4, 70), (3, 80)):
+        conn.execute('UPDATE user_stats SET total_score = ? WHERE user_id = ?', (score, user_id))
+        writer.collect(conn.cursor(), [(user_id, None)])
+        conn.commit()
+    assert conn.execute('SELECT COUNT(*) FROM leaderboard_changes').fetchone()[0] == 2
+    board.change_retention = 2
+    assert names(board, conn) == ['u3', 'u4', 'u1']
+    assert len(statements) == 1
+
+
+def test_score_drop_on_full_board_rebuilds_at_once():
+    conn = board_db([10, 20, 30, 40])
+    board = Leaderboard(size=3, refresh_interval=3600)
+    board.load(conn)
+    assert names(board, conn) == ['u4', 'u3', 'u2']
+    set_score(conn, board, 4, 0)
+    # u1 was below the cut; only a rebuild can find it
+    assert names(board, conn) == ['u3', 'u2', 'u1']
+    assert names(board, conn, 'stack') == ['u3', 'u2', 'u1']
+
+
+def test_merge_top_interleaves_shards():
+    first = board_db([10, 30])
+    second = board_db([20, 40])
+    boards = [Leaderboard(size=2), Leaderboard(size=2)]
+    keyed = [board.top_keyed(conn, GLOBAL, 2) for board, conn in zip(boards, (first, second))]
+    assert [entry['total_score'] for entry in merge_top(keyed, 3)] == [40, 30, 20]
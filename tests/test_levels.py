@@ -0,0 +1,26 @@
+from level_catalog import catalog
+
+
+def test_catalog_revalidates_with_etag(client):
+    response = client.get('/api/levels/catalog')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.get_json()
+    revalidated = client.get('/api/levels/catalog', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+    assert client.get('/api/levels/catalog', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_versioned_catalog_is_immutable(client):
+    response = client.get(f'/api/levels/catalog/{catalog.version}')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert response.get_data() == client.get('/api/levels/catalog').get_data()
+    assert client.get('/api/levels/catalog/0000').status_code == 404
+
+
+def test_levels_of_one_structure(client):
+    response = client.get('/api/levels/stack')
+    assert response.status_code == 200
+    assert 'ETag' in response.headers
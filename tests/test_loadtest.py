@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import loadtest  # noqa: E402
+
+
+def row(rps, p95, requests=100):
+    return {'requests': requests, 'errors': 0, 'statuses': {}, 'throughput_rps': rps,
+            'p50_ms': 1.0, 'p95_ms': p95, 'p99_ms': p95}
+
+
+def test_percentile():
+    assert loadtest.percentile([], 0.5) == 0.0
+    values = list(range(100))
+    assert loadtest.percentile(values, 0.50) == 50
+    assert loadtest.percentile(values, 0.99) == 99
+    assert loadtest.percentile(values, 1.0) == 99
+
+
+def test_summarize_counts_errors():
+    summary = loadtest.summarize([0.001, 0.002, 0.003, 0.004], {200: 2, 503: 1, 0: 1}, 2.0)
+    assert summary['requests'] == 4
+    assert summary['errors'] == 2
+    assert summary['statuses'] == {'0': 1, '200': 2, '503': 1}
+    assert summary['throughput_rps'] == 2.0
+    assert summary['p50_ms'] == 3.0
+
+
+def test_compare_flags_regressions(tmp_path):
+    baseline = {
+        'meta': {'revision': 'abc', 'started_at': '2026-01-01T00:00:00'},
+        'endpoints': {'leaderboard': row(100, 10), 'login': row(100, 10), 'signup': row(100, 10, requests=0)},
+        'total': row(300, 10),
+    }
+    path = tmp_path / 'baseline.json'
+    path.write_text(json.dumps(baseline))
+    result = {
+        # Throughput down 20%, p95 up 20%, within tolerance, no baseline rows
+        'endpoints': {'leaderboard': row(80, 10), 'login': row(100, 12), 'progress': row(100, 50),
+                      'signup': row(1, 100)},
+        'total': row(295, 10.5),
+    }
+    assert loadtest.compare(result, str(path), 0.1) == ['leaderboard', 'login']
+    assert loadtest.compare(result, str(path), 0.25) == []
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+
+import metrics
+
+
+def sample(text, name, **labels):
+    # Value of one sample line, or 0 when the series does not exist yet
+    for line in text.splitlines():
+        match = re.match(rf'{name}{{(.*)}} (\S+)$', line)
+        if match and all(f'{key}="{value}"' in match.group(1) for key, value in labels.items()):
+            return float(match.group(2))
+    return 0.0
+
+
+def test_requests_and_statements_are_counted(client, operator):
+    before = client.get('/api/metrics', headers=operator).get_data(as_text=True)
+    for _ in range(3):
+        assert client.get('/api/health').status_code == 200
+    after = client.get('/api/metrics', headers=operator).get_data(as_text=True)
+
+    def delta(name, **labels):
+        return sample(after, name, **labels) - sample(before, name, **labels)
+
+    assert delta('http_requests_total', route='/api/health', status='200') == 3
+    assert delta('http_request_duration_seconds_count', route='/api/health') == 3
+    assert '# TYPE sqlite_statement_duration_seconds histogram' in after
+
+
+def totals(name):
+    # {labels: value} of one metric in this worker; a histogram's value is
+    # its count
+    samples = metrics.registry.snapshot()[name]
+    return {tuple(key): sum(value[:-1]) if isinstance(value, list) else value for key, value in samples}
+
+
+def test_statements_are_timed_and_rows_counted():
+    conn = sqlite3.connect(':memory:', factory=metrics.TimedConnection)
+    conn.execute('CREATE TABLE scores (n INTEGER)')
+    timed, rows = totals('sqlite_statement_duration_seconds'), totals('sqlite_rows_total')
+    conn.executemany('INSERT INTO scores VALUES (?)', [(n,) for n in range(5)])
+    assert len(conn.execute('SELECT n FROM scores').fetchall()) == 5
+    conn.commit()
+
+    def delta(before, after, name):
+        return after.get((name,), 0) - before.get((name,), 0)
+
+    after = totals('sqlite_statement_duration_seconds')
+    assert [delta(timed, after, name) for name in ('insert scores', 'select scores', 'commit')] == [1, 1, 1]
+    after = totals('sqlite_rows_total')
+    assert [delta(rows, after, name) for name in ('insert scores', 'select scores')] == [5, 5]
+
+
+def test_slow_statements_are_logged_with_their_plan(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, 'SLOW_QUERY_MS', 0)
+    monkeypatch.setattr(metrics, '_slow_logged', {})
+    conn = sqlite3.connect(':memory:', factory=metrics.TimedConnection)
+    conn.execute('CREATE TABLE slow (n INTEGER PRIMARY KEY)')
+    with caplog.at_level(logging.WARNING, logger='metrics.slow_query'):
+        for _ in range(2):
+            conn.execute('SELECT n FROM slow WHERE n = ?', (1,)).fetchall()
+    logged = [r.getMessage() for r in caplog.records if 'FROM slow WHERE' in r.getMessage()]
+    # Once per statement per SLOW_QUERY_LOG_INTERVAL
+    assert len(logged) == 1
+    assert 'plan: SEARCH slow USING INTEGER PRIMARY KEY' in logged[0]
+
+
+def test_worker_snapshots_are_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(metrics, '_snapshot_paths', {})
+    route = ['GET', '/api/merged', '200']
+    other = {'http_requests_total': [[route, 4]], 'unknown_metric': [[[], 1]]}
+    # Another worker, and an earlier process that had this one's pid
+    (tmp_path / 'metrics-1-1.json').write_text(json.dumps(other))
+    (tmp_path / f'metrics-{os.getpid()}-1.json').write_text(json.dumps(other))
+    with metrics.registry.lock:
+        metrics.http_requests.inc(tuple(route), 2)
+    try:
+        text = metrics.exposition()
+        assert sample(text, 'http_requests_total', route='/api/merged') == 10
+        # Flushing again replaces this process's own file only
+        metrics.flush(force=True)
+        assert sample(metrics.exposition(), 'http_requests_total', route='/api/merged') == 10
+        assert len(os.listdir(tmp_path)) == 3
+    finally:
+        with metrics.registry.lock:
+            del metrics.http_requests.values[tuple(route)]
@@ -0,0 +1,45 @@
+import sqlite3
+
+import app
+import migrations
+
+
+def fresh_schema():
+    conn = sqlite3.connect(':memory:')
+    app._create_schema(conn.cursor())
+    return conn
+
+
+def test_migrate_applies_each_step_once():
+    conn = fresh_schema()
+    cursor = conn.cursor()
+    assert migrations.current_version(cursor) == migrations.LATEST
+    # init_db() ran them all; a second run has nothing left to do
+    assert migrations.migrate(cursor) == migrations.LATEST
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert set(migrations.index_names()) <= indexes
+
+
+def test_migrate_stops_at_target():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE user_stats (user_id INTEGER, total_score INTEGER)')
+    cursor.execute('CREATE TABLE game_progress (user_id INTEGER, data_structure TEXT, best_score INTEGER, '
+                   'completed BOOLEAN, best_time INTEGER)')
+    assert migrations.migrate(cursor, target=1) == 1
+    assert migrations.current_version(cursor) == 1
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert indexes == {'idx_user_stats_score_desc', 'idx_game_progress_ds_user'}
+
+
+def test_leaderboard_queries_walk_indexes():
+    conn = fresh_schema()
+
+    def plan(sql, *params):
+        return ' '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params))
+
+    top = plan('SELECT user_id FROM user_stats ORDER BY total_score DESC, user_id LIMIT 10')
+    assert 'idx_user_stats_score_desc' in top and 'TEMP B-TREE' not in top
+    board = plan('SELECT user_id, SUM(best_score) FROM game_progress WHERE data_structure = ? GROUP BY user_id',
+                 'stack')
+    assert 'COVERING INDEX idx_game_progress_ds_user' in board and 'TEMP B-TREE' not in board
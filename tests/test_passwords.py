@@ -0,0 +1,49 @@
+import hashlib
+
+import passwords
+import pytest
+from passwords import PasswordHasher, PasswordQueueFull, check, derive
+from shards import router
+
+
+def test_hashes_are_salted_and_verify():
+    first, second = derive('secret1', n=16), derive('secret1', n=16)
+    assert first != second and first.startswith('scrypt$16$8$1$')
+    assert check('secret1', first)[0]
+    assert not check('secret2', first)[0]
+
+
+def test_outdated_hashes_are_upgraded_on_match():
+    legacy = hashlib.sha256(b'secret1').hexdigest()
+    matches, upgraded = check('secret1', legacy)
+    assert matches and upgraded.startswith(f'scrypt${passwords.PASSWORD_SCRYPT_N}$')
+    assert check('wrong', legacy) == (False, None)
+    # Other scrypt parameters than the configured ones are rehashed too
+    matches, upgraded = check('secret1', derive('secret1', n=passwords.PASSWORD_SCRYPT_N * 2))
+    assert matches and upgraded is not None
+    assert check('secret1', derive('secret1')) == (True, None)
+
+
+def test_full_queue_is_refused():
+    hasher = PasswordHasher(processes=1, max_queued=0)
+    assert hasher._slots.acquire(blocking=False)
+    with pytest.raises(PasswordQueueFull):
+        hasher.hash('secret1')
+    hasher._slots.release()
+
+
+def test_login_upgrades_a_legacy_hash(client):
+    with router.directory.transaction() as conn:
+        user_id = conn.execute('INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                               ('legacy', 'legacy@example.com', hashlib.sha256(b'secret1').hexdigest())).lastrowid
+    with router.for_user(user_id).pool.transaction() as conn:
+        conn.execute('INSERT INTO user_stats (user_id) VALUES (?)', (user_id,))
+
+    assert client.post('/api/login', json={'username': 'legacy', 'password': 'nope123'}).status_code == 401
+    response = client.post('/api/login', json={'username': 'legacy', 'password': 'secret1'})
+    assert response.status_code == 200 and response.get_json()['token']
+    with router.directory.connection() as conn:
+        stored = conn.execute('SELECT password_hash FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+    assert stored.startswith('scrypt$')
+    assert client.post('/api/login', json={'username': 'legacy', 'password': 'secret1'}).status_code == 200
+    assert client.post('/api/login', json={'username': 'nobody', 'password': 'secret1'}).status_code == 401
@@ -0,0 +1,117 @@
+import progress
+from progress import MAX_BATCH_SIZE
+
+
+def attempts(play):
+    return [
+        play('stack', 11, won=False, time_taken=40),
+        play('stack', 11, time_taken=30),
+        # Two wasted moves, and a time of 0 that is "not recorded"
+        play('stack', 11, time_taken=0, detour=[['push', 'Z'], ['pop']]),
+        play('queue', 3, time_taken=25),
+    ]
+
+
+def read(client, headers):
+    body = client.get('/api/progress', headers=headers).get_json()
+    rows = [{key: row[key] for key in ('data_structure', 'level_id', 'completed', 'best_score', 'best_time',
+                                       'best_moves', 'attempts')} for row in body['all_progress']]
+    stats = {key: body['stats'][key] for key in ('total_score', 'total_time', 'levels_completed', 'total_attempts')}
+    return stats, rows, body['data_structure_progress']
+
+
+def test_upsert_keeps_the_best_results(client, register, play):
+    _, headers = register()
+    scores = []
+    for attempt in attempts(play):
+        response = client.post('/api/progress', headers=headers, json=attempt)
+        assert response.status_code == 200
+        scores.append(response.get_json()['score'])
+    # Replayed: 4 moves of 6 in 30 s, 6 moves in "0 s", 2 moves of 5 in 25 s
+    assert scores == [0, 70, 110, 90]
+    stats, rows, _ = read(client, headers)
+    assert rows == [
+        {'data_structure': 'queue', 'level_id': 3, 'completed': 1, 'best_score': 90, 'best_time': 25,
+         'best_moves': 2, 'attempts': 1},
+        # The first attempt's row keeps its moves (3, one short of a win)
+        # unless a later attempt needs fewer
+        {'data_structure': 'stack', 'level_id': 11, 'completed': 1, 'best_score': 110, 'best_time': 30,
+         'best_moves': 3, 'attempts': 3},
+    ]
+    assert stats == {'total_score': 270, 'total_time': 55, 'levels_completed': 3, 'total_attempts': 4}
+
+
+def test_client_scores_are_ignored(client, register, play):
+    _, headers = register()
+    claimed = play('stack', 11, won=False, completed=True, score=100000, moves=1)
+    body = client.post('/api/progress', headers=headers, json=claimed).get_json()
+    assert (body['completed'], body['score'], body['moves']) == (False, 0, 3)
+    assert read(client, headers)[0]['total_score'] == 0
+
+
+def test_attempts_need_an_operation_log(client, register, play, monkeypatch):
+    _, headers = register()
+    unlogged = {'data_structure': 'stack', 'level_id': 11, 'completed': True, 'score': 100000,
+                'time_taken': 5, 'moves': 4}
+    response = client.post('/api/progress', headers=headers, json=unlogged)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Operation log required'
+
+    # Opted out, for old clients: counted as a play and nothing more
+    monkeypatch.setattr(progress, 'REQUIRE_VERIFIED_PROGRESS', False)
+    body = client.post('/api/progress', headers=headers, json=unlogged).get_json()
+    assert (body['completed'], body['score'], body['moves']) == (False, 0, 0)
+    stats, rows, _ = read(client, headers)
+    assert stats == {'total_score': 0, 'total_time': 0, 'levels_completed': 0, 'total_attempts': 1}
+    assert (rows[0]['best_score'], rows[0]['completed']) == (0, 0)
+    assert client.get('/api/rank', headers=headers).get_json()['total_score'] == 0
+
+
+def test_batch_matches_single_writes(client, register, play):
+    _, single = register()
+    for attempt in attempts(play):
+        client.post('/api/progress', headers=single, json=attempt)
+    _, batched = register()
+    response = client.post('/api/progress/batch', headers=batched, json={'attempts': attempts(play)})
+    assert response.status_code == 200
+    assert response.get_json()['applied'] == len(attempts(play))
+    assert read(client, batched) == read(client, single)
+
+
+def test_batch_reports_bad_items_and_limits(client, register, play):
+    user_id, headers = register()
+    attempt = play('stack', 11)
+    response = client.post('/api/progress/batch', headers=headers,
+                           json=[attempt, {'data_structure': 'stack'}, 'nope'])
+    body = response.get_json()
+    assert (body['applied'], body['failed']) == (1, 2)
+    assert [result['status'] for result in body['results']] == ['ok', 'error', 'error']
+
+    assert client.post('/api/progress/batch', headers=headers, json={'attempts': []}).status_code == 400
+    too_many = {'attempts': [attempt] * (MAX_BATCH_SIZE + 1)}
+    assert client.post('/api/progress/batch', headers=headers, json=too_many).status_code == 413
+    other = dict(attempt, user_id=user_id + 1000)
+    assert client.post('/api/progress/batch', headers=headers, json=[other]).status_code == 403
+    assert client.post('/api/progress', headers=headers, json=other).status_code == 403
+    assert client.post('/api/progress', headers=headers, json={'level_id': 1}).status_code == 400
+
+
+def test_unknown_levels_are_rejected(client, register, play):
+    user_id, headers = register()
+    bad = [
+        dict(play('stack', 11), level_id={'id': 11}),
+        dict(play('stack', 11), data_structure=['stack']),
+        dict(play('stack', 11), level_id='11'),
+        dict(play('stack', 11), level_id=True),
+        dict(play('stack', 11), data_structure='bogus'),
+        dict(play('stack', 11), level_id=99999),
+        {'data_structure': 'zzz', 'level_id': 1, 'operation_log': []},
+    ]
+    for attempt in bad:
+        response = client.post('/api/progress', headers=headers, json=attempt)
+        assert response.status_code == 400, attempt
+        assert response.get_json()['error'].startswith('Unknown')
+
+    body = client.post('/api/progress/batch', headers=headers, json=bad + [play('stack', 11)]).get_json()
+    assert (body['applied'], body['failed']) == (1, len(bad))
+    assert read(client, headers)[0]['total_attempts'] == 1
@@ -0,0 +1,87 @@
+import sqlite3
+from random import Random
+
+from rank_index import FenwickTree, RankIndex
+
+
+def stats_db(scores):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE leaderboard_version (id INTEGER PRIMARY KEY, version INTEGER)')
+    conn.execute('INSERT INTO leaderboard_version VALUES (1, 7)')
+    conn.execute('CREATE TABLE user_stats (user_id INTEGER PRIMARY KEY, total_score INTEGER)')
+    conn.executemany('INSERT INTO user_stats (total_score) VALUES (?)', [(score,) for score in scores])
+    return conn
+
+
+def assert_matches(index, scores, probes):
+    for score in probes:
+        assert index.above(score) == sum(1 for s in scores if s > score)
+        assert index.below(score) == sum(1 for s in scores if s < score)
+        assert index.rank(score) == 1 + sum(1 for s in scores if s > score)
+
+
+def test_fenwick_prefix_sums():
+    rng = Random(1)
+    counts = [rng.randint(0, 5) for _ in range(100)]
+    tree = FenwickTree(counts)
+    for index in range(100):
+        assert tree.prefix_sum(index) == sum(counts[:index + 1])
+    tree.add(10, 3)
+    assert tree.prefix_sum(9) == sum(counts[:10])
+    assert tree.prefix_sum(10) == sum(counts[:11]) + 3
+    assert tree.prefix_sum(1000) == sum(counts) + 3
+
+
+def test_load_and_apply_match_a_scan():
+    # dense_scores=64 sends the higher scores to the overflow list
+    rng = Random(2)
+    scores = [rng.choice([0, rng.randint(0, 200)]) for _ in range(300)]
+    index = RankIndex(dense_scores=64)
+    index.load(stats_db(scores))
+    assert index.total == len(scores)
+    probes = [0, 1, 50, 63, 64, 65, 150, 200, 201]
+    assert_matches(index, scores, probes)
+
+    moves = []
+    for _ in range(200):
+        player = rng.randrange(len(scores))
+        new = scores[player] + rng.randint(1, 40)
+        moves.append((scores[player], new))
+        scores[player] = new
+    moves.append((None, 0))
+    scores.append(0)
+    index.apply(8, moves)
+    assert index.total == len(scores)
+    assert_matches(index, scores, probes + [max(scores)])
+    assert index.percentile(max(scores) + 1) == 100.0
+
+
+def test_huge_score_stays_bounded():
+    index = RankIndex()
+    index.load(stats_db([0, 10, 10 ** 12]))
+    assert len(index._counts) <= 2 ** 20
+    assert index.rank(10 ** 12) == 1
+    assert index.rank(10) == 2
+    assert index.percentile(10 ** 12) == 66.67
+    index.apply(8, [(10, 10 ** 15)])
+    assert len(index._counts) <= 2 ** 20
+    assert index.rank(10 ** 15) == 1
+    assert index.rank(10 ** 12) == 2
+
+
+def test_out_of_range_attempts_are_rejected(client, register, play):
+    _, headers = register()
+    attempt = play('stack', 1, time_taken=5)
+    for score in (10 ** 12, -1, 'many', 1.5, True):
+        response = client.post('/api/progress', headers=headers, json=dict(attempt, score=score))
+        assert response.status_code == 400, score
+    response = client.post('/api/progress/batch', headers=headers,
+                           json={'attempts': [dict(attempt, score=10), dict(attempt, moves=-3)]})
+    body = response.get_json()
+    assert (body['applied'], body['failed']) == (1, 1)
+    assert body['results'][1]['error'] == 'moves must be between 0 and 100000'
+
+    response = client.post('/api/progress', headers=headers, json=dict(attempt, time_taken=12.0))
+    assert response.status_code == 200
+    # One move of 3 in 5 s, then in 12 s: 120 + 106 points
+    assert client.get('/api/rank', headers=headers).get_json()['total_score'] == 226
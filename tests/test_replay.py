@@ -0,0 +1,72 @@
+from generator import generated_pool
+from level_catalog import catalog
+from replay import calculate_score, verify
+from solver import solve
+
+
+def test_optimal_solutions_verify_for_every_structure():
+    for ds in ('stack', 'queue', 'linkedlist', 'tree', 'graph'):
+        level = catalog.level(ds, 1)
+        log = solve(ds, level)
+        result = verify(ds, 1, log, time_taken=30)
+        assert result.valid and result.won, (ds, result.error)
+        assert result.moves == len(log)
+        assert result.score == calculate_score(True, level['maxMoves'], len(log), 30, 0)
+
+
+def test_compact_operations_and_hints():
+    full = verify('queue', 1, [{'operation': 'enqueue', 'value': 'A'}])
+    compact = verify('queue', 1, [['enqueue', 'A']])
+    assert full == compact
+    assert verify('queue', 1, [['enqueue', 'A']], hints=2).score < full.score
+
+
+def test_invalid_logs_are_rejected():
+    assert verify('queue', 1, [['pop']]).error == 'Operation not allowed in this level: pop'
+    assert verify('queue', 1, 'enqueue A').error == 'Operation log must be a list'
+    assert verify('queue', 1, [['enqueue', 'A'], ['enqueue', 'B']]).error == \
+        'Operations continue after the game ended'
+    assert verify('queue', 9999, []).error == 'Unknown level'
+    assert not verify('queue', 1, [['enqueue', 'B']]).won
+
+
+def test_generated_levels_verify():
+    level = generated_pool.level('stack', 1001)
+    log = solve('stack', level)
+    result = verify('stack', 1001, log)
+    assert result.valid and result.won and result.moves == level['optimalMoves']
+
+
+def test_verified_solution_for_a_generated_level(client, register):
+    _, headers = register()
+    level = generated_pool.level('tree', 1001)
+    response = client.post('/api/progress', headers=headers, json={
+        'data_structure': 'tree', 'level_id': 1001, 'time_taken': 12,
+        'completed': False, 'score': 0, 'operation_log': solve('tree', level)})
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert body['completed'] and body['moves'] == level['optimalMoves']
+    assert body['score'] == calculate_score(True, level['maxMoves'], level['optimalMoves'], 12, 0)
+
+    response = client.post('/api/progress', headers=headers, json={
+        'data_structure': 'tree', 'level_id': 1001, 'operation_log': [['insert_tree', 1], ['pop']]})
+    assert response.status_code == 422
+
+
+def test_verify_many_looks_each_level_up_once(monkeypatch):
+    import replay
+    lookups = []
+    compiled_level = replay.compiled_level
+    monkeypatch.setattr(replay, 'compiled_level', lambda ds, level_id: lookups.append((ds, level_id))
+                        or compiled_level(ds, level_id))
+    submissions = [
+        ('queue', 1, [['enqueue', 'A']], 10, 0),
+        ('queue', '1', [['enqueue', 'B']], 10, 0),
+        ('queue', 1, [['dequeue']], 10, 1),
+        ('stack', 1001, [['pop']], 5, 0),
+        ('queue', [1], [], 0, 0),
+    ]
+    results = replay.verify_many(submissions)
+    assert lookups == [('queue', 1), ('stack', 1001), ('queue', [1])]
+    assert results == [verify(*submission) for submission in submissions]
+    assert [result.error for result in results[3:]] == [None, 'Unknown level']
@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import reshard
+from shards import shard_index
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SEED = '''
+import app
+from level_catalog import catalog
+from solver import solve
+client = app.app.test_client()
+for n in range(12):
+    body = client.post('/api/register', json={
+        'username': f'reshard{n}', 'email': f'reshard{n}@example.com', 'password': 'secret1'}).get_json()
+    headers = {'Authorization': 'Bearer ' + body['token']}
+    for level_id in range(1, n % 4 + 2):
+        response = client.post('/api/progress', headers=headers, json={
+            'data_structure': 'stack', 'level_id': level_id, 'time_taken': n,
+            'operation_log': solve('stack', catalog.level('stack', level_id))})
+        assert response.status_code == 200, response.get_json()
+'''
+
+TOTALS = '''
+import json
+import app
+client = app.app.test_client()
+print(json.dumps([client.get('/api/leaderboard?limit=100').get_json(),
+                  client.get('/api/leaderboard?window=week&limit=100').get_json()]))
+'''
+
+
+def source_file(path, users=30):
+    reshard.build(path, [], 0, 1)
+    conn = sqlite3.connect(path)
+    for user_id in range(1, users + 1):
+        conn.execute('INSERT INTO user_stats (user_id, total_score, total_attempts) VALUES (?, ?, ?)',
+                     (user_id, user_id * 10, user_id))
+        conn.execute('INSERT INTO game_progress (user_id, data_structure, level_id, best_score, attempts) '
+                     'VALUES (?, ?, 1, ?, ?)', (user_id, 'stack', user_id * 10, user_id))
+        conn.execute('INSERT INTO attempts (day, user_id, data_structure, level_id, completed, score, '
+                     'time_taken, moves) VALUES (20000, ?, ?, 1, 1, ?, 5, 3)', (user_id, 'stack', user_id * 10))
+    conn.commit()
+    conn.close()
+
+
+def test_build_partitions_rows_and_keeps_checksums(tmp_path):
+    source = str(tmp_path / 'source.db')
+    source_file(source)
+    targets = [str(tmp_path / f'shard{n}.db') for n in range(3)]
+    for index, path in enumerate(targets):
+        reshard.build(path, [source], index, 3)
+
+    assert reshard.checksum(targets) == reshard.checksum([source]) == [30, 4650, 465, 30, 465]
+    for index, path in enumerate(targets):
+        conn = sqlite3.connect(path)
+        for table in ('user_stats', 'game_progress', 'attempts'):
+            user_ids = [row[0] for row in conn.execute(f'SELECT user_id FROM {table}')]
+            assert user_ids and all(shard_index(user_id, 3) == index for user_id in user_ids)
+        conn.close()
+
+
+def test_checksum_sees_a_lost_row(tmp_path):
+    source = str(tmp_path / 'source.db')
+    source_file(source)
+    copy = str(tmp_path / 'copy.db')
+    reshard.build(copy, [source], 0, 1)
+    conn = sqlite3.connect(copy)
+    conn.execute('DELETE FROM game_progress WHERE user_id = 7')
+    conn.commit()
+    conn.close()
+    assert reshard.checksum([copy]) != reshard.checksum([source])
+
+
+LOSE_A_ROW = '''
+import reshard
+copy_rows = reshard.copy_rows
+def lossy(conn, *args):
+    copy_rows(conn, *args)
+    conn.execute('DELETE FROM game_progress WHERE id = (SELECT MAX(id) FROM game_progress)')
+reshard.copy_rows = lossy
+reshard.main()
+'''
+
+
+def test_round_trip_through_three_shards(tmp_path):
+    env = dict(os.environ, DATABASE_PATH=str(tmp_path / 'game.db'), SHARD_PATH=str(tmp_path / 'game-{n}.db'),
+               PASSWORD_HASH_PROCESSES='0', PASSWORD_SCRYPT_N='16', SESSION_SECRET='reshard')
+
+    def run(*args, shards=1):
+        result = subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True,
+                                env=dict(env, SHARD_COUNT=str(shards)), timeout=120)
+        assert result.returncode == 0, result.stderr
+        return result.stdout
+
+    run('-c', SEED)
+    before = run('-c', TOTALS)
+    assert len(json.loads(before)[0]) == 12
+    assert '3 shard(s)' in run('reshard.py', '3')
+    assert {'game-0.db', 'game-1.db', 'game-2.db'} <= set(os.listdir(tmp_path))
+    assert run('-c', TOTALS, shards=3) == before
+    # A failed merge leaves both layouts as they were, and can be rerun
+    failed = subprocess.run([sys.executable, '-c', LOSE_A_ROW, '1'], cwd=ROOT, capture_output=True, text=True,
+                            env=dict(env, SHARD_COUNT='3'), timeout=120)
+    assert 'Checksum mismatch' in failed.stderr
+    assert not any(name.endswith('.resharding') for name in os.listdir(tmp_path))
+    assert run('-c', TOTALS, shards=3) == before
+    assert '1 shard(s)' in run('reshard.py', '1', shards=3)
+    assert not any(name.startswith('game-') and name.endswith('.db') for name in os.listdir(tmp_path))
+    assert run('-c', TOTALS) == before
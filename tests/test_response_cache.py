@@ -0,0 +1,133 @@
+import threading
+
+import pytest
+from response_cache import ResponseCache
+
+
+class SlowFill:
+    # A fill() that blocks until released, counting its calls
+    def __init__(self, body=b'body'):
+        self.body = body
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return self.body
+
+
+def in_threads(count, target):
+    results = [None] * count
+    errors = []
+
+    def run(n):
+        try:
+            results[n] = target()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_hits_until_invalidated():
+    cache = ResponseCache(ttl=60)
+    bodies = iter([b'one', b'two'])
+    fill = lambda: next(bodies)  # noqa: E731
+    assert cache.get(('board', 1), {'leaderboard'}, fill) == b'one'
+    assert cache.get(('board', 1), {'leaderboard'}, fill) == b'one'
+    cache.invalidate('progress:1')
+    assert cache.get(('board', 1), {'leaderboard'}, fill) == b'one'
+    cache.invalidate('leaderboard')
+    assert cache.get(('board', 1), {'leaderboard'}, fill) == b'two'
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_concurrent_misses_share_one_fill():
+    cache = ResponseCache(ttl=60)
+    fill = SlowFill()
+    leader, results, _ = in_threads(1, lambda: cache.get(('board',), {'leaderboard'}, fill))
+    assert fill.started.wait(5)
+    herd, herd_results, errors = in_threads(15, lambda: cache.get(('board',), {'leaderboard'}, fill))
+    while cache.coalesced < 15:
+        threading.Event().wait(0.001)
+    fill.release.set()
+    for thread in leader + herd:
+        thread.join(5)
+    assert fill.calls == 1
+    assert results + herd_results == [b'body'] * 16
+    assert (cache.misses, cache.coalesced, errors) == (1, 15, [])
+
+
+def test_invalidation_during_a_fill_detaches_it():
+    # A write landing while a fill runs: the fill may have read the old
+    # data, so it is neither stored nor shared with later requests
+    cache = ResponseCache(ttl=60)
+    stale = SlowFill(b'stale')
+    threads, results, _ = in_threads(1, lambda: cache.get(('board',), {'leaderboard'}, stale))
+    assert stale.started.wait(5)
+    cache.invalidate('leaderboard')
+    assert cache.get(('board',), {'leaderboard'}, lambda: b'fresh') == b'fresh'
+    stale.release.set()
+    threads[0].join(5)
+    assert results == [b'stale']
+    assert cache.get(('board',), {'leaderboard'}, lambda: b'other') == b'fresh'
+
+
+def test_fill_errors_reach_every_waiter_and_are_not_cached():
+    cache = ResponseCache(ttl=60)
+    release = threading.Event()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('database is locked')
+
+    leader, _, leader_errors = in_threads(1, lambda: cache.get(('board',), set(), failing))
+    assert started.wait(5)
+    herd, _, errors = in_threads(3, lambda: cache.get(('board',), set(), failing))
+    while cache.coalesced < 3:
+        threading.Event().wait(0.001)
+    release.set()
+    for thread in leader + herd:
+        thread.join(5)
+    assert len(leader_errors + errors) == 4
+    assert cache.get(('board',), set(), lambda: b'ok') == b'ok'
+
+
+def test_size_bound_evicts_least_recently_used():
+    cache = ResponseCache(ttl=60, max_bytes=10)
+    for n in range(3):
+        cache.get(('key', n), {f'tag{n}'}, lambda: b'x' * 4)
+    assert len(cache) == 2 and cache.evictions == 1
+    assert cache.get(('key', 2), set(), lambda: b'new') == b'xxxx'
+    assert cache.get(('key', 0), set(), lambda: b'new') == b'new'
+
+
+def test_ttl_zero_always_fills():
+    cache = ResponseCache(ttl=0)
+    calls = []
+    for _ in range(3):
+        cache.get(('board',), set(), lambda: calls.append(1) or b'body')
+    assert len(calls) == 3 and len(cache) == 0
+
+
+@pytest.mark.parametrize('path', ['/api/leaderboard', '/api/leaderboard/stack'])
+def test_progress_writes_invalidate_cached_boards(client, register, play, path):
+    user_id, headers = register()
+    client.get(path + '?limit=100')
+    assert client.get('/api/progress', headers=headers).get_json()['stats']['total_score'] == 0
+    response = client.post('/api/progress', headers=headers, json=play('stack', 3, time_taken=5))
+    assert response.status_code == 200
+    score = response.get_json()['score']
+    username = client.get('/api/session', headers=headers).get_json()['user']['username']
+    board = {entry['username']: entry['total_score'] for entry in client.get(path + '?limit=100').get_json()}
+    assert board[username] == score
+    progress = client.get('/api/progress', headers=headers).get_json()
+    assert progress['stats']['total_score'] == score
@@ -0,0 +1,90 @@
+import sqlite3
+import time
+
+from sessions import SessionStore
+
+
+def revocations_db():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''CREATE TABLE revoked_sessions (
+        id INTEGER PRIMARY KEY, session_id TEXT UNIQUE, expires INTEGER)''')
+    return conn
+
+
+def test_token_validates_in_another_worker():
+    token, session = SessionStore(secret=b'shared').issue(42, 'ada', 'ada@example.com')
+    other = SessionStore(secret=b'shared')
+    found = other.validate(token)
+    assert (found.user_id, found.expires, found.session_id) == (42, session.expires, session.session_id)
+    # The metadata is not in the token
+    assert found.username is None
+
+
+def test_forged_and_malformed_tokens_are_rejected():
+    store = SessionStore(secret=b'shared')
+    token, _ = store.issue(42)
+    user_id, expires, session_id, signature = token.split('.')
+    fresh = SessionStore(secret=b'shared')
+    assert fresh.validate(f'43.{expires}.{session_id}.{signature}') is None
+    assert fresh.validate(f'{user_id}.{int(expires, 16) + 3600:x}.{session_id}.{signature}') is None
+    assert fresh.validate(token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB')) is None
+    assert fresh.validate('not-a-token') is None
+    assert fresh.validate(f'{user_id}.{expires}.{session_id}.é') is None
+    assert SessionStore(secret=b'other').validate(token) is None
+    assert fresh.validate(token) is not None
+
+
+def test_expired_tokens_are_rejected():
+    store = SessionStore(secret=b'shared', ttl=-1)
+    token, _ = store.issue(42)
+    assert store.validate(token) is None
+    assert SessionStore(secret=b'shared').validate(token) is None
+
+
+def test_revocation_reaches_other_workers_on_refresh():
+    conn = revocations_db()
+    first = SessionStore(secret=b'shared')
+    second = SessionStore(secret=b'shared', refresh_interval=0)
+    token, session = first.issue(42)
+    assert second.validate(token) is not None
+
+    first.revoke(conn, session)
+    assert first.validate(token) is None
+    # Cached in the other worker until it reads the revocations
+    assert second.validate(token) is not None
+    assert second.refresh_due()
+    second.refresh(conn)
+    assert second.validate(token) is None
+
+
+def test_cache_is_bounded():
+    store = SessionStore(secret=b'shared', cache_size=2)
+    tokens = [store.issue(n)[0] for n in range(5)]
+    assert len(store._cache) == 2
+    # Evicted tokens still validate, by their signature
+    assert all(store.validate(token) is not None for token in tokens)
+    assert store.validate(tokens[0]).expires > time.time()
+
+
+def test_routes_need_a_valid_session(client, register):
+    user_id, headers = register()
+    assert client.get('/api/session', headers=headers).get_json()['user']['id'] == user_id
+    assert client.get('/api/session').status_code == 401
+    assert client.get('/api/progress', headers={'Authorization': 'Bearer nope'}).status_code == 401
+    assert client.get('/api/progress', headers={'Authorization': 'Bearer a.b.c.é'}).status_code == 401
+    assert client.post('/api/logout', headers=headers).status_code == 200
+    assert client.get('/api/session', headers=headers).status_code == 401
+
+
+def test_operator_routes_need_the_operator_key(client, operator):
+    for path in ('/api/export/progress', '/api/export/stats', '/api/metrics'):
+        assert client.get(path).status_code == 401
+        assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+        assert client.get(path, headers=operator).status_code == 200
+
+
+def test_operator_routes_are_disabled_without_a_key(client, operator, monkeypatch):
+    import app
+    monkeypatch.setattr(app, 'OPERATOR_KEY', '')
+    assert client.get('/api/export/stats', headers=operator).status_code == 403
+    assert client.get('/api/metrics', headers={'Authorization': 'Bearer '}).status_code == 403
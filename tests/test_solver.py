@@ -0,0 +1,60 @@
+import json
+
+import pytest
+from level_catalog import catalog
+from replay import verify
+from solver import HintCache, Unsolvable, solve
+
+
+def test_every_catalog_solution_replays_as_a_win():
+    for ds in catalog.data_structures:
+        for level in catalog.levels[ds]:
+            try:
+                log = solve(ds, level)
+            except Unsolvable:
+                continue
+            result = verify(ds, level['id'], log)
+            assert result.won and result.moves == len(log), (ds, level['id'], result)
+
+
+def test_solutions_are_shortest():
+    level = {'initial': ['A', 'B', 'C'], 'target': ['A'], 'operations': ['push', 'pop'], 'maxMoves': 5}
+    assert solve('stack', level) == [{'operation': 'pop'}, {'operation': 'pop'}]
+    level = {'initial': ['A', 'B'], 'target': ['B', 'C'], 'operations': ['enqueue', 'dequeue'], 'maxMoves': 5}
+    assert len(solve('queue', level)) == 2
+    # A win is only checked after a move
+    level = {'initial': ['A'], 'target': ['A'], 'operations': ['push', 'pop'], 'maxMoves': 5}
+    assert len(solve('stack', level)) == 2
+    with pytest.raises(Unsolvable):
+        solve('stack', {'initial': ['A'], 'target': ['B'], 'operations': ['pop'], 'maxMoves': 3})
+
+
+def test_hint_cache_is_bounded():
+    cache = HintCache(maxsize=2)
+    for n in range(3):
+        cache.put(n, n)
+    assert cache.get(0) is None and cache.get(2) == 2
+    assert len(cache) == 2 and (cache.hits, cache.misses) == (1, 1)
+
+
+def test_hints_follow_an_optimal_line(client):
+    [level] = [level for level in catalog.levels['stack'] if len(solve('stack', level)) >= 3][:1]
+    remaining = len(solve('stack', level))
+    state = level['initial']
+    while remaining:
+        body = client.get(f'/api/hint/stack/{level["id"]}?state={json.dumps(state)}').get_json()
+        assert body['moves_remaining'] == remaining
+        move = body['move']
+        state = state + [move['value']] if move['operation'] == 'push' else state[:-1]
+        remaining -= 1
+    assert state == level['target']
+
+
+def test_hint_errors(client):
+    assert client.get('/api/hint/stack/9999').status_code == 404
+    assert client.get('/api/hint/stack/1?state=nope').status_code == 400
+    for state in ([[1]], [{'a': 1}], [None], [True], [1.5], ['A'] * 100):
+        response = client.get(f'/api/hint/stack/1?state={json.dumps(state)}')
+        assert response.status_code == 400, state
+        assert 'state' in response.get_json()['error']
+    assert client.get('/api/hint/stack/1001').status_code == 200
@@ -0,0 +1,163 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import history
+import pytest
+from progress import parse_verified
+from shards import router
+import write_behind
+from write_behind import WriteBehindBuffer, normalize
+
+ATTEMPTS = [
+    # (data_structure, level_id, completed, score, time_taken, moves)
+    ('stack', 1, False, 0, 40, 0),
+    ('stack', 1, True, 80, 30, 6),
+    ('stack', 1, True, 95, 0, 4),
+    ('stack', 1, False, 10, 12, 9),
+    ('queue', 2, True, 70, 25, 5),
+]
+
+
+@pytest.fixture
+def buffer(tmp_path):
+    buffer = WriteBehindBuffer(enabled=True, flush_interval=60, journal_dir=str(tmp_path))
+    yield buffer
+    buffer.close()
+
+
+def rows(user_id):
+    with router.for_user(user_id).pool.connection() as conn:
+        progress = [tuple(row)[1:] for row in conn.execute(
+            'SELECT user_id, data_structure, level_id, completed, best_score, best_time, best_moves, attempts '
+            'FROM game_progress WHERE user_id = ? ORDER BY data_structure, level_id', (user_id,))]
+        stats = tuple(conn.execute(
+            'SELECT total_score, total_time, levels_completed, total_attempts FROM user_stats WHERE user_id = ?',
+            (user_id,)).fetchone())
+        days = [tuple(row) for row in conn.execute(
+            'SELECT day, COUNT(*) FROM attempts WHERE user_id = ? GROUP BY day ORDER BY day', (user_id,))]
+    return progress, stats, days
+
+
+def buffered(user_id):
+    return [normalize((user_id,) + attempt) for attempt in ATTEMPTS]
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_merged_flush_matches_direct_writes(client, register, play, buffer):
+    bodies = [
+        play('stack', 11, won=False, time_taken=40),
+        play('stack', 11, time_taken=30),
+        play('stack', 11, time_taken=0, detour=[['push', 'Z'], ['pop']]),
+        play('stack', 11, won=False, time_taken=12),
+        play('queue', 3, time_taken=25),
+    ]
+    direct_id, headers = register()
+    for body in bodies:
+        assert client.post('/api/progress', headers=headers, json=body).status_code == 200
+
+    # The route's buffered path: the same replayed attempts, normalized
+    merged_id, _ = register()
+    attempts = [normalize(attempt) for attempt in parse_verified([dict(body, user_id=merged_id) for body in bodies])]
+    buffer.add(attempts[:2])
+    buffer.add(attempts[2:])
+    buffer.flush()
+    assert rows(merged_id) == rows(direct_id)
+
+
+def test_buffered_reads_include_unflushed_attempts(register, buffer):
+    def read():
+        with router.for_user(user_id).pool.connection() as conn:
+            progress = buffer.read_progress(conn.cursor(), user_id)
+        # Ids and timestamps are only assigned by the flush
+        for row in progress['all_progress']:
+            del row['id'], row['last_played']
+        return progress
+
+    user_id, _ = register()
+    buffer.add(buffered(user_id))
+    before = read()
+    assert before['stats']['total_attempts'] == len(ATTEMPTS)
+    buffer.flush()
+    assert read() == before
+
+
+def test_attempts_keep_the_day_they_arrived(register, buffer, monkeypatch):
+    user_id, _ = register()
+    monkeypatch.setattr(history, 'today', lambda: 20000)
+    buffer.add(buffered(user_id)[:3])
+    monkeypatch.setattr(history, 'today', lambda: 20001)
+    buffer.add(buffered(user_id)[3:])
+    monkeypatch.setattr(history, 'today', lambda: 20002)
+    buffer.flush()
+    assert rows(user_id)[2] == [(20000, 3), (20001, 2)]
+
+
+def test_recovery_replays_dead_segments_once(register, buffer, tmp_path):
+    user_id, _ = register()
+    lines = [json.dumps([19990 + n, attempt]) for n, attempt in enumerate(buffered(user_id))]
+    # A segment from before days were journaled, and a torn last line
+    lines.append(json.dumps(list(buffered(user_id)[0])))
+    lines.append('["stack", 1')
+    segment = f'progress-{dead_pid()}-1-1.log'
+    (tmp_path / segment).write_text('\n'.join(lines) + '\n')
+
+    assert buffer.recover() == len(ATTEMPTS) + 1
+    progress, stats, days = rows(user_id)
+    assert stats[3] == len(ATTEMPTS) + 1
+    assert days[:len(ATTEMPTS)] == [(19990 + n, 1) for n in range(len(ATTEMPTS))]
+    assert days[-1] == (history.today(), 1)
+    assert os.listdir(tmp_path) == []
+
+    # The same segment again, as if the crash came after the commit
+    (tmp_path / segment).write_text('\n'.join(lines) + '\n')
+    assert buffer.recover() == 0
+    assert rows(user_id) == (progress, stats, days)
+
+
+def test_reused_pids_do_not_hide_dead_segments(register, buffer, tmp_path):
+    user_id, _ = register()
+    line = json.dumps([history.today(), buffered(user_id)[1]]) + '\n'
+    process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+    try:
+        start = write_behind._process_start(process.pid)
+        if start is None:
+            pytest.skip('no /proc')
+        live = [f'progress-{process.pid}-{start}-1.log', f'progress-{write_behind._identity()}-1.log']
+        # The same pids, but processes that started at another time
+        reused = [f'progress-{process.pid}-{start - 1}-1.log', f'progress-{os.getpid()}-0-1.log',
+                  f'progress-{os.getpid()}-1.log']
+        for name in live + reused:
+            (tmp_path / name).write_text(line)
+        assert buffer.recover() == len(reused)
+        assert sorted(os.listdir(tmp_path)) == sorted(live)
+        assert rows(user_id)[1][3] == len(reused)
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_running_workers_recover_dead_segments(register, tmp_path):
+    user_id, _ = register()
+    buffer = WriteBehindBuffer(enabled=True, flush_interval=60, journal_dir=str(tmp_path), recovery_interval=0.05)
+    try:
+        buffer.add(buffered(user_id)[:1])
+        (tmp_path / f'progress-{dead_pid()}-1-1.log').write_text(
+            json.dumps([history.today(), buffered(user_id)[1]]) + '\n')
+        deadline = time.monotonic() + 10
+        while rows(user_id)[1][3] < 1 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        # The dead segment, while this worker's own stays buffered
+        assert rows(user_id)[1][3] == 1
+        assert len(os.listdir(tmp_path)) == 1
+        buffer.flush()
+        assert rows(user_id)[1][3] == 2
+    finally:
+        buffer.close()
@@ -0,0 +1,549 @@
+"""Optional write-behind buffer for progress attempts (PROGRESS_WRITE_BEHIND=1).
+
+POST /api/progress is acknowledged once the attempt is in an in-process
+buffer. Attempts on the same (user_id, data_structure, level_id) are merged
+as they arrive, exactly as UPSERT_PROGRESS would apply them one after the
+other. A background thread writes everything out in one transaction (one
+per shard) when WRITE_BEHIND_FLUSH_SIZE rows are pending or
+WRITE_BEHIND_FLUSH_INTERVAL seconds after the oldest one arrived. So a burst
+of N requests costs one write lock and one commit instead of N.
+
+Durability:
+  * default: buffered attempts live only in memory. A clean shutdown
+    flushes them (atexit, which gunicorn workers run on SIGTERM). A crash
+    loses at most one flush interval of acknowledged attempts.
+  * WRITE_BEHIND_JOURNAL=<dir>: every attempt is appended to a journal
+    segment, with the day it arrived, before it is acknowledged. The flush transaction records the
+    segment name, so a segment whose flush committed is never replayed.
+    Segments left behind by a dead process are replayed at startup and,
+    every WRITE_BEHIND_RECOVERY_INTERVAL seconds (default 60; 0 turns it
+    off), by the flush thread of each running worker, so the segments of
+    a worker gunicorn replaced do not wait for a restart. A segment is
+    named after its process's pid and start time, so a reused pid does
+    not make a dead process look alive.
+  * WRITE_BEHIND_FSYNC=1 also fsyncs every append (survives power loss).
+
+get_progress() reads through the buffer, so a worker always returns the
+writes it has acknowledged. Other workers and the leaderboards see them
+after the flush. Attempts go into the history journal and rollups (see
+history.py) under the day they were acknowledged, not the day of the flush
+or of a crash recovery.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+import history
+import metrics
+from response_cache import response_cache
+from progress import UPDATE_USER_STATS, load_progress, stats_row, summarize_progress
+from shards import router
+
+PROGRESS_WRITE_BEHIND = os.environ.get('PROGRESS_WRITE_BEHIND', '0') == '1'
+FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', 0.1))
+FLUSH_SIZE = int(os.environ.get('WRITE_BEHIND_FLUSH_SIZE', 500))
+MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 50000))
+JOURNAL_DIR = os.environ.get('WRITE_BEHIND_JOURNAL')
+JOURNAL_FSYNC = os.environ.get('WRITE_BEHIND_FSYNC', '0') == '1'
+RECOVERY_INTERVAL = float(os.environ.get('WRITE_BEHIND_RECOVERY_INTERVAL', 60))
+
+# UPSERT_PROGRESS for a merged entry. A new row gets the values the first
+# attempt and its successors would have left (insert_time/insert_moves); an
+# existing row only takes the positive minimums, as each attempt would.
+UPSERT_MERGED_PROGRESS = '''
+    INSERT INTO game_progress
+        (user_id, data_structure, level_id, completed, best_score, best_time, best_moves, attempts)
+    VALUES (:user_id, :data_structure, :level_id, :completed, :best_score,
+            :insert_time, :insert_moves, :attempts)
+    ON CONFLICT(user_id, data_structure, level_id) DO UPDATE SET
+        completed = excluded.completed,
+        best_score = MAX(best_score, excluded.best_score),
+        best_time = CASE WHEN :min_time > 0 THEN MIN(best_time, :min_time) ELSE best_time END,
+        best_moves = CASE WHEN :min_moves > 0 THEN MIN(best_moves, :min_moves) ELSE best_moves END,
+        attempts = attempts + excluded.attempts,
+        last_played = CURRENT_TIMESTAMP
+'''
+
+log = logging.getLogger('write_behind')
+
+flushed_rows = metrics.registry.counter(
+    'progress_write_behind_rows_total', 'game_progress rows written by write-behind flushes.')
+flush_duration = metrics.registry.histogram(
+    'progress_write_behind_flush_seconds', 'Write-behind group commit latency.')
+
+
+def _positive(value):
+    return value if value > 0 else 0
+
+
+def _min_positive(a, b):
+    if a > 0 and b > 0:
+        return min(a, b)
+    return a if a > 0 else b
+
+
+def _integer(value, field):
+    # What the INTEGER column would store, so "3" and 3 merge as one row
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    raise ValueError(f'{field} must be a number')
+
+
+def _number(value, field):
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return value
+    raise ValueError(f'{field} must be a number')
+
+
+def normalize(attempt):
+    # Raises ValueError for values the buffer cannot merge like SQLite would
+    user_id, data_structure, level_id, completed, score, time_taken, moves = attempt
+    if not isinstance(data_structure, str):
+        raise ValueError('data_structure must be a string')
+    return (
+        _integer(user_id, 'user_id'),
+        data_structure,
+        _integer(level_id, 'level_id'),
+        1 if completed else 0,
+        _number(score, 'score'),
+        _number(time_taken, 'time_taken'),
+        _number(moves, 'moves'),
+    )
+
+
+class PendingProgress:
+    # The combined effect of consecutive attempts on one game_progress row
+    __slots__ = ('completed', 'best_score', 'insert_time', 'min_time',
+                 'insert_moves', 'min_moves', 'attempts')
+
+    def __init__(self, attempt):
+        _, _, _, completed, score, time_taken, moves = attempt
+        self.completed = completed
+        self.best_score = score
+        self.insert_time = time_taken
+        self.min_time = _positive(time_taken)
+        self.insert_moves = moves
+        self.min_moves = _positive(moves)
+        self.attempts = 1
+
+    def merge(self, later):
+        self.completed = later.completed
+        self.best_score = max(self.best_score, later.best_score)
+        if later.min_time > 0:
+            self.insert_time = min(self.insert_time, later.min_time)
+        self.min_time = _min_positive(self.min_time, later.min_time)
+        if later.min_moves > 0:
+            self.insert_moves = min(self.insert_moves, later.min_moves)
+        self.min_moves = _min_positive(self.min_moves, later.min_moves)
+        self.attempts += later.attempts
+
+    def params(self, user_id, data_structure, level_id):
+        return {
+            'user_id': user_id, 'data_structure': data_structure, 'level_id': level_id,
+            'completed': self.completed, 'best_score': self.best_score,
+            'insert_time': self.insert_time, 'min_time': self.min_time,
+            'insert_moves': self.insert_moves, 'min_moves': self.min_moves,
+            'attempts': self.attempts,
+        }
+
+    def apply_to(self, row):
+        # Python twin of UPSERT_MERGED_PROGRESS for an existing row
+        row['completed'] = self.completed
+        row['best_score'] = max(row['best_score'] or 0, self.best_score)
+        if self.min_time > 0 and row['best_time'] is not None:
+            row['best_time'] = min(row['best_time'], self.min_time)
+        if self.min_moves > 0 and row['best_moves'] is not None:
+            row['best_moves'] = min(row['best_moves'], self.min_moves)
+        row['attempts'] = (row['attempts'] or 0) + self.attempts
+
+    def new_row(self, user_id, data_structure, level_id):
+        return {
+            'id': None, 'user_id': user_id, 'data_structure': data_structure, 'level_id': level_id,
+            'completed': self.completed, 'best_score': self.best_score,
+            'best_time': self.insert_time, 'best_moves': self.insert_moves,
+            'attempts': self.attempts, 'last_played': None,
+        }
+
+
+class Layer:
+    # Merged attempts not yet committed: user_id -> {(ds, level_id): entry},
+    # plus the user_stats deltas they add.
+    def __init__(self):
+        self.users = {}
+        self.stats = {}
+        self.rows = 0
+        # user_id -> (day, attempt) in arrival order, for the attempts journal
+        self.attempts = {}
+        self.segments = []
+        # shard index -> whether its transaction applied this layer (False:
+        # the journal segment was already recorded there)
+        self.committed = {}
+
+    def add(self, attempt, day=None):
+        user_id, data_structure, level_id = attempt[:3]
+        entries = self.users.setdefault(user_id, {})
+        entry = PendingProgress(attempt)
+        current = entries.get((data_structure, level_id))
+        if current is None:
+            entries[(data_structure, level_id)] = entry
+            self.rows += 1
+        else:
+            current.merge(entry)
+        self.attempts.setdefault(user_id, []).append((history.today() if day is None else day, attempt))
+        score, time_taken, completed, attempts, _ = stats_row(attempt)
+        totals = self.stats.setdefault(user_id, [0, 0, 0, 0])
+        totals[0] += score
+        totals[1] += time_taken
+        totals[2] += completed
+        totals[3] += attempts
+
+
+class WriteBehindBuffer:
+    def __init__(self, enabled=PROGRESS_WRITE_BEHIND, flush_interval=FLUSH_INTERVAL,
+                 flush_size=FLUSH_SIZE, max_pending=MAX_PENDING,
+                 journal_dir=JOURNAL_DIR, fsync=JOURNAL_FSYNC, recovery_interval=RECOVERY_INTERVAL):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.journal_dir = journal_dir
+        self.fsync = fsync
+        self.recovery_interval = recovery_interval if journal_dir else 0
+        self._next_recovery = time.monotonic() + self.recovery_interval
+        self._cond = threading.Condition()
+        # Held while a flush commits and while a read merges the buffer,
+        # so a read never counts a row both in SQLite and in the buffer.
+        self._commit_lock = threading.Lock()
+        self._pending = Layer()
+        self._inflight = Layer()
+        self._oldest = None
+        self._journal = None
+        # shard index -> segment markers to delete with its next flush
+        self._forget = {}
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    # Write side
+
+    def add(self, attempts):
+        # Queue already-normalized attempts; blocks while the buffer is full.
+        with self._cond:
+            self._start()
+            while self._pending.rows >= self.max_pending and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError('Progress buffer is shut down')
+            day = history.today()
+            if self.journal_dir:
+                self._append_journal(attempts, day)
+            for attempt in attempts:
+                self._pending.add(attempt, day)
+            if self._oldest is None:
+                # Starts the flush-interval clock
+                self._oldest = time.monotonic()
+                self._cond.notify_all()
+            elif self._pending.rows >= self.flush_size:
+                self._cond.notify_all()
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        # First use in this process (or after a fork, which drops threads)
+        self._pid = os.getpid()
+        self._pending, self._inflight, self._journal = Layer(), Layer(), None
+        self._thread = threading.Thread(target=self._run, name='progress-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _append_journal(self, attempts, day):
+        if self._journal is None:
+            name = f'progress-{_identity()}-{time.time_ns()}.log'
+            self._journal = open(os.path.join(self.journal_dir, name), 'a', encoding='utf-8')
+            self._pending.segments.append(name)
+        self._journal.write(''.join(json.dumps([day, attempt]) + '\n' for attempt in attempts))
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due() and not self._recovery_due():
+                    self._cond.wait(self._wait_time())
+                if not self._due():
+                    batch = None
+                elif not self._pending.rows:
+                    return
+                else:
+                    # Swap under the condition; writers keep filling a fresh layer
+                    batch, self._pending, self._oldest = self._pending, Layer(), None
+                    if self._journal is not None:
+                        self._journal.close()
+                        self._journal = None
+                    self._inflight = batch
+                    self._cond.notify_all()
+            if batch is not None:
+                self._flush(batch)
+                continue
+            self._next_recovery = time.monotonic() + self.recovery_interval
+            try:
+                self.recover()
+            except Exception:
+                log.exception('Write-behind journal recovery failed')
+
+    def _due(self):
+        if self._closed or self._pending.rows >= self.flush_size:
+            return True
+        return self._oldest is not None and time.monotonic() - self._oldest >= self.flush_interval
+
+    def _recovery_due(self):
+        return self.recovery_interval and time.monotonic() >= self._next_recovery
+
+    def _wait_time(self):
+        waits = []
+        if self._oldest is not None:
+            waits.append(self.flush_interval - (time.monotonic() - self._oldest))
+        if self.recovery_interval:
+            waits.append(self._next_recovery - time.monotonic())
+        return max(0.0, min(waits)) if waits else None
+
+    def _flush(self, batch):
+        delay = 0.05
+        while True:
+            try:
+                elapsed = self._commit(batch, inflight=True)
+                break
+            except Exception as e:
+                # The batch stays in flight (and visible to reads) until it lands
+                log.error('Write-behind flush of %d rows failed, retrying: %s', batch.rows, e)
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+        self._after_commit(batch, elapsed)
+
+    def _commit(self, batch, inflight=False, skip_if_recorded=None):
+        # One transaction per shard the layer touches. Shards that committed
+        # before a failure are skipped when the flush is retried. Returns the
+        # elapsed time, or None if every shard had already applied the
+        # journal segment.
+        start = time.perf_counter()
+        with self._commit_lock:
+            for shard, user_ids in router.group(batch.users, user_id=lambda user_id: user_id).items():
+                if shard.index not in batch.committed:
+                    batch.committed[shard.index] = self._commit_shard(shard, batch, user_ids, skip_if_recorded)
+            if inflight:
+                with self._cond:
+                    self._inflight = Layer()
+        if not any(batch.committed.values()):
+            return None
+        return time.perf_counter() - start
+
+    def _commit_shard(self, shard, batch, user_ids, skip_if_recorded):
+        forget = self._forget.get(shard.index, [])
+        with shard.pool.transaction() as conn:
+            cursor = conn.cursor()
+            if skip_if_recorded is not None:
+                cursor.execute('SELECT 1 FROM write_behind_segments WHERE name = ?', (skip_if_recorded,))
+                if cursor.fetchone() is not None:
+                    return False
+            cursor.executemany('DELETE FROM write_behind_segments WHERE name = ?', [(name,) for name in forget])
+            cursor.executemany(
+                UPSERT_MERGED_PROGRESS,
+                [entry.params(user_id, ds, level_id)
+                 for user_id in user_ids
+                 for (ds, level_id), entry in batch.users[user_id].items()])
+            cursor.executemany(UPDATE_USER_STATS,
+                               [tuple(batch.stats[user_id]) + (user_id,) for user_id in user_ids])
+            by_day = {}
+            for user_id in user_ids:
+                for day, attempt in batch.attempts[user_id]:
+                    by_day.setdefault(day, []).append(attempt)
+            for day, attempts in by_day.items():
+                history.record(cursor, attempts, day)
+            cursor.executemany('INSERT OR IGNORE INTO write_behind_segments (name) VALUES (?)',
+                               [(name,) for name in batch.segments])
+            ranking_changes = shard.leaderboard.collect(
+                cursor, [(user_id, ds) for user_id in user_ids for ds, _ in batch.users[user_id]])
+            score_moves = shard.rank_index.collect(cursor, {user_id: batch.stats[user_id][0] for user_id in user_ids})
+        del forget[:]
+        shard.leaderboard.apply(ranking_changes)
+        shard.rank_index.apply(ranking_changes[0], score_moves)
+        response_cache.invalidate('leaderboard', *(f'progress:{user_id}' for user_id in user_ids))
+        return True
+
+    def _after_commit(self, batch, elapsed):
+        for name in batch.segments:
+            try:
+                os.unlink(os.path.join(self.journal_dir, name))
+            except FileNotFoundError:
+                pass
+            # The marker rows go with each shard's next flush, once the
+            # file is gone
+            for index in batch.committed:
+                self._forget.setdefault(index, []).append(name)
+        if elapsed is not None:
+            with metrics.registry.lock:
+                flushed_rows.inc((), batch.rows)
+                flush_duration.observe((), elapsed)
+
+    def close(self, timeout=30):
+        # Flush whatever is buffered and stop the thread.
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+            if thread.is_alive():
+                log.error('Write-behind buffer did not drain within %s s', timeout)
+
+    def flush(self):
+        # Block until everything queued so far is committed.
+        with self._cond:
+            if self._pending.rows:
+                self._oldest = time.monotonic() - self.flush_interval
+                self._cond.notify_all()
+            while (self._pending.rows or self._inflight.rows) and self._thread and self._thread.is_alive():
+                self._cond.wait(0.01)
+
+    # Read side
+
+    def read_progress(self, cursor, user_id):
+        # read_progress() plus this worker's acknowledged, unflushed attempts
+        if not self.enabled or not self._buffered(user_id):
+            return summarize_progress(*load_progress(cursor, user_id))
+        with self._commit_lock:
+            stats, rows = load_progress(cursor, user_id)
+            shard_index = router.for_user(user_id).index
+            with self._cond:
+                # A retried flush may already have committed this user's shard
+                layers = [(layer.users.get(user_id, {}), layer.stats.get(user_id))
+                          for layer in (self._inflight, self._pending)
+                          if shard_index not in layer.committed]
+                by_key = {(row['data_structure'], row['level_id']): row for row in rows}
+                for entries, totals in layers:
+                    for (ds, level_id), entry in entries.items():
+                        row = by_key.get((ds, level_id))
+                        if row is None:
+                            row = by_key[(ds, level_id)] = entry.new_row(user_id, ds, level_id)
+                            rows.append(row)
+                        else:
+                            entry.apply_to(row)
+                    if totals is not None and stats is not None:
+                        for field, delta in zip(('total_score', 'total_time', 'levels_completed',
+                                                 'total_attempts'), totals):
+                            stats[field] += delta
+        rows.sort(key=lambda row: (row['data_structure'], row['level_id']))
+        return summarize_progress(stats, rows)
+
+    def _buffered(self, user_id):
+        with self._cond:
+            return user_id in self._pending.users or user_id in self._inflight.users
+
+    # Crash recovery
+
+    def recover(self):
+        # Replay journal segments left by processes that are gone. Returns
+        # the number of attempts replayed.
+        if not self.journal_dir:
+            return 0
+        os.makedirs(self.journal_dir, exist_ok=True)
+        replayed = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            segment, _, owner = name.partition('.recovering-')
+            if not segment.startswith('progress-'):
+                continue
+            # progress-<pid>-<start>-<time>.log; older segments lack <start>
+            owner = owner or segment[len('progress-'):].rsplit('-', 1)[0]
+            if _alive(owner):
+                continue
+            claimed = f'{segment}.recovering-{_identity()}'
+            try:
+                # Renaming claims the segment; only one worker can win
+                os.rename(os.path.join(self.journal_dir, name), os.path.join(self.journal_dir, claimed))
+            except FileNotFoundError:
+                continue
+            layer = Layer()
+            layer.segments.append(segment)
+            with open(os.path.join(self.journal_dir, claimed), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        # [day, attempt]; segments from before days were
+                        # journaled hold the bare attempt
+                        record = json.loads(line)
+                        day, attempt = record if len(record) == 2 else (None, record)
+                        layer.add(normalize(attempt), day)
+                    except (ValueError, TypeError):
+                        # A torn last line from the crash
+                        continue
+            if layer.rows:
+                self._after_commit(layer, self._commit(layer, skip_if_recorded=segment))
+            os.unlink(os.path.join(self.journal_dir, claimed))
+            # Shards where its flush had committed before the crash skip it
+            replayed += sum(totals[3] for user_id, totals in layer.stats.items()
+                            if layer.committed.get(router.for_user(user_id).index))
+        if replayed:
+            log.warning('Replayed %d journaled progress attempts', replayed)
+        return replayed
+
+
+_identities = {}
+
+
+def _process_start(pid):
+    # When a process started, in clock ticks since boot, or None where
+    # /proc cannot tell
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+        # The command name may hold spaces; the fields after it do not
+        return int(stat.rsplit(b')', 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _identity():
+    # "<pid>-<start>" for this process; without /proc the start is the time
+    # this process first asked, which is just as unique
+    pid = os.getpid()
+    if pid not in _identities:
+        start = _process_start(pid)
+        _identities[pid] = f'{pid}-{time.time_ns() if start is None else start}'
+    return _identities[pid]
+
+
+def _alive(owner):
+    # owner is "<pid>-<start>", or a bare pid from older segments
+    pid, _, start = owner.partition('-')
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        # A bare pid or another start is an earlier process with our pid
+        return owner == _identity()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    current = _process_start(pid)
+    return not start or current is None or str(current) == start
+
+
+progress_buffer = WriteBehindBuffer()